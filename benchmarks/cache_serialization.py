@@ -0,0 +1,72 @@
+"""Compare the serialization of cached time series data with pickle.
+
+Usage: python -m benchmarks.cache_serialization [SIZES]
+
+SIZES is a comma-separated list of numbers of records; the default is
+52560,525600 (one and ten years of ten-minute data). For each size, it reads the data
+from the database and compares the size of the serialized data and the time it takes
+to serialize and deserialize it, using pickle (which is what Django's cache backends
+do with a dataframe) and using the format of enhydris.timeseries_cache with each
+available compression.
+"""
+
+import pickle
+from importlib.util import find_spec
+
+from django.test import override_settings
+
+from enhydris.timeseries_cache import deserialize, serialize
+
+from .common import best_time, get_sizes, print_row, timeseries_with_records
+
+
+def get_compressions():
+    result = [None, "zlib"]
+    if find_spec("lz4"):
+        result.append("lz4")
+    return result
+
+
+def benchmark_pickle(data):
+    pickled = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+    dump_time = best_time(lambda: pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+    load_time = best_time(lambda: pickle.loads(pickled))
+    return len(pickled), dump_time, load_time
+
+
+def benchmark_serialize(data, compression):
+    with override_settings(ENHYDRIS_CACHE_COMPRESSION=compression):
+        serialized = serialize(data)
+        dump_time = best_time(lambda: serialize(data))
+        load_time = best_time(lambda: deserialize(serialized))
+    return len(serialized), dump_time, load_time
+
+
+def main():
+    print_row("records", "format", "bytes", "dump (ms)", "load (ms)", "size ratio")
+    for size in get_sizes([52560, 525600]):
+        with timeseries_with_records(size) as timeseries:
+            data = timeseries._get_all_data_as_pd()
+        pickle_size, dump_time, load_time = benchmark_pickle(data)
+        print_row(
+            size,
+            "pickle",
+            pickle_size,
+            f"{dump_time * 1000:.1f}",
+            f"{load_time * 1000:.1f}",
+            "1.0x",
+        )
+        for compression in get_compressions():
+            nbytes, dump_time, load_time = benchmark_serialize(data, compression)
+            print_row(
+                size,
+                compression or "uncompressed",
+                nbytes,
+                f"{dump_time * 1000:.1f}",
+                f"{load_time * 1000:.1f}",
+                "{:.1f}x".format(pickle_size / nbytes),
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Functionality common to the benchmarks.
+
+The benchmarks use the same settings as ``manage.py``, so they need a database with
+TimescaleDB. Everything they write to the database is written inside a transaction
+that is rolled back at the end, so it is safe to run them on a development database.
+"""
+
+import sys
+import time
+from contextlib import contextmanager
+
+import django
+
+from enhydris import set_django_settings_module
+
+set_django_settings_module()
+django.setup()
+
+from django.db import connection, transaction  # NOQA isort:skip
+
+from model_mommy import mommy  # NOQA isort:skip
+
+from enhydris import models  # NOQA isort:skip
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def timeseries_with_records(nrecords, utc_offset=120):
+    """Create a ten-minute time series with nrecords records and yield it.
+
+    The records are generated by the database server, and one in a hundred of them is
+    flagged. The time series and its records are rolled back when the context
+    manager exits.
+    """
+    try:
+        with transaction.atomic():
+            timeseries = mommy.make(
+                models.Timeseries,
+                time_zone__utc_offset=utc_offset,
+                precision=2,
+                time_step="10min",
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    """
+                    INSERT INTO enhydris_timeseriesrecord
+                        (timeseries_id, "timestamp", value, flags)
+                    SELECT
+                        %s,
+                        '1990-01-01T00:00Z'::timestamptz + i * interval '10 minutes',
+                        random() * 100,
+                        CASE WHEN i %% 100 = 0 THEN 'DOUBTFUL' ELSE '' END
+                    FROM generate_series(0, %s - 1) AS i
+                    """,
+                    [timeseries.id, nrecords],
+                )
+            yield timeseries
+            raise _Rollback()
+    except _Rollback:
+        pass
+
+
+def best_time(func, repeat=3):
+    """Run func repeat times and return the best time in seconds."""
+    result = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if result is None or elapsed < result:
+            result = elapsed
+    return result
+
+
+def get_sizes(default):
+    """Return the list of sizes specified in the command line, or default."""
+    if len(sys.argv) > 1:
+        return [int(x) for x in sys.argv[1].split(",")]
+    return default
+
+
+def print_row(*items):
+    print("".join("{:>16}".format(item) for item in items))
@@ -0,0 +1,86 @@
+"""Compare reading compressed and uncompressed time series data from the database.
+
+Usage: python -m benchmarks.compression [SIZES]
+
+SIZES is a comma-separated list of numbers of records; the default is
+52560,525600,2628000 (one, ten and fifty years of ten-minute data). For each size, it
+measures TimeseriesRecord.get_dataframe() for the whole time series and for one
+month of it, before and after the chunks of the time series are compressed with
+TimescaleDB native compression (which needs TimescaleDB 2.0 or later), and shows the
+compression ratio of these chunks.
+"""
+
+import datetime as dt
+
+from django.db import connection
+
+from enhydris import compression
+
+from .common import best_time, get_sizes, models, print_row, timeseries_with_records
+
+
+def compress_timeseries(timeseries):
+    """Compress the chunks of the time series and return the compression ratio."""
+    with connection.cursor() as cursor:
+        compression.enable(cursor, "100 years")
+        cursor.execute(
+            """
+            SELECT compress_chunk(format('%%I.%%I', chunk_schema, chunk_name)::regclass)
+            FROM timescaledb_information.chunks
+            WHERE hypertable_name = 'enhydris_timeseriesrecord'
+                AND NOT is_compressed AND range_end > %s AND range_start <= %s
+            """,
+            [timeseries.start_date_utc, timeseries.end_date_utc],
+        )
+        chunks = [row[0].split(".")[-1] for row in cursor.fetchall()]
+        cursor.execute(
+            """
+            SELECT
+                SUM(before_compression_total_bytes),
+                SUM(after_compression_total_bytes)
+            FROM chunk_compression_stats('enhydris_timeseriesrecord')
+            WHERE chunk_name = ANY(%s)
+            """,
+            [chunks],
+        )
+        before, after = cursor.fetchone()
+    return before / after
+
+
+def time_reads(timeseries):
+    start_date = dt.datetime(1990, 6, 1, tzinfo=dt.timezone.utc)
+    end_date = dt.datetime(1990, 6, 30, 23, 59, tzinfo=dt.timezone.utc)
+    get_dataframe = models.TimeseriesRecord.get_dataframe
+    all_time = best_time(lambda: get_dataframe(timeseries))
+    month_time = best_time(lambda: get_dataframe(timeseries, start_date, end_date))
+    return all_time, month_time
+
+
+def main():
+    print_row(
+        "records",
+        "all (s)",
+        "all comp. (s)",
+        "month (ms)",
+        "month comp. (ms)",
+        "ratio",
+    )
+    for size in get_sizes([52560, 525600, 2628000]):
+        with timeseries_with_records(size) as timeseries:
+            timeseries.rebuild_summary()
+            timeseries.refresh_from_db()
+            all_time, month_time = time_reads(timeseries)
+            ratio = compress_timeseries(timeseries)
+            all_compressed_time, month_compressed_time = time_reads(timeseries)
+        print_row(
+            size,
+            f"{all_time:.3f}",
+            f"{all_compressed_time:.3f}",
+            f"{month_time * 1000:.1f}",
+            f"{month_compressed_time * 1000:.1f}",
+            f"{ratio:.1f}x",
+        )
+
+
+if __name__ == "__main__":
+    main()
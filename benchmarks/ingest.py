@@ -0,0 +1,53 @@
+"""Compare the ingestion of time series data into the database.
+
+Usage: python -m benchmarks.ingest [SIZES]
+
+SIZES is a comma-separated list of numbers of records; the default is
+10000,100000,525600 (the latter is ten years of ten-minute data). For each size, it
+compares the throughput of TimeseriesRecord.bulk_insert() when it uses "COPY ... FROM
+STDIN" with its fallback that uses bulk_create().
+"""
+
+import numpy as np
+import pandas as pd
+from htimeseries import HTimeseries
+
+from .common import best_time, get_sizes, models, print_row, timeseries_with_records
+
+
+def make_htimeseries(nrecords):
+    index = pd.date_range("1990-01-01 00:00", periods=nrecords, freq="10min")
+    flags = np.where(np.arange(nrecords) % 100 == 0, "DOUBTFUL", "")
+    data = pd.DataFrame(
+        {"value": np.random.rand(nrecords) * 100, "flags": flags},
+        columns=["value", "flags"],
+        index=index,
+    )
+    data.index.name = "date"
+    return HTimeseries(data)
+
+
+def time_insert(insert, htimeseries):
+    with timeseries_with_records(0) as timeseries:
+        return best_time(lambda: insert(timeseries, htimeseries.data), repeat=1)
+
+
+def main():
+    print_row("records", "bulk_create (s)", "copy (s)", "copy (rec/s)", "speedup")
+    for size in get_sizes([10000, 100000, 525600]):
+        htimeseries = make_htimeseries(size)
+        bulk_create_time = time_insert(
+            models.TimeseriesRecord._bulk_create, htimeseries
+        )
+        copy_time = time_insert(models.TimeseriesRecord._copy_insert, htimeseries)
+        print_row(
+            size,
+            f"{bulk_create_time:.3f}",
+            f"{copy_time:.3f}",
+            f"{size / copy_time:.0f}",
+            "{:.1f}x".format(bulk_create_time / copy_time),
+        )
+
+
+if __name__ == "__main__":
+    main()
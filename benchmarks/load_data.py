@@ -0,0 +1,45 @@
+"""Compare the loading of time series data from the database.
+
+Usage: python -m benchmarks.load_data [SIZES]
+
+SIZES is a comma-separated list of numbers of records; the default is
+10000,1000000,10000000. For each size, it compares TimeseriesRecord.get_dataframe()
+with the loader that creates a model instance per record (which is what Enhydris used
+to do).
+"""
+
+import pandas as pd
+
+from .common import best_time, get_sizes, print_row, timeseries_with_records
+
+
+def load_with_orm(timeseries):
+    tzinfo = timeseries.time_zone.as_tzinfo
+    data = {"value": [], "flags": []}
+    index = []
+    for record in timeseries.timeseriesrecord_set.all().order_by("timestamp"):
+        timestamp = record.timestamp.astimezone(tzinfo).replace(tzinfo=None)
+        index.append(timestamp)
+        data["value"].append(record.value)
+        data["flags"].append(record.flags)
+    result = pd.DataFrame(data=data, columns=["value", "flags"], index=index)
+    result.index.name = "date"
+    return result
+
+
+def load_columnar(timeseries):
+    return timeseries._get_all_data_as_pd()
+
+
+def main():
+    print_row("records", "orm (s)", "columnar (s)", "speedup")
+    for size in get_sizes([10000, 1000000, 10000000]):
+        with timeseries_with_records(size) as timeseries:
+            orm_time = best_time(lambda: load_with_orm(timeseries), repeat=1)
+            columnar_time = best_time(lambda: load_columnar(timeseries))
+        speedup = "{:.1f}x".format(orm_time / columnar_time)
+        print_row(size, f"{orm_time:.3f}", f"{columnar_time:.3f}", speedup)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ from io import TextIOWrapper
 
 from django import forms
 from django.conf import settings
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.db.models import Q, TextField
 from django.utils.translation import ugettext_lazy as _
 
@@ -103,6 +103,20 @@ class TimeseriesInlineAdminForm(forms.ModelForm):
         initial="APPEND",
         choices=(
             ("APPEND", _("Append this file's data to the already existing")),
+            (
+                "MERGE",
+                _(
+                    "Merge this file's data with the already existing, replacing "
+                    "records with the same date"
+                ),
+            ),
+            (
+                "REPLACE_PERIOD",
+                _(
+                    "Replace the already existing data in the period covered by "
+                    "this file with this file's data"
+                ),
+            ),
             (
                 "REPLACE",
                 _("Discard any already existing data and replace them with this file"),
@@ -167,6 +181,9 @@ class TimeseriesInlineAdminForm(forms.ModelForm):
                 )
             )
 
+    # The result of merge_data() if data has been merged, for StationAdmin to report
+    merge_result = None
+
     def save(self, *args, **kwargs):
         result = super().save(*args, **kwargs)
         if self.cleaned_data.get("data") is not None:
@@ -177,9 +194,26 @@ class TimeseriesInlineAdminForm(forms.ModelForm):
         data = TextIOWrapper(self.cleaned_data["data"], encoding="utf-8", newline="\n")
         if self.cleaned_data["replace_or_append"] == "APPEND":
             self.instance.append_data(data)
+        elif self.cleaned_data["replace_or_append"] == "MERGE":
+            self.merge_result = self.instance.merge_data(data)
+        elif self.cleaned_data["replace_or_append"] == "REPLACE_PERIOD":
+            self._replace_period(data)
         else:
             self.instance.set_data(data)
 
+    def _replace_period(self, data):
+        ahtimeseries = HTimeseries(data)
+        if not len(ahtimeseries.data):
+            return
+        tzinfo = self.instance.time_zone.as_tzinfo
+        start_date = ahtimeseries.data.index.min().to_pydatetime()
+        end_date = ahtimeseries.data.index.max().to_pydatetime()
+        self.instance.replace_range(
+            start_date.replace(tzinfo=tzinfo),
+            end_date.replace(tzinfo=tzinfo),
+            ahtimeseries,
+        )
+
 
 class TimeseriesInline(InlinePermissionsMixin, nested_admin.NestedStackedInline):
     form = TimeseriesInlineAdminForm
@@ -284,3 +318,22 @@ class StationAdmin(ObjectPermissionsModelAdmin, nested_admin.NestedModelAdmin):
         if obj.creator is None:
             obj.creator = request.user
         super().save_model(request, obj, form, change)
+
+    def save_formset(self, request, form, formset, change):
+        super().save_formset(request, form, formset, change)
+        for inline_form in formset.forms:
+            merge_result = getattr(inline_form, "merge_result", None)
+            if merge_result is None:
+                continue
+            messages.add_message(
+                request,
+                messages.INFO,
+                _(
+                    "Time series {}: {} records inserted, {} updated, {} unchanged"
+                ).format(
+                    inline_form.instance,
+                    merge_result["inserted"],
+                    merge_result["updated"],
+                    merge_result["unchanged"],
+                ),
+            )
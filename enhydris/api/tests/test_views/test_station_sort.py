@@ -1,3 +1,4 @@
+from io import StringIO
 from unittest.mock import patch
 
 from rest_framework.test import APITestCase
@@ -39,6 +40,23 @@ class StationSortByReverseNameTestCase(APITestCase):
         self.assertEqual(self.response.json()["results"][0]["name"], "Rivendell")
 
 
+class StationSortByLastUpdateTestCase(APITestCase):
+    def setUp(self):
+        for name, datestr in (("Rivendell", "2019-01-01"), ("Hobbiton", "2018-01-01")):
+            station = mommy.make(models.Station, name=name)
+            timeseries = mommy.make(
+                models.Timeseries, gentity=station, time_zone__utc_offset=0
+            )
+            timeseries.set_data(StringIO(f"{datestr} 00:00,0,\n"))
+        self.response = self.client.get("/api/stations/?sort=-last_update")
+
+    def test_status_code(self):
+        self.assertEqual(self.response.status_code, 200)
+
+    def test_rivendell_is_first(self):
+        self.assertEqual(self.response.json()["results"][0]["name"], "Rivendell")
+
+
 class StationSortWithInvalidAndDuplicateFieldsTestCase(APITestCase):
     @patch(
         "django.db.models.query.QuerySet.order_by",
@@ -1,13 +1,15 @@
 from datetime import datetime
-from io import StringIO
-from unittest.mock import patch
+from importlib.util import find_spec
+from io import BytesIO, StringIO
+from unittest import skipUnless
+from unittest.mock import ANY, patch
+from zipfile import ZipFile
 
 from django.contrib.auth.models import User
 from django.test.utils import override_settings
 from rest_framework.test import APITestCase
 
 import iso8601
-import pandas as pd
 from htimeseries import HTimeseries
 from model_mommy import mommy
 
@@ -32,7 +34,7 @@ class Tsdata404TestCase(APITestCase):
 
 
 @override_settings(ENHYDRIS_OPEN_CONTENT=False)
-@patch("enhydris.models.Timeseries.get_data", return_value=HTimeseries())
+@patch("enhydris.models.Timeseries.iter_data", return_value=[])
 class TsdataGetPermissionsTestCase(APITestCase):
     def setUp(self):
         station = mommy.make(models.Station)
@@ -56,12 +58,6 @@ class TsdataGetPermissionsTestCase(APITestCase):
 
 class TimeseriesDataMixin:
     def create_timeseries(self):
-        self.htimeseries = HTimeseries()
-        self.htimeseries.data = pd.DataFrame(
-            index=[datetime(2017, 11, 23, 17, 23), datetime(2018, 11, 25, 1, 0)],
-            data={"value": [1.0, 2.0], "flags": ["", ""]},
-            columns=["value", "flags"],
-        )
         self.station = mommy.make(models.Station)
         self.timeseries = mommy.make(
             models.Timeseries,
@@ -70,19 +66,18 @@ class TimeseriesDataMixin:
             time_zone__utc_offset=120,
             precision=2,
         )
+        self.timeseries.set_data(StringIO("2017-11-23 17:23,1,\n2018-11-25 01:00,2,\n"))
 
 
 @override_settings(ENHYDRIS_OPEN_CONTENT=True)
 class GetDataTestCase(APITestCase, TimeseriesDataMixin):
     def setUp(self):
         self.create_timeseries()
-        p = patch("enhydris.models.Timeseries.get_data", return_value=self.htimeseries)
-        with p:
-            self.response = self.client.get(
-                "/api/stations/{}/timeseries/{}/data/".format(
-                    self.station.id, self.timeseries.id
-                )
+        self.response = self.client.get(
+            "/api/stations/{}/timeseries/{}/data/".format(
+                self.station.id, self.timeseries.id
             )
+        )
 
     def test_status_code(self):
         self.assertEqual(self.response.status_code, 200)
@@ -91,10 +86,9 @@ class GetDataTestCase(APITestCase, TimeseriesDataMixin):
         self.assertEqual(self.response["Content-Type"], "text/csv; charset=utf-8")
 
     def test_response_content(self):
-        self.assertTrue(
-            self.response.content.decode().endswith(
-                "2017-11-23 17:23,1.000000,\r\n2018-11-25 01:00,2.000000,\r\n"
-            )
+        self.assertEqual(
+            self.response.getvalue().decode(),
+            "2017-11-23 17:23,1.00,\r\n2018-11-25 01:00,2.00,\r\n",
         )
 
 
@@ -103,62 +97,303 @@ class GetDataInVariousFormatsTestCase(APITestCase, TimeseriesDataMixin):
     def setUp(self):
         super().setUp()
         self.create_timeseries()
-        self.get_data_patch = patch(
-            "enhydris.models.Timeseries.get_data", return_value=self.htimeseries
-        )
         self.base_url = "/api/stations/{}/timeseries/{}/data/".format(
             self.station.id, self.timeseries.id
         )
 
     def test_response_content_hts_version_2(self):
-        with self.get_data_patch:
-            response = self.client.get(self.base_url + "?fmt=hts2")
-        self.assertTrue(response.content.decode().startswith("Version=2\r\n"))
+        response = self.client.get(self.base_url + "?fmt=hts2")
+        self.assertTrue(response.getvalue().decode().startswith("Version=2\r\n"))
 
     def test_response_headers_hts_version_2(self):
-        with self.get_data_patch:
-            response = self.client.get(self.base_url + "?fmt=hts2")
+        response = self.client.get(self.base_url + "?fmt=hts2")
         self.assertEqual(
             response["Content-Type"], "text/vnd.openmeteo.timeseries; charset=utf-8"
         )
         self.assertEqual(response["Content-Disposition"], 'inline; filename="42.hts"')
 
     def test_response_content_hts_version_5(self):
-        with self.get_data_patch:
-            response = self.client.get(self.base_url + "?fmt=hts")
-        self.assertTrue(response.content.decode().startswith("Count=2\r\n"))
+        response = self.client.get(self.base_url + "?fmt=hts")
+        content = response.getvalue().decode()
+        self.assertIn("\r\nCount=2\r\n", content)
+        self.assertTrue(
+            content.endswith(
+                "\r\n\r\n2017-11-23 17:23,1.00,\r\n2018-11-25 01:00,2.00,\r\n"
+            )
+        )
 
     def test_response_headers_hts_version_5(self):
-        with self.get_data_patch:
-            response = self.client.get(self.base_url + "?fmt=hts")
+        response = self.client.get(self.base_url + "?fmt=hts")
         self.assertEqual(
             response["Content-Type"], "text/vnd.openmeteo.timeseries; charset=utf-8"
         )
         self.assertEqual(response["Content-Disposition"], 'inline; filename="42.hts"')
 
     def test_response_content_csv(self):
-        with self.get_data_patch:
-            response = self.client.get(self.base_url + "?fmt=csv")
-        self.assertTrue(response.content.decode().startswith("2017-11-23 17:23,"))
+        response = self.client.get(self.base_url + "?fmt=csv")
+        self.assertTrue(response.getvalue().decode().startswith("2017-11-23 17:23,"))
 
     def test_response_headers_csv(self):
-        with self.get_data_patch:
-            response = self.client.get(self.base_url + "?fmt=csv")
+        response = self.client.get(self.base_url + "?fmt=csv")
         self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
         self.assertEqual(response["Content-Disposition"], 'inline; filename="42.csv"')
 
     def test_response_content_csv_default(self):
-        with self.get_data_patch:
-            response = self.client.get(self.base_url)
-        self.assertTrue(response.content.decode().startswith("2017-11-23 17:23,"))
+        response = self.client.get(self.base_url)
+        self.assertTrue(response.getvalue().decode().startswith("2017-11-23 17:23,"))
 
     def test_response_headers_csv_default(self):
-        with self.get_data_patch:
-            response = self.client.get(self.base_url)
+        response = self.client.get(self.base_url)
         self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
         self.assertEqual(response["Content-Disposition"], 'inline; filename="42.csv"')
 
 
+@override_settings(ENHYDRIS_OPEN_CONTENT=True)
+class AggregateTestCase(APITestCase):
+    def setUp(self):
+        station = mommy.make(models.Station)
+        self.timeseries = mommy.make(
+            models.Timeseries,
+            id=42,
+            gentity=station,
+            time_zone__utc_offset=120,
+            precision=2,
+        )
+        self.timeseries.set_data(
+            StringIO(
+                "2017-11-23 17:23,1,\n" "2017-11-23 18:23,2,\n" "2017-11-24 17:23,4,\n"
+            )
+        )
+        self.url = f"/api/stations/{station.id}/timeseries/42/aggregate/"
+
+    def test_csv(self):
+        response = self.client.get(self.url + "?step=D&fn=mean")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertEqual(
+            response.content.decode(),
+            "2017-11-23 00:00,1.50,\r\n2017-11-24 00:00,4.00,\r\n",
+        )
+
+    def test_csv_with_many_functions(self):
+        response = self.client.get(self.url + "?step=D&fn=min,max,count")
+        self.assertEqual(
+            response.content.decode(),
+            "2017-11-23 00:00,1.00,2.00,2\r\n2017-11-24 00:00,4.00,4.00,1\r\n",
+        )
+
+    def test_hts(self):
+        response = self.client.get(self.url + "?step=D&fn=max&fmt=hts")
+        content = response.content.decode()
+        self.assertIn("Time_step=D\r\n", content)
+        self.assertTrue(content.endswith("2017-11-24 00:00,4.00,\r\n"))
+
+    def test_hts_with_many_functions(self):
+        response = self.client.get(self.url + "?step=D&fn=min,max&fmt=hts")
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_step(self):
+        response = self.client.get(self.url + "?step=W&fn=mean")
+        self.assertContains(response, "not a valid", status_code=400)
+
+
+@override_settings(ENHYDRIS_OPEN_CONTENT=True)
+class ChartTestCase(APITestCase):
+    def setUp(self):
+        station = mommy.make(models.Station)
+        self.timeseries = mommy.make(
+            models.Timeseries,
+            id=42,
+            gentity=station,
+            time_zone__utc_offset=120,
+            precision=2,
+        )
+        self.timeseries.set_data(
+            StringIO(
+                "2017-11-23 17:23,1,\n"
+                "2017-11-23 18:23,,MISS\n"
+                "2017-11-24 17:23,4,\n"
+                "2018-01-01 00:00,3,\n"
+            )
+        )
+        self.url = f"/api/stations/{station.id}/timeseries/42/chart/"
+
+    def test_all(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            {
+                "data": [
+                    [1511457780000, 1.0],
+                    [1511544180000, 4.0],
+                    [1514764800000, 3.0],
+                ]
+            },
+        )
+
+    def test_range(self):
+        response = self.client.get(
+            self.url + "?start_date=2017-11-24 00:00&end_date=2017-12-31 23:59"
+        )
+        self.assertEqual(response.json(), {"data": [[1511544180000, 4.0]]})
+
+    def test_points(self):
+        response = self.client.get(self.url + "?points=2")
+        self.assertEqual(
+            response.json(), {"data": [[1511457780000, 1.0], [1511544180000, 4.0]]}
+        )
+
+    def test_invalid_method(self):
+        response = self.client.get(self.url + "?method=average")
+        self.assertContains(response, "not a valid", status_code=400)
+
+    @override_settings(ENHYDRIS_OPEN_CONTENT=False)
+    def test_anonymous_user_is_denied(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(ENHYDRIS_OPEN_CONTENT=True)
+class StatsTestCase(APITestCase):
+    def setUp(self):
+        station = mommy.make(models.Station)
+        self.timeseries = mommy.make(
+            models.Timeseries,
+            id=42,
+            gentity=station,
+            time_zone__utc_offset=120,
+            precision=2,
+        )
+        self.timeseries.set_data(
+            StringIO(
+                "2017-11-23 17:23,350,\n"
+                "2017-11-23 18:23,,MISS\n"
+                "2017-11-24 17:23,10,\n"
+                "2018-01-01 00:00,100,\n"
+            )
+        )
+        self.url = f"/api/stations/{station.id}/timeseries/42/stats/"
+
+    def test_all(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            {
+                "count": 3,
+                "min": 10.0,
+                "min_date": "2017-11-24 17:23",
+                "max": 350.0,
+                "max_date": "2017-11-23 17:23",
+                "sum": 460.0,
+                "mean": 460 / 3,
+                "last": 100.0,
+                "last_date": "2018-01-01 00:00",
+            },
+        )
+
+    def test_range(self):
+        response = self.client.get(
+            self.url + "?start_date=2017-11-24 00:00&end_date=2017-12-31 23:59"
+        )
+        self.assertEqual(response.json()["count"], 1)
+        self.assertEqual(response.json()["mean"], 10)
+
+    def test_vector(self):
+        response = self.client.get(self.url + "?vector=true&end_date=2017-12-31")
+        self.assertAlmostEqual(response.json()["vector_mean"], 0)
+        self.assertEqual(response.json()["sectors"], [2, 0, 0, 0, 0, 0, 0, 0])
+
+    def test_empty_range(self):
+        response = self.client.get(self.url + "?start_date=2019-01-01")
+        self.assertEqual(response.json()["count"], 0)
+        self.assertIsNone(response.json()["mean"])
+
+    def test_infinite_value(self):
+        self.timeseries.append_data(StringIO("2018-01-02 00:00,inf,\n"))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 3)
+        self.assertEqual(response.json()["max"], 350)
+
+    @override_settings(ENHYDRIS_OPEN_CONTENT=False)
+    def test_anonymous_user_is_denied(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(ENHYDRIS_OPEN_CONTENT=True)
+class MultiDataTestCase(APITestCase):
+    def setUp(self):
+        self.station = mommy.make(models.Station)
+        self.timeseries1 = mommy.make(
+            models.Timeseries,
+            id=42,
+            gentity=self.station,
+            time_zone__utc_offset=120,
+            precision=2,
+        )
+        self.timeseries1.set_data(
+            StringIO("2017-11-23 17:20,1,\n2017-11-23 17:30,,MISS\n")
+        )
+        self.timeseries2 = mommy.make(
+            models.Timeseries,
+            id=43,
+            gentity=self.station,
+            time_zone__utc_offset=60,
+            precision=0,
+        )
+        self.timeseries2.set_data(
+            StringIO("2017-11-23 16:30,2,\n2017-11-23 16:40,3,\n")
+        )
+        self.url = f"/api/stations/{self.station.id}/timeseries/multi-data/"
+
+    def test_csv(self):
+        response = self.client.get(self.url + "?ids=42,43")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertEqual(
+            response.content.decode(),
+            "date,42,42_flags,43,43_flags\r\n"
+            "2017-11-23 17:20,1.00,,,\r\n"
+            "2017-11-23 17:30,,MISS,2,\r\n"
+            "2017-11-23 17:40,,,3,\r\n",
+        )
+
+    def test_range_in_time_zone_of_first_time_series(self):
+        response = self.client.get(self.url + "?ids=43,42&start_date=2017-11-23 16:30")
+        self.assertEqual(
+            response.content.decode(),
+            "date,43,43_flags,42,42_flags\r\n"
+            "2017-11-23 16:30,2,,,MISS\r\n"
+            "2017-11-23 16:40,3,,,\r\n",
+        )
+
+    def test_hts(self):
+        response = self.client.get(self.url + "?ids=42,43&fmt=hts")
+        self.assertEqual(response["Content-Type"], "application/zip")
+        with ZipFile(BytesIO(response.content)) as zipfile:
+            self.assertEqual(zipfile.namelist(), ["42.hts", "43.hts"])
+            content = zipfile.read("43.hts").decode()
+        self.assertIn("Timezone=", content)
+        self.assertTrue(content.endswith("2017-11-23 16:40,3,\r\n"))
+
+    def test_invalid_ids(self):
+        response = self.client.get(self.url + "?ids=42,x")
+        self.assertEqual(response.status_code, 400)
+
+    def test_time_series_of_other_station(self):
+        mommy.make(models.Timeseries, id=44)
+        response = self.client.get(self.url + "?ids=42,44")
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(ENHYDRIS_OPEN_CONTENT=False)
+    def test_anonymous_user_is_denied(self):
+        response = self.client.get(self.url + "?ids=42,43")
+        self.assertEqual(response.status_code, 401)
+
+
 class TsdataPostTestCase(APITestCase):
     @patch("enhydris.models.Timeseries.append_data")
     def setUp(self, m):
@@ -189,6 +424,80 @@ class TsdataPostTestCase(APITestCase):
         )
 
 
+class TsdataPostMergeTestCase(APITestCase):
+    def setUp(self):
+        user = mommy.make(User, username="admin", is_superuser=True)
+        station = mommy.make(models.Station)
+        self.timeseries = mommy.make(
+            models.Timeseries, gentity=station, time_zone__utc_offset=0, precision=2
+        )
+        self.timeseries.set_data(StringIO("2017-11-23 17:23,1,\n"))
+        self.client.force_authenticate(user=user)
+        self.url = f"/api/stations/{station.id}/timeseries/{self.timeseries.id}/data/"
+
+    def test_merge(self):
+        response = self.client.post(
+            self.url,
+            data={
+                "mode": "merge",
+                "timeseries_records": (
+                    "2016-11-25 01:00,2.000000,\r\n2017-11-23 17:23,1.5,\r\n"
+                ),
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"inserted": 1, "updated": 1, "unchanged": 0})
+        self.assertEqual(list(self.timeseries.get_data().data["value"]), [2.0, 1.5])
+
+    def test_unknown_mode(self):
+        response = self.client.post(
+            self.url,
+            data={"mode": "nonsense", "timeseries_records": "2018-11-25 01:00,2,\r\n"},
+        )
+        self.assertContains(response, "Unknown mode", status_code=400)
+
+
+class TsdataPostReplaceTestCase(APITestCase):
+    def setUp(self):
+        user = mommy.make(User, username="admin", is_superuser=True)
+        station = mommy.make(models.Station)
+        self.timeseries = mommy.make(
+            models.Timeseries, gentity=station, time_zone__utc_offset=0, precision=2
+        )
+        self.timeseries.set_data(
+            StringIO("2017-11-23 17:23,1,\n2017-11-23 17:33,2,\n2017-11-23 17:43,3,\n")
+        )
+        self.client.force_authenticate(user=user)
+        self.url = f"/api/stations/{station.id}/timeseries/{self.timeseries.id}/data/"
+
+    def test_replace(self):
+        response = self.client.post(
+            self.url,
+            data={
+                "mode": "replace",
+                "start_date": "2017-11-23 17:30",
+                "end_date": "2017-11-23 17:40",
+                "timeseries_records": "2017-11-23 17:35,4,\r\n",
+            },
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(
+            list(self.timeseries.get_data().data["value"]), [1.0, 4.0, 3.0]
+        )
+
+    def test_replace_without_end_date(self):
+        response = self.client.post(
+            self.url,
+            data={
+                "mode": "replace",
+                "start_date": "2017-11-23 17:30",
+                "timeseries_records": "2017-11-23 17:35,4,\r\n",
+            },
+        )
+        self.assertContains(response, "requires a valid", status_code=400)
+        self.assertEqual(len(self.timeseries.get_data().data), 3)
+
+
 @override_settings(ENHYDRIS_USERS_CAN_ADD_CONTENT=True)
 class TsdataPostAuthorizationTestCase(APITestCase):
     def setUp(self):
@@ -274,6 +583,24 @@ class TsdataPostDuplicateTimestampsTestCase(APITestCase):
         )
 
 
+class TsdataPostExistingTimestampsTestCase(APITestCase):
+    @patch("enhydris.models.Timeseries._check_new_data_is_newer")
+    def setUp(self, m):
+        user = mommy.make(User, username="admin", is_superuser=True)
+        station = mommy.make(models.Station)
+        tz = mommy.make(models.TimeZone, code="EET", utc_offset=120)
+        timeseries = mommy.make(models.Timeseries, gentity=station, time_zone=tz)
+        timeseries.set_data(StringIO("2018-11-23 17:23,1.000000,\r\n"))
+        self.client.force_authenticate(user=user)
+        self.response = self.client.post(
+            f"/api/stations/{station.id}/timeseries/{timeseries.id}/data/",
+            data={"timeseries_records": "2018-11-23 17:23,2.000000,\r\n"},
+        )
+
+    def test_status_code(self):
+        self.assertEqual(self.response.status_code, 400)
+
+
 @override_settings(ENHYDRIS_OPEN_CONTENT=True)
 class TsdataStartAndEndDateTestCase(APITestCase):
     """Test that there's no aware/naive date confusion.
@@ -287,8 +614,8 @@ class TsdataStartAndEndDateTestCase(APITestCase):
         self.tz = mommy.make(models.TimeZone, code="EET", utc_offset=120)
         self.timeseries = mommy.make(models.Timeseries, time_zone=self.tz, precision=2)
 
-    @patch("enhydris.models.Timeseries.get_data")
-    def test_called_get_data_with_proper_start_date(self, m):
+    @patch("enhydris.models.Timeseries.iter_data", return_value=[])
+    def test_called_iter_data_with_proper_start_date(self, m):
         self.response = self.client.get(
             "/api/stations/{}/timeseries/{}/data/?start_date=2005-08-23T19:54".format(
                 self.timeseries.gentity.id, self.timeseries.id
@@ -297,10 +624,12 @@ class TsdataStartAndEndDateTestCase(APITestCase):
         m.assert_called_once_with(
             start_date=datetime(2005, 8, 23, 19, 54, tzinfo=self.tz.as_tzinfo),
             end_date=None,
+            format=HTimeseries.TEXT,
+            version=ANY,
         )
 
-    @patch("enhydris.models.Timeseries.get_data")
-    def test_called_get_data_with_proper_end_date(self, m):
+    @patch("enhydris.models.Timeseries.iter_data", return_value=[])
+    def test_called_iter_data_with_proper_end_date(self, m):
         self.response = self.client.get(
             "/api/stations/{}/timeseries/{}/data/?end_date=2005-08-23T19:54".format(
                 self.timeseries.gentity.id, self.timeseries.id
@@ -309,6 +638,8 @@ class TsdataStartAndEndDateTestCase(APITestCase):
         m.assert_called_once_with(
             start_date=None,
             end_date=datetime(2005, 8, 23, 19, 54, tzinfo=self.tz.as_tzinfo),
+            format=HTimeseries.TEXT,
+            version=ANY,
         )
 
 
@@ -318,23 +649,156 @@ class TsdataInvalidStartOrEndDateTestCase(APITestCase):
         self.tz = mommy.make(models.TimeZone, code="EET", utc_offset=120)
         self.timeseries = mommy.make(models.Timeseries, time_zone=self.tz, precision=2)
 
-    @patch("enhydris.models.Timeseries.get_data")
+    @patch("enhydris.models.Timeseries.iter_data", return_value=[])
     def test_invalid_start_date(self, m):
         self.response = self.client.get(
             "/api/stations/{}/timeseries/{}/data/?start_date=hello".format(
                 self.timeseries.gentity.id, self.timeseries.id
             )
         )
-        m.assert_called_once_with(start_date=None, end_date=None)
+        m.assert_called_once_with(
+            start_date=None, end_date=None, format=HTimeseries.TEXT, version=ANY
+        )
 
-    @patch("enhydris.models.Timeseries.get_data")
+    @patch("enhydris.models.Timeseries.iter_data", return_value=[])
     def test_invalid_end_date(self, m):
         self.response = self.client.get(
             "/api/stations/{}/timeseries/{}/data/?end_date=hello".format(
                 self.timeseries.gentity.id, self.timeseries.id
             )
         )
-        m.assert_called_once_with(start_date=None, end_date=None)
+        m.assert_called_once_with(
+            start_date=None, end_date=None, format=HTimeseries.TEXT, version=ANY
+        )
+
+
+@skipUnless(find_spec("pyarrow"), "pyarrow is not installed")
+@override_settings(ENHYDRIS_OPEN_CONTENT=True)
+class ColumnarFormatsTestCase(APITestCase):
+    def setUp(self):
+        station = mommy.make(models.Station)
+        self.timeseries = mommy.make(
+            models.Timeseries,
+            gentity=station,
+            name="Temperature",
+            time_zone__utc_offset=120,
+            precision=2,
+        )
+        self.timeseries.set_data(
+            StringIO("2018-12-09 13:10,20,\n2018-12-09 13:20,,MISS\n")
+        )
+        self.url = "/api/stations/{}/timeseries/".format(station.id)
+
+    def _get_table(self, url, fmt):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        f = BytesIO(b"".join(response.streaming_content))
+        if fmt == "parquet":
+            return pq.read_table(f)
+        return pa.ipc.open_file(f).read_all()
+
+    def _get_data_table(self, fmt):
+        return self._get_table(
+            "{}{}/data/?fmt={}".format(self.url, self.timeseries.id, fmt), fmt
+        )
+
+    def test_parquet(self):
+        table = self._get_data_table("parquet")
+        self.assertEqual(table.column_names, ["date", "value", "flags"])
+        self.assertEqual(
+            table.column("date").to_pylist(),
+            [datetime(2018, 12, 9, 13, 10), datetime(2018, 12, 9, 13, 20)],
+        )
+        self.assertEqual(table.column("value").to_pylist(), [20, None])
+        self.assertEqual(table.column("flags").to_pylist(), ["", "MISS"])
+
+    def test_parquet_metadata(self):
+        table = self._get_data_table("parquet")
+        self.assertEqual(table.schema.metadata[b"title"], b"Temperature")
+        self.assertEqual(table.schema.metadata[b"precision"], b"2")
+
+    def test_arrow(self):
+        table = self._get_data_table("arrow")
+        self.assertEqual(table.column("value").to_pylist(), [20, None])
+
+    def test_aggregate(self):
+        table = self._get_table(
+            "{}{}/aggregate/?step=H&fn=mean,count&fmt=parquet".format(
+                self.url, self.timeseries.id
+            ),
+            "parquet",
+        )
+        self.assertEqual(table.column_names, ["date", "mean", "count"])
+        self.assertEqual(table.column("count").to_pylist(), [1])
+
+    def test_multi_data(self):
+        table = self._get_table(
+            "{}multi-data/?ids={}&fmt=arrow".format(self.url, self.timeseries.id),
+            "arrow",
+        )
+        id = self.timeseries.id
+        self.assertEqual(table.column_names, ["date", str(id), f"{id}_flags"])
+        self.assertEqual(table.schema.metadata[f"{id}:title".encode()], b"Temperature")
+
+    @patch("enhydris.columnar.find_spec", return_value=None)
+    def test_pyarrow_not_installed(self, m):
+        response = self.client.get(
+            "{}{}/data/?fmt=parquet".format(self.url, self.timeseries.id)
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(ENHYDRIS_OPEN_CONTENT=True)
+class TsdataAfterTestCase(APITestCase):
+    def setUp(self):
+        station = mommy.make(models.Station)
+        self.timeseries = mommy.make(
+            models.Timeseries, gentity=station, time_zone__utc_offset=120, precision=2
+        )
+        self.timeseries.set_data(
+            StringIO(
+                "2018-12-09 13:10,20,\n2018-12-09 13:20,21,\n2018-12-09 13:30,22,\n"
+            )
+        )
+        self.url = "/api/stations/{}/timeseries/{}/data/".format(
+            station.id, self.timeseries.id
+        )
+
+    def _get(self, params):
+        return self.client.get(self.url, params).content.decode()
+
+    def test_after(self):
+        self.assertEqual(
+            self._get({"after": "2018-12-09 13:10"}),
+            "2018-12-09 13:20,21.00,\r\n2018-12-09 13:30,22.00,\r\n",
+        )
+
+    def test_after_last_record(self):
+        self.assertEqual(self._get({"after": "2018-12-09 13:30"}), "")
+
+    def test_after_with_time_zone(self):
+        self.assertEqual(
+            self._get({"after": "2018-12-09T11:20Z"}), "2018-12-09 13:30,22.00,\r\n"
+        )
+
+    def test_after_later_than_start_date(self):
+        self.assertEqual(
+            self._get({"after": "2018-12-09 13:20", "start_date": "2018-12-09 13:10"}),
+            "2018-12-09 13:30,22.00,\r\n",
+        )
+
+    def test_start_date_later_than_after(self):
+        self.assertEqual(
+            self._get({"after": "2018-12-09 13:00", "start_date": "2018-12-09 13:20"}),
+            "2018-12-09 13:20,21.00,\r\n2018-12-09 13:30,22.00,\r\n",
+        )
+
+    def test_invalid_after(self):
+        response = self.client.get(self.url, {"after": "2018-12-09 13:2O"})
+        self.assertEqual(response.status_code, 400)
 
 
 @override_settings(ENHYDRIS_OPEN_CONTENT=True)
@@ -390,6 +854,57 @@ class TimeseriesBottomTestCase(APITestCase):
         self.assertEqual(self.response.content.decode(), "2018-12-09 13:10,20.00,")
 
 
+@override_settings(ENHYDRIS_OPEN_CONTENT=True)
+class TimeseriesHeadAndTailTestCase(APITestCase):
+    def setUp(self):
+        station = mommy.make(models.Station)
+        timeseries = mommy.make(
+            models.Timeseries, gentity=station, time_zone__utc_offset=120, precision=1
+        )
+        timeseries.set_data(
+            StringIO(
+                "2018-12-09 13:10,20,\n"
+                "2018-12-09 13:20,,MISS\n"
+                "2018-12-09 13:30,22.04,\n"
+            )
+        )
+        self.url = "/api/stations/{}/timeseries/{}/".format(station.id, timeseries.id)
+
+    def _get(self, action):
+        return self.client.get(self.url + action)
+
+    def test_tail(self):
+        response = self._get("tail/?n=2")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.content.decode(),
+            "2018-12-09 13:20,,MISS\r\n2018-12-09 13:30,22.0,\r\n",
+        )
+
+    def test_tail_defaults_to_last_record(self):
+        self.assertEqual(
+            self._get("tail/").content.decode(), "2018-12-09 13:30,22.0,\r\n"
+        )
+
+    def test_head(self):
+        self.assertEqual(
+            self._get("head/?n=2").content.decode(),
+            "2018-12-09 13:10,20.0,\r\n2018-12-09 13:20,,MISS\r\n",
+        )
+
+    def test_more_than_the_records(self):
+        self.assertEqual(len(self._get("tail/?n=10").content.decode().splitlines()), 3)
+
+    def test_invalid_n(self):
+        self.assertEqual(self._get("tail/?n=0").status_code, 400)
+        self.assertEqual(self._get("tail/?n=hello").status_code, 400)
+
+    def test_head_request_of_data_is_not_affected(self):
+        response = self.client.head(self.url + "data/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+
+
 @override_settings(ENHYDRIS_OPEN_CONTENT=False)
 class TimeseriesBottomPermissionsTestCase(APITestCase):
     def setUp(self):
@@ -413,6 +928,93 @@ class TimeseriesBottomPermissionsTestCase(APITestCase):
         self.assertEqual(self.response.status_code, 200)
 
 
+@override_settings(ENHYDRIS_OPEN_CONTENT=True)
+class ConditionalGetTestCase(APITestCase):
+    def setUp(self):
+        station = mommy.make(models.Station)
+        self.timeseries = mommy.make(
+            models.Timeseries, gentity=station, time_zone__utc_offset=120, precision=2
+        )
+        self.timeseries.set_data(StringIO("2018-12-09 13:10,20,\n"))
+        self.url = "/api/stations/{}/timeseries/{}/".format(
+            station.id, self.timeseries.id
+        )
+
+    def _get(self, action, **headers):
+        return self.client.get(self.url + action, **headers)
+
+    def test_etag(self):
+        response = self._get("data/")
+        self.timeseries.refresh_from_db()
+        self.assertEqual(
+            response["ETag"],
+            '"{}-{}"'.format(self.timeseries.id, self.timeseries.data_version),
+        )
+
+    def test_data_not_modified(self):
+        etag = self._get("data/")["ETag"]
+        response = self._get("data/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_data_not_modified_does_not_read_the_data(self):
+        etag = self._get("data/")["ETag"]
+        with patch("enhydris.models.Timeseries.iter_data") as m:
+            self._get("data/", HTTP_IF_NONE_MATCH=etag)
+        m.assert_not_called()
+
+    def test_data_modified(self):
+        etag = self._get("data/")["ETag"]
+        self.timeseries.append_data(StringIO("2018-12-09 13:20,21,\n"))
+        response = self._get("data/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_unchanged_merge_does_not_modify(self):
+        etag = self._get("data/")["ETag"]
+        self.timeseries.merge_data(StringIO("2018-12-09 13:10,20,\n"))
+        response = self._get("data/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_changing_the_time_series_modifies(self):
+        etag = self._get("data/")["ETag"]
+        self.timeseries.precision = 3
+        self.timeseries.save()
+        response = self._get("data/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def _check_modified_by_saving(self, obj, attribute, value):
+        etag = self._get("data/?fmt=hts")["ETag"]
+        setattr(obj, attribute, value)
+        obj.save()
+        response = self._get("data/?fmt=hts", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_changing_the_station_modifies(self):
+        station = models.Station.objects.get(id=self.timeseries.gentity_id)
+        self._check_modified_by_saving(station, "name", "Renamed")
+
+    def test_changing_the_variable_modifies(self):
+        self._check_modified_by_saving(self.timeseries.variable, "descr", "Renamed")
+
+    def test_changing_the_unit_of_measurement_modifies(self):
+        unit = self.timeseries.unit_of_measurement
+        self._check_modified_by_saving(unit, "symbol", "mm")
+
+    def test_changing_the_time_zone_modifies(self):
+        self._check_modified_by_saving(self.timeseries.time_zone, "code", "EET")
+
+    def test_bottom_if_modified_since(self):
+        last_modified = self._get("bottom/")["Last-Modified"]
+        response = self._get("bottom/", HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_aggregate_not_modified(self):
+        etag = self._get("aggregate/?step=H")["ETag"]
+        response = self._get("aggregate/?step=H", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
 @override_settings(ENHYDRIS_USERS_CAN_ADD_CONTENT=True)
 class TimeseriesPostTestCase(APITestCase):
     def setUp(self):
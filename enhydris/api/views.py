@@ -1,21 +1,26 @@
+import datetime as dt
 import mimetypes
 import os
-from io import StringIO
+from io import BytesIO, StringIO
 from wsgiref.util import FileWrapper
+from zipfile import ZIP_DEFLATED, ZipFile
 
 from django.db import IntegrityError
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
 import iso8601
+import numpy as np
 import pandas as pd
 from htimeseries import HTimeseries
 
-from enhydris import models
+from enhydris import columnar, models
 from enhydris.views_common import StationListViewMixin
 
 from . import permissions, serializers
@@ -123,12 +128,25 @@ class GentityFileViewSet(ReadOnlyModelViewSet):
         return response
 
 
+MAX_CHART_POINTS = 10000
+MAX_HEAD_OR_TAIL_RECORDS = 10000
+
+
 class TimeseriesViewSet(ModelViewSet):
     queryset = models.Timeseries.objects.all()
     serializer_class = serializers.TimeseriesSerializer
 
     def get_permissions(self):
-        if self.action in ("data", "bottom"):
+        if self.action in (
+            "data",
+            "bottom",
+            "aggregate",
+            "chart",
+            "stats",
+            "multi_data",
+            "head_records",
+            "tail_records",
+        ):
             pc = [permissions.CanAccessTimeseriesData]
         else:
             pc = [permissions.CanEditOrReadOnly]
@@ -175,25 +193,376 @@ class TimeseriesViewSet(ModelViewSet):
         elif request.method == "POST":
             return self._post_data(request, pk)
 
+    @action(detail=False, methods=["get"], url_path="multi-data")
+    def multi_data(self, request, *, station_id):
+        try:
+            ids = [int(x) for x in request.GET.get("ids", "").split(",")]
+        except ValueError:
+            return HttpResponse(
+                status=status.HTTP_400_BAD_REQUEST,
+                content="ids must be a comma-separated list of time series ids",
+                content_type="text/plain",
+            )
+        ids = list(dict.fromkeys(ids))
+        timeseries = {
+            t.id: t
+            for t in self.get_queryset()
+            .filter(id__in=ids)
+            .select_related("gentity", "time_zone", "unit_of_measurement")
+        }
+        if len(timeseries) != len(ids):
+            raise Http404
+        timeseries_list = [timeseries[id] for id in ids]
+        for t in timeseries_list:
+            self.check_object_permissions(request, t)
+
+        fmt = request.GET.get("fmt", "csv").lower()
+        if fmt in columnar.FORMATS:
+            try:
+                columnar.check_available(fmt)
+            except ValueError as e:
+                return HttpResponse(
+                    status=status.HTTP_400_BAD_REQUEST,
+                    content=str(e),
+                    content_type="text/plain",
+                )
+
+        tz = timeseries_list[0].time_zone.as_tzinfo
+        start_date = self._get_date_from_string(request.GET.get("start_date"), tz)
+        end_date = self._get_date_from_string(request.GET.get("end_date"), tz)
+        data = models.Timeseries.get_many_data(timeseries_list, start_date, end_date)
+        if fmt == "hts":
+            response = HttpResponse(
+                self._get_hts_zip(timeseries_list, data), content_type="application/zip"
+            )
+            response["Content-Disposition"] = 'attachment; filename="data.zip"'
+        elif fmt in columnar.FORMATS:
+            extension, content_type = columnar.FORMATS[fmt]
+            response = StreamingHttpResponse(
+                self._iter_aligned_columnar(fmt, timeseries_list, data),
+                content_type=content_type,
+            )
+            response["Content-Disposition"] = f'attachment; filename="data.{extension}"'
+        else:
+            response = HttpResponse(content_type="text/csv; charset=utf-8")
+            self._write_aligned_csv(response, timeseries_list, data)
+            response["Content-Disposition"] = 'inline; filename="data.csv"'
+        return response
+
+    def _get_aligned_dataframe(self, timeseries_list, data):
+        """Return the data of many time series as a single dataframe.
+
+        For each time series, the dataframe has a column named after its id, with
+        the values, and one named after its id followed by "_flags". The index is
+        the union of the dates, in the time zone of the first time series; a time
+        series that has no record at a date has NaN in both columns.
+        """
+        utc_offset = timeseries_list[0].time_zone.utc_offset
+        columns = {}
+        for t, ahtimeseries in zip(timeseries_list, data):
+            shift = pd.Timedelta(minutes=utc_offset - t.time_zone.utc_offset)
+            index = ahtimeseries.data.index + shift
+            columns[str(t.id)] = pd.Series(
+                ahtimeseries.data["value"].values, index=index, dtype=np.float64
+            )
+            columns[f"{t.id}_flags"] = pd.Series(
+                ahtimeseries.data["flags"].astype(str).values, index=index
+            )
+        result = pd.DataFrame(columns)
+        result.index.name = "date"
+        return result
+
+    def _write_aligned_csv(self, f, timeseries_list, data):
+        """Write the data of many time series as a multi-column CSV.
+
+        The first line is a header with "date" and the columns of
+        _get_aligned_dataframe(). Each line has a date and the value and flags of
+        each time series at that date (empty if it has no record at that date).
+        """
+        result = self._get_aligned_dataframe(timeseries_list, data)
+        for t in timeseries_list:
+            result[str(t.id)] = _format_values(result[str(t.id)].values, t.precision)
+        result = result.fillna("")
+        result.to_csv(f, line_terminator="\r\n", date_format="%Y-%m-%d %H:%M")
+
+    def _iter_aligned_columnar(self, fmt, timeseries_list, data):
+        """Return the data of many time series as a Parquet or Arrow file.
+
+        The file has the columns of _get_aligned_dataframe(), and the properties of
+        each time series in its metadata, preceded by the id and a colon (e.g.
+        "1234:title").
+        """
+        columns = []
+        metadata = {}
+        for t, ahtimeseries in zip(timeseries_list, data):
+            columns += [(str(t.id), "float"), (f"{t.id}_flags", "str")]
+            metadata.update(columnar.get_metadata(ahtimeseries, prefix=f"{t.id}:"))
+        return columnar.iter_file(
+            fmt,
+            columns,
+            columnar.split(self._get_aligned_dataframe(timeseries_list, data)),
+            metadata,
+        )
+
+    def _get_hts_zip(self, timeseries_list, data):
+        with BytesIO() as result:
+            with ZipFile(result, "w", ZIP_DEFLATED) as zipfile:
+                for t, ahtimeseries in zip(timeseries_list, data):
+                    f = StringIO()
+                    ahtimeseries.write(f, format=HTimeseries.FILE)
+                    zipfile.writestr(f"{t.id}.hts", f.getvalue())
+            return result.getvalue()
+
+    @action(detail=True, methods=["get"])
+    def aggregate(self, request, pk=None, *, station_id):
+        timeseries = get_object_or_404(models.Timeseries, pk=int(pk))
+        self.check_object_permissions(request, timeseries)
+        not_modified_response = self._get_not_modified_response(request, timeseries)
+        if not_modified_response:
+            return not_modified_response
+        tz = timeseries.time_zone.as_tzinfo
+        start_date = self._get_date_from_string(request.GET.get("start_date"), tz)
+        end_date = self._get_date_from_string(request.GET.get("end_date"), tz)
+        step = request.GET.get("step", "")
+        functions = list(dict.fromkeys(request.GET.get("fn", "mean").split(",")))
+        try:
+            fmt, version, extension, content_type = self._get_format(request)
+            if fmt == HTimeseries.FILE and len(functions) > 1:
+                raise ValueError("The hts format can only have one function")
+            data = timeseries.get_aggregated_data(step, functions, start_date, end_date)
+        except ValueError as e:
+            return HttpResponse(
+                status=status.HTTP_400_BAD_REQUEST,
+                content=str(e),
+                content_type="text/plain",
+            )
+        if fmt in columnar.FORMATS:
+            response = StreamingHttpResponse(
+                self._iter_aggregated_columnar(fmt, data), content_type=content_type
+            )
+        else:
+            response = HttpResponse(content_type=content_type)
+            if len(functions) == 1:
+                data[functions[0]].write(response, format=fmt, version=version)
+            else:
+                self._write_aggregated_csv(response, data)
+        response["Content-Disposition"] = 'inline; filename="{}-{}.{}"'.format(
+            pk, step, extension
+        )
+        self._set_validators(response, timeseries)
+        return response
+
+    def _write_aggregated_csv(self, f, data):
+        """Write the result of Timeseries.get_aggregated_data() as a multi-column CSV.
+
+        Each line has the date and the value of each function, each formatted
+        like HTimeseries.write() would format it.
+        """
+        columns = []
+        for ahtimeseries in data.values():
+            text = StringIO()
+            ahtimeseries.write(text)
+            lines = text.getvalue().splitlines()
+            columns.append([line.split(",")[1] for line in lines])
+            dates = [line.split(",")[0] for line in lines]
+        for date, *values in zip(dates, *columns):
+            f.write(",".join([date, *values]) + "\r\n")
+
+    def _iter_aggregated_columnar(self, fmt, data):
+        """Return the result of get_aggregated_data() as a Parquet or Arrow file.
+
+        The file has the date and a column for each function.
+        """
+        first = next(iter(data.values()))
+        dataframe = pd.DataFrame(
+            {function: a.data["value"] for function, a in data.items()},
+            index=first.data.index,
+        )
+        return columnar.iter_file(
+            fmt,
+            [(function, "float") for function in data],
+            columnar.split(dataframe),
+            columnar.get_metadata(first),
+        )
+
+    @action(detail=True, methods=["get"])
+    def chart(self, request, pk=None, *, station_id):
+        timeseries = get_object_or_404(models.Timeseries, pk=int(pk))
+        self.check_object_permissions(request, timeseries)
+        tz = timeseries.time_zone.as_tzinfo
+        start_date = self._get_date_from_string(request.GET.get("start_date"), tz)
+        end_date = self._get_date_from_string(request.GET.get("end_date"), tz)
+        method = request.GET.get("method", "minmax")
+        try:
+            npoints = min(int(request.GET.get("points", 200)), MAX_CHART_POINTS)
+            data = timeseries.get_chart_data(start_date, end_date, npoints, method)
+        except ValueError as e:
+            return HttpResponse(
+                status=status.HTTP_400_BAD_REQUEST,
+                content=str(e),
+                content_type="text/plain",
+            )
+
+        # The timestamps are milliseconds since the epoch of the local (naive) time,
+        # as if it were UTC, which is what javascript charting libraries expect.
+        timestamps = data.index.values.view("int64") // 1000000
+        return Response({"data": list(zip(timestamps.tolist(), data.values.tolist()))})
+
+    @action(detail=True, methods=["get"])
+    def stats(self, request, pk=None, *, station_id):
+        timeseries = get_object_or_404(models.Timeseries, pk=int(pk))
+        self.check_object_permissions(request, timeseries)
+        tz = timeseries.time_zone.as_tzinfo
+        start_date = self._get_date_from_string(request.GET.get("start_date"), tz)
+        end_date = self._get_date_from_string(request.GET.get("end_date"), tz)
+        vector = request.GET.get("vector", "").lower() in ("1", "true", "yes")
+        result = timeseries.get_statistics(start_date, end_date, vector)
+        for key in ("min_date", "max_date", "last_date"):
+            if result[key] is not None:
+                result[key] = result[key].strftime("%Y-%m-%d %H:%M")
+        return Response(result)
+
     @action(detail=True, methods=["get"])
     def bottom(self, request, pk=None, *, station_id):
-        ts = get_object_or_404(models.Timeseries, pk=pk)
+        ts = get_object_or_404(
+            models.Timeseries.objects.select_related("time_zone"), pk=pk
+        )
         self.check_object_permissions(request, ts)
+        not_modified_response = self._get_not_modified_response(request, ts)
+        if not_modified_response:
+            return not_modified_response
         response = HttpResponse(content_type="text/plain")
         response.write(ts.get_last_record_as_string())
+        self._set_validators(response, ts)
+        return response
+
+    # Not named "head" and "tail", because a "head" method would handle HEAD requests
+    @action(detail=True, methods=["get"], url_path="head", url_name="head")
+    def head_records(self, request, pk=None, *, station_id):
+        return self._get_head_or_tail(request, pk, tail=False)
+
+    @action(detail=True, methods=["get"], url_path="tail", url_name="tail")
+    def tail_records(self, request, pk=None, *, station_id):
+        return self._get_head_or_tail(request, pk, tail=True)
+
+    def _get_head_or_tail(self, request, pk, tail):
+        timeseries = get_object_or_404(
+            models.Timeseries.objects.select_related("time_zone"), pk=int(pk)
+        )
+        self.check_object_permissions(request, timeseries)
+        not_modified_response = self._get_not_modified_response(request, timeseries)
+        if not_modified_response:
+            return not_modified_response
+        try:
+            n = int(request.GET.get("n", 1))
+            if n < 1:
+                raise ValueError("n must be a positive integer")
+        except ValueError as e:
+            return HttpResponse(
+                status=status.HTTP_400_BAD_REQUEST,
+                content=str(e),
+                content_type="text/plain",
+            )
+        n = min(n, MAX_HEAD_OR_TAIL_RECORDS)
+        response = HttpResponse(
+            models.TimeseriesRecord.get_head_or_tail_csv(timeseries, n, tail),
+            content_type="text/csv; charset=utf-8",
+        )
+        self._set_validators(response, timeseries)
         return response
 
     def _get_data(self, request, pk, format=None):
         timeseries = get_object_or_404(models.Timeseries, pk=int(pk))
         self.check_object_permissions(request, timeseries)
+        not_modified_response = self._get_not_modified_response(request, timeseries)
+        if not_modified_response:
+            return not_modified_response
 
         tz = timeseries.time_zone.as_tzinfo
-        start_date = request.GET.get("start_date")
         end_date = request.GET.get("end_date")
-        start_date = self._get_date_from_string(start_date, tz)
         end_date = self._get_date_from_string(end_date, tz)
 
+        try:
+            start_date = self._get_start_date(request, tz)
+            fmt, version, extension, content_type = self._get_format(request)
+        except ValueError as e:
+            return HttpResponse(
+                status=status.HTTP_400_BAD_REQUEST,
+                content=str(e),
+                content_type="text/plain",
+            )
+        if request.method == "GET":
+            response = StreamingHttpResponse(
+                timeseries.iter_data(
+                    start_date=start_date,
+                    end_date=end_date,
+                    format=fmt,
+                    version=version,
+                ),
+                content_type=content_type,
+            )
+        else:
+            response = HttpResponse(content_type=content_type)
+        response["Content-Disposition"] = 'inline; filename="{}.{}"'.format(
+            pk, extension
+        )
+        self._set_validators(response, timeseries)
+        return response
+
+    def _get_start_date(self, request, tz):
+        """Return the start date of the data to get, taking "after" into account.
+
+        "after" is usually the date of the last record the client has. The records
+        must be later than it, and not earlier than "start_date" if that is also
+        specified (the later of the two applies). Unlike "start_date", an invalid
+        "after" is an error rather than no limit, otherwise a typo could return the
+        entire time series.
+        """
+        start_date = request.GET.get("start_date")
+        after = request.GET.get("after")
+        if not after:
+            return self._get_date_from_string(start_date, tz)
+        after_date = self._parse_date(after, tz)
+        if not after_date:
+            raise ValueError(f'Invalid date "{after}" in "after"')
+        parsed_start_date = self._parse_date(start_date, tz)
+        if parsed_start_date and parsed_start_date > after_date:
+            return self._get_date_from_string(start_date, tz)
+        # The database stores microseconds
+        return after_date + dt.timedelta(microseconds=1)
+
+    def _get_not_modified_response(self, request, timeseries):
+        """Return a 304 response if the client has the current data, else None.
+
+        The ETag and Last-Modified of the data are derived from the data version of
+        the time series (see _set_validators()), so this doesn't read any records.
+        """
+        response = get_conditional_response(
+            request,
+            etag=self._get_etag(timeseries),
+            last_modified=int(timeseries.data_last_modified.timestamp()),
+        )
+        if response is not None:
+            self._set_validators(response, timeseries)
+        return response
+
+    def _set_validators(self, response, timeseries):
+        response["ETag"] = self._get_etag(timeseries)
+        response["Last-Modified"] = http_date(timeseries.data_last_modified.timestamp())
+
+    def _get_etag(self, timeseries):
+        return quote_etag(f"{timeseries.id}-{timeseries.data_version}")
+
+    def _get_format(self, request):
+        """Return format, version, extension and content type from the fmt param.
+
+        Raises ValueError if the format is not available.
+        """
         fmt_param = request.GET.get("fmt", "csv").lower()
+        if fmt_param in columnar.FORMATS:
+            columnar.check_available(fmt_param)
+            extension, content_type = columnar.FORMATS[fmt_param]
+            return fmt_param, "irrelevant", extension, content_type
         if fmt_param == "hts":
             fmt = HTimeseries.FILE
             version = 5
@@ -209,21 +578,27 @@ class TimeseriesViewSet(ModelViewSet):
             version = "irrelevant"
             extension = "csv"
             content_type = "text/csv"
-        response = HttpResponse(content_type=content_type + "; charset=utf-8")
-        response["Content-Disposition"] = 'inline; filename="{}.{}"'.format(
-            pk, extension
-        )
-        if request.method == "GET":
-            ahtimeseries = timeseries.get_data(start_date=start_date, end_date=end_date)
-            ahtimeseries.write(response, format=fmt, version=version)
-        return response
+        content_type += "; charset=utf-8"
+        return fmt, version, extension, content_type
 
     def _post_data(self, request, pk, format=None):
         try:
             atimeseries = get_object_or_404(models.Timeseries, pk=int(pk))
             self.check_object_permissions(request, atimeseries)
-            atimeseries.append_data(StringIO(request.data["timeseries_records"]))
-            return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+            data = StringIO(request.data["timeseries_records"])
+            mode = request.data.get("mode", "append")
+            if mode == "append":
+                atimeseries.append_data(data)
+                return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+            elif mode == "merge":
+                return Response(atimeseries.merge_data(data))
+            elif mode == "replace":
+                start_date, end_date = self._get_range_to_replace(request, atimeseries)
+                atimeseries.replace_range(start_date, end_date, data)
+                return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+            raise ValueError(
+                f'Unknown mode "{mode}"; use "append", "merge" or "replace"'
+            )
         except (IntegrityError, iso8601.ParseError, ValueError) as e:
             return HttpResponse(
                 status=status.HTTP_400_BAD_REQUEST,
@@ -231,6 +606,16 @@ class TimeseriesViewSet(ModelViewSet):
                 content_type="text/plain",
             )
 
+    def _get_range_to_replace(self, request, atimeseries):
+        # Unlike when getting data, a missing or invalid date is an error rather than
+        # no limit, otherwise a typo could delete the entire time series.
+        tz = atimeseries.time_zone.as_tzinfo
+        start_date = self._parse_date(request.data.get("start_date"), tz)
+        end_date = self._parse_date(request.data.get("end_date"), tz)
+        if not start_date or not end_date:
+            raise ValueError("Replacing data requires a valid start_date and end_date")
+        return start_date, end_date
+
     def _get_date_from_string(self, adate, tz):
         date = self._parse_date(adate, tz)
         if not date:
@@ -249,3 +634,14 @@ class TimeseriesViewSet(ModelViewSet):
         if date.isoformat() > pd.Timestamp.max.isoformat():
             date = pd.Timestamp.max
         return date
+
+
+def _format_values(values, precision):
+    """Format an array of values with the precision, like HTimeseries.write()."""
+    if precision < 0:
+        multiplier = 10 ** -precision
+        values = np.round(values / multiplier) * multiplier
+        precision = 0
+    result = np.char.mod(f"%.{precision}f", values).astype(object)
+    result[np.isnan(values)] = ""
+    return result
@@ -0,0 +1,134 @@
+"""The chunk layout of the time series records hypertable.
+
+The records are stored in chunks of ENHYDRIS_CHUNK_TIME_INTERVAL and, if
+ENHYDRIS_CHUNK_SPACE_PARTITIONS is greater than 1, further partitioned by a hash of
+the time series id. TimescaleDB only applies a new layout to the chunks it creates
+afterwards, so the "rechunk_timeseries_records" management command reloads the
+records with rebuild() when the layout differs from the settings. It also reorders
+the chunks by the primary key (timeseries_id, timestamp) with reorder(), so that the
+records of each time series are contiguous on disk.
+"""
+
+MINIMUM_VERSION = (2, 0)
+
+PRIMARY_KEY_INDEX = "enhydris_timeseriesrecord_pk"
+
+
+def layout_matches(cursor, time_interval, partitions):
+    """Return True if the hypertable has the specified layout.
+
+    "time_interval" is a PostgreSQL interval; "partitions" is the number of space
+    partitions, 1 meaning no space partitioning.
+    """
+    cursor.execute(
+        """
+        SELECT
+            COALESCE(
+                BOOL_OR(dimension_type = 'Time' AND time_interval = %s::interval),
+                false
+            ),
+            COALESCE(MAX(num_partitions) FILTER (WHERE dimension_type = 'Space'), 1)
+        FROM timescaledb_information.dimensions
+        WHERE hypertable_name = 'enhydris_timeseriesrecord'
+        """,
+        [time_interval],
+    )
+    time_interval_matches, current_partitions = cursor.fetchone()
+    return time_interval_matches and current_partitions == partitions
+
+
+def compression_is_enabled(cursor):
+    cursor.execute(
+        """
+        SELECT compression_enabled FROM timescaledb_information.hypertables
+        WHERE hypertable_name = 'enhydris_timeseriesrecord'
+        """
+    )
+    return cursor.fetchone()[0]
+
+
+def rebuild(cursor, time_interval, partitions):
+    """Change the layout and reload all records so that it applies to them.
+
+    The records are copied to a temporary table, the hypertable is truncated (which
+    drops its chunks), its layout is changed, and the records are copied back in
+    primary key order. This needs as much free disk space as the records occupy,
+    and it must be run in a transaction. Compression must be disabled.
+    """
+    cursor.execute(
+        """
+        CREATE TEMPORARY TABLE enhydris_timeseriesrecord_rechunk ON COMMIT DROP AS
+        SELECT * FROM enhydris_timeseriesrecord
+        """
+    )
+    cursor.execute("TRUNCATE enhydris_timeseriesrecord")
+    cursor.execute(
+        "SELECT set_chunk_time_interval('enhydris_timeseriesrecord', %s::interval)",
+        [time_interval],
+    )
+    _set_partitions(cursor, partitions)
+    cursor.execute(
+        """
+        INSERT INTO enhydris_timeseriesrecord
+            (timeseries_id, "timestamp", value, flags)
+        SELECT timeseries_id, "timestamp", value, flags
+        FROM enhydris_timeseriesrecord_rechunk
+        ORDER BY timeseries_id, "timestamp"
+        """
+    )
+    cursor.execute("DROP TABLE enhydris_timeseriesrecord_rechunk")
+
+
+def _set_partitions(cursor, partitions):
+    cursor.execute(
+        """
+        SELECT COUNT(*) FROM timescaledb_information.dimensions
+        WHERE hypertable_name = 'enhydris_timeseriesrecord'
+            AND dimension_type = 'Space'
+        """
+    )
+    has_space_dimension = cursor.fetchone()[0]
+    if has_space_dimension:
+        # A dimension can't be removed; one partition is equivalent to none
+        cursor.execute(
+            "SELECT set_number_partitions('enhydris_timeseriesrecord', %s)",
+            [partitions],
+        )
+    elif partitions > 1:
+        cursor.execute(
+            """
+            SELECT add_dimension(
+                'enhydris_timeseriesrecord',
+                'timeseries_id',
+                number_partitions => %s
+            )
+            """,
+            [partitions],
+        )
+
+
+def reorder(cursor):
+    """Reorder the uncompressed chunks by the primary key and add a reorder policy.
+
+    The policy reorders each new chunk once TimescaleDB stops inserting into it.
+    Returns the number of chunks reordered.
+    """
+    cursor.execute(
+        f"""
+        SELECT reorder_chunk(
+            format('%I.%I', chunk_schema, chunk_name)::regclass,
+            '{PRIMARY_KEY_INDEX}'
+        )
+        FROM timescaledb_information.chunks
+        WHERE hypertable_name = 'enhydris_timeseriesrecord' AND NOT is_compressed
+        """
+    )
+    count = len(cursor.fetchall())
+    cursor.execute(
+        f"""
+        SELECT add_reorder_policy(
+            'enhydris_timeseriesrecord', '{PRIMARY_KEY_INDEX}', if_not_exists => true
+        )
+        """
+    )
+    return count
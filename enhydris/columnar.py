@@ -0,0 +1,131 @@
+"""Writing time series data in the Parquet and Arrow IPC file formats.
+
+These formats need the pyarrow package, which is optional. The data is written a
+dataframe at a time, each dataframe becoming a row group (Parquet) or a record batch
+(Arrow), and what has been written so far is yielded after each one, so that a
+response can be streamed without having the whole file in memory. The properties of
+the time series (title, time zone, precision etc.) are stored in the metadata of the
+file's schema.
+"""
+import json
+from importlib.util import find_spec
+
+import numpy as np
+
+# Format: (file extension, content type)
+FORMATS = {
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "arrow": ("arrow", "application/vnd.apache.arrow.file"),
+}
+
+# The number of records in each row group or record batch
+BATCH_SIZE = 100000
+
+_METADATA_ATTRIBUTES = (
+    "title",
+    "comment",
+    "timezone",
+    "time_step",
+    "unit",
+    "variable",
+    "precision",
+    "location",
+)
+
+
+def check_available(fmt):
+    if find_spec("pyarrow") is None:
+        raise ValueError(f"The {fmt} format is not available on this server")
+
+
+def get_metadata(ahtimeseries, prefix=""):
+    """Return the properties of an HTimeseries as a dictionary of strings.
+
+    The keys are the names of the properties, preceded by "prefix".
+    """
+    result = {}
+    for attribute in _METADATA_ATTRIBUTES:
+        value = getattr(ahtimeseries, attribute, None)
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            value = json.dumps(value)
+        result[prefix + attribute] = value
+    return result
+
+
+def iter_file(fmt, columns, dataframes, metadata):
+    """Return an iterator over the bytes of a file with the dataframes.
+
+    "fmt" is "parquet" or "arrow". "columns" is a list of (name, type) tuples, where
+    type is "float" or "str", that specifies the columns of the dataframes other
+    than the index; the file has these columns preceded by "date", which is the
+    (naive) index of the dataframes; NaN values are written as nulls. "dataframes"
+    is an iterable of dataframes; an empty one results in a file with no records.
+    "metadata" is a dictionary of strings.
+    """
+    import pyarrow as pa
+
+    types = {"float": pa.float64(), "str": pa.string()}
+    schema = pa.schema(
+        [("date", pa.timestamp("us"))]
+        + [(name, types[column_type]) for name, column_type in columns],
+        metadata=metadata,
+    )
+    sink = _Sink()
+    writer = _open_writer(fmt, sink, schema)
+    for dataframe in dataframes:
+        arrays = [pa.array(dataframe.index.values.astype("datetime64[us]"))]
+        for name, column_type in columns:
+            values = dataframe[name].values
+            if column_type == "str":
+                values = np.asarray(values, dtype=object)
+            arrays.append(pa.array(values, type=types[column_type], from_pandas=True))
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def split(dataframe):
+    """Split a dataframe that is already in memory into BATCH_SIZE parts."""
+    for start in range(0, max(len(dataframe), 1), BATCH_SIZE):
+        end = start + BATCH_SIZE
+        yield dataframe.iloc[start:end]
+
+
+def _open_writer(fmt, sink, schema):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if fmt == "parquet":
+        return pq.ParquetWriter(sink, schema)
+    return pa.ipc.new_file(sink, schema)
+
+
+class _Sink:
+    """A write-only file that keeps what is written to it until it is taken."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        result = b"".join(self.chunks)
+        self.chunks = []
+        return result
@@ -0,0 +1,155 @@
+"""TimescaleDB native compression of old time series records.
+
+Compression is optional. If ENHYDRIS_COMPRESS_AFTER is set (to a PostgreSQL interval
+such as "2 years"), the "compress_timeseries_records" management command enables
+compression of the enhydris_timeseriesrecord hypertable and adds a policy that
+compresses each chunk once all its records are older than that. The chunks are
+segmented by time series and ordered by timestamp, so that reading a time series, or
+a range of it, only decompresses the segments of that time series.
+
+Before version 2.11, TimescaleDB can't update or delete records of compressed chunks
+(and before 2.3 it can't insert into them either), so Enhydris calls
+decompress_for_write() before writing records; it decompresses the compressed chunks
+that overlap the records to be written, and the policy compresses them again later.
+"""
+import functools
+
+from django.conf import settings
+from django.db import connection
+
+from enhydris import continuous_aggregates
+
+MINIMUM_VERSION = (2, 0)
+
+# The first version that can insert, update and delete records of compressed chunks
+DML_VERSION = (2, 11)
+
+
+def enable(cursor, compress_after):
+    """Enable compression and (re)create the policy with the specified interval."""
+    cursor.execute(
+        """
+        ALTER TABLE enhydris_timeseriesrecord SET (
+            timescaledb.compress,
+            timescaledb.compress_segmentby = 'timeseries_id',
+            timescaledb.compress_orderby = '"timestamp"'
+        )
+        """
+    )
+    cursor.execute(
+        "SELECT remove_compression_policy("
+        "'enhydris_timeseriesrecord', if_exists => true)"
+    )
+    cursor.execute(
+        "SELECT add_compression_policy('enhydris_timeseriesrecord', %s::interval)",
+        [compress_after],
+    )
+
+
+def disable(cursor):
+    """Remove the policy, decompress all chunks and disable compression.
+
+    Returns the number of chunks that were decompressed.
+    """
+    cursor.execute(
+        "SELECT remove_compression_policy("
+        "'enhydris_timeseriesrecord', if_exists => true)"
+    )
+    result = decompress_chunks(cursor)
+    cursor.execute(
+        "ALTER TABLE enhydris_timeseriesrecord SET (timescaledb.compress = false)"
+    )
+    return result
+
+
+def compress_chunks(cursor, older_than):
+    """Compress the uncompressed chunks whose records are all older than older_than.
+
+    "older_than" is a PostgreSQL interval. Returns the number of chunks compressed.
+    """
+    cursor.execute(
+        """
+        SELECT compress_chunk(format('%%I.%%I', chunk_schema, chunk_name)::regclass)
+        FROM timescaledb_information.chunks
+        WHERE hypertable_name = 'enhydris_timeseriesrecord'
+            AND NOT is_compressed
+            AND range_end <= now() - %s::interval
+        """,
+        [older_than],
+    )
+    return len(cursor.fetchall())
+
+
+def decompress_chunks(cursor, start_date=None, end_date=None):
+    """Decompress the compressed chunks that overlap start_date to end_date.
+
+    The dates are aware (inclusive); None means no limit. Returns the number of
+    chunks decompressed.
+    """
+    cursor.execute(
+        """
+        SELECT decompress_chunk(format('%%I.%%I', chunk_schema, chunk_name)::regclass)
+        FROM timescaledb_information.chunks
+        WHERE hypertable_name = 'enhydris_timeseriesrecord'
+            AND is_compressed
+            AND (%s::timestamptz IS NULL OR range_end > %s)
+            AND (%s::timestamptz IS NULL OR range_start <= %s)
+        """,
+        [start_date, start_date, end_date, end_date],
+    )
+    return len(cursor.fetchall())
+
+
+def decompress_for_write(timeseries, start_date=None, end_date=None):
+    """Make the records of a time series between the dates writable.
+
+    start_date and end_date are naive, in the time zone of the time series; None
+    means no limit. This does nothing if compression is disabled or if TimescaleDB
+    can write to compressed chunks.
+    """
+    if settings.ENHYDRIS_COMPRESS_AFTER is None or _can_write_compressed_chunks():
+        return
+    tzinfo = timeseries.time_zone.as_tzinfo
+    if start_date is not None:
+        start_date = start_date.replace(tzinfo=tzinfo)
+    if end_date is not None:
+        end_date = end_date.replace(tzinfo=tzinfo)
+    with connection.cursor() as cursor:
+        decompress_chunks(cursor, start_date, end_date)
+
+
+@functools.lru_cache()
+def _can_write_compressed_chunks():
+    version = continuous_aggregates.get_timescaledb_version()
+    return version is not None and version >= DML_VERSION
+
+
+def get_report(cursor):
+    """Return the size of each chunk before and after compression.
+
+    Returns a list of (chunk name, range start, range end, is compressed, bytes
+    before compression, bytes after compression) tuples; the latter is None for
+    uncompressed chunks.
+    """
+    cursor.execute(
+        """
+        SELECT
+            c.chunk_name,
+            c.range_start,
+            c.range_end,
+            c.is_compressed,
+            COALESCE(
+                s.before_compression_total_bytes,
+                pg_total_relation_size(
+                    format('%I.%I', c.chunk_schema, c.chunk_name)::regclass
+                )
+            ),
+            s.after_compression_total_bytes
+        FROM timescaledb_information.chunks c
+        LEFT JOIN chunk_compression_stats('enhydris_timeseriesrecord') s
+            ON s.chunk_schema = c.chunk_schema AND s.chunk_name = c.chunk_name
+        WHERE c.hypertable_name = 'enhydris_timeseriesrecord'
+        ORDER BY c.range_start
+        """
+    )
+    return cursor.fetchall()
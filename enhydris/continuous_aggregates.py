@@ -0,0 +1,165 @@
+"""TimescaleDB continuous aggregates of time series records.
+
+A continuous aggregate ("rollup") is a materialized view that contains the sum, min,
+max and count of the values of each time series for each hour, day or month (in UTC),
+and that TimescaleDB refreshes automatically. The rollups are optional; they are
+created with the "create_continuous_aggregates" management command, and
+TimeseriesRecord.get_aggregated_dataframe() uses those listed in the
+ENHYDRIS_CONTINUOUS_AGGREGATES setting.
+
+A rollup can be used instead of the records if its intervals fit in the requested
+intervals; for example, an hourly rollup can be used for daily aggregation of a time
+series whose UTC offset is a whole number of hours, but a daily rollup can be used
+only if the UTC offset is zero, because the rollup's days are in UTC.
+"""
+import datetime as dt
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+
+class Rollup:
+    def __init__(self, name, interval, minutes, minimum_version, end_offset, schedule):
+        self.name = name
+        self.interval = interval
+        self.minutes = minutes  # None if the length varies
+        self.minimum_version = minimum_version
+        self.end_offset = end_offset
+        self.schedule = schedule
+
+    @property
+    def view_name(self):
+        return f"enhydris_timeseriesrecord_{self.name}"
+
+    def create(self, cursor):
+        cursor.execute(
+            f"""
+            CREATE MATERIALIZED VIEW {self.view_name}
+            WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+            SELECT
+                timeseries_id,
+                time_bucket(INTERVAL '{self.interval}', "timestamp") AS bucket,
+                SUM(NULLIF(value, 'NaN')) AS sum,
+                MIN(NULLIF(value, 'NaN')) AS min,
+                MAX(NULLIF(value, 'NaN')) AS max,
+                COUNT(NULLIF(value, 'NaN')) AS count
+            FROM enhydris_timeseriesrecord
+            GROUP BY timeseries_id, bucket
+            WITH NO DATA
+            """
+        )
+        cursor.execute(
+            f"""
+            SELECT add_continuous_aggregate_policy(
+                '{self.view_name}',
+                start_offset => NULL,
+                end_offset => INTERVAL '{self.end_offset}',
+                schedule_interval => INTERVAL '{self.schedule}'
+            )
+            """
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {self.view_name}")
+
+    def exists(self, cursor):
+        cursor.execute(
+            """
+            SELECT COUNT(*) FROM timescaledb_information.continuous_aggregates
+            WHERE view_name = %s
+            """,
+            [self.view_name],
+        )
+        return bool(cursor.fetchone()[0])
+
+    def refresh(self, cursor):
+        cursor.execute(
+            f"CALL refresh_continuous_aggregate('{self.view_name}', NULL, NULL)"
+        )
+
+    def can_serve(self, bucket_minutes, utc_offset, start_date, end_date):
+        """Return True if this rollup can be used for an aggregation.
+
+        "bucket_minutes" is the length of the requested intervals in minutes, or None
+        for months and years. "utc_offset" is that of the time series. "start_date"
+        and "end_date" (aware or None) must be at boundaries of the rollup's
+        intervals (end_date at the last minute of an interval), otherwise the first
+        or last interval would include records outside the requested range.
+        """
+        if self.minutes is None:
+            if bucket_minutes is not None or utc_offset:
+                return False
+        elif utc_offset % self.minutes:
+            return False
+        elif bucket_minutes is not None and bucket_minutes % self.minutes:
+            return False
+        if start_date and not self._is_at_boundary(start_date):
+            return False
+        if end_date and not self._is_at_boundary(end_date + dt.timedelta(minutes=1)):
+            return False
+        return True
+
+    def _is_at_boundary(self, date):
+        date = date.astimezone(dt.timezone.utc)
+        if date.second or date.microsecond:
+            return False
+        minutes = date.hour * 60 + date.minute
+        if self.minutes is None:
+            return date.day == 1 and minutes == 0
+        return minutes % self.minutes == 0
+
+
+ROLLUPS = [
+    Rollup("monthly", "1 month", None, (2, 8), "1 month", "1 day"),
+    Rollup("daily", "1 day", 1440, (2, 0), "1 day", "1 hour"),
+    Rollup("hourly", "1 hour", 60, (2, 0), "1 hour", "30 minutes"),
+]
+
+
+def get_rollup(name):
+    for rollup in ROLLUPS:
+        if rollup.name == name:
+            return rollup
+    raise ValueError(f'"{name}" is not a continuous aggregate')
+
+
+def choose_rollup(bucket_minutes, utc_offset, start_date, end_date):
+    """Return the coarsest enabled rollup that can serve an aggregation, or None.
+
+    See Rollup.can_serve() for the parameters.
+    """
+    enabled = settings.ENHYDRIS_CONTINUOUS_AGGREGATES
+    for rollup in ROLLUPS:
+        if rollup.name in enabled and rollup.can_serve(
+            bucket_minutes, utc_offset, start_date, end_date
+        ):
+            return rollup
+    return None
+
+
+def get_timescaledb_version():
+    """Return the version of the timescaledb extension as a tuple of integers."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT extversion FROM pg_extension WHERE extname = 'timescaledb'"
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return tuple(int(x) for x in row[0].split("-")[0].split("."))
+
+
+def execute_with_fallback(rollup_query, fallback_query):
+    """Execute rollup_query, or fallback_query if the rollup is not available.
+
+    Each argument is a function that accepts a cursor, executes a query, and returns
+    the result. rollup_query is executed in a savepoint so that, if it fails
+    (e.g. because the continuous aggregate hasn't been created or the extension
+    does not support it), the transaction can continue with fallback_query.
+    """
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            return rollup_query(cursor)
+    except DatabaseError:
+        with connection.cursor() as cursor:
+            return fallback_query(cursor)
@@ -0,0 +1,103 @@
+"""Reduction of time series data to a few points for charting.
+
+A chart is a few hundred pixels wide, so there is no point in sending it more than a
+few hundred points, however many records the time series has. The functions of this
+module select the records to show; they work on numpy arrays of the timestamps (as
+integers) and the values (without NaNs) and return the indices of the selected
+records, in chronological order.
+
+"minmax" divides the time range into intervals of equal length and keeps the minimum
+and the maximum of each interval, so that peaks are never lost. "lttb" (Largest
+Triangle Three Buckets, Sveinn Steinarsson, 2013) divides the records into buckets of
+equal size and keeps the record of each bucket that forms the largest triangle with
+the records selected from its neighbouring buckets, which better preserves the shape
+of the line.
+"""
+import numpy as np
+import pandas as pd
+
+
+def min_max(timestamps, values, npoints):
+    n = len(timestamps)
+    if n <= npoints:
+        return np.arange(n)
+    nbuckets = max(npoints // 2, 1)
+    t0 = timestamps[0]
+    span = int(timestamps[-1]) - int(t0) + 1
+    # The intervals are rounded up to a whole number of time units so that there are
+    # at most nbuckets of them (multiplying nanoseconds by nbuckets would overflow).
+    interval = -(-span // nbuckets)
+    buckets = (timestamps - t0) // interval
+    starts = np.flatnonzero(np.diff(buckets, prepend=-1))
+    counts = np.diff(np.append(starts, n))
+    bucket_ids = np.repeat(np.arange(len(starts)), counts)
+    minima = np.minimum.reduceat(values, starts)
+    maxima = np.maximum.reduceat(values, starts)
+    min_indices = _first_in_each_bucket(values == np.repeat(minima, counts), bucket_ids)
+    max_indices = _first_in_each_bucket(values == np.repeat(maxima, counts), bucket_ids)
+    return np.union1d(min_indices, max_indices)
+
+
+def _first_in_each_bucket(mask, bucket_ids):
+    indices = np.flatnonzero(mask)
+    first = np.flatnonzero(np.diff(bucket_ids[indices], prepend=-1))
+    return indices[first]
+
+
+def lttb(timestamps, values, npoints):
+    n = len(timestamps)
+    if n <= npoints:
+        return np.arange(n)
+    if npoints < 3:
+        # There are no buckets between the first and the last record
+        return np.array([0, n - 1][-npoints:])
+    x = (timestamps - timestamps[0]).astype(np.float64)
+    y = values
+
+    # The first and last records are always selected; the rest are divided into
+    # npoints - 2 buckets, the boundaries of which are in "edges".
+    edges = np.linspace(1, n - 1, npoints - 1).astype(np.int64)
+    result = np.empty(npoints, dtype=np.int64)
+    result[0] = 0
+    result[-1] = n - 1
+    a = 0
+    for i in range(npoints - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start = end
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+        areas = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        result[i + 1] = a
+    return result
+
+
+METHODS = {"minmax": min_max, "lttb": lttb}
+
+
+def downsample(data, npoints, method="minmax"):
+    """Return about npoints records of data.
+
+    "data" is a dataframe like those returned by TimeseriesCache.get(). Records
+    without a value are ignored. The result is a pandas series of the values of the
+    selected records, with the same (datetime) index.
+    """
+    try:
+        select = METHODS[method]
+    except KeyError:
+        raise ValueError(
+            f'"{method}" is not a valid downsampling method; use '
+            + " or ".join(f'"{x}"' for x in METHODS)
+        )
+    if npoints < 1:
+        raise ValueError("The number of points must be positive")
+    values = data["value"].values
+    has_value = ~np.isnan(values)
+    values = values[has_value]
+    index = data.index[has_value]
+    selected = select(index.values.view(np.int64), values, npoints)
+    return pd.Series(values[selected], index=index[selected], name="value")
@@ -0,0 +1,77 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from enhydris import compression, continuous_aggregates
+
+
+class Command(BaseCommand):
+    help = (
+        "Enable TimescaleDB native compression of the time series records, add a "
+        "policy that compresses them once they are older than "
+        "ENHYDRIS_COMPRESS_AFTER, and compress those that already are."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            help="Compress now the records older than this interval instead of "
+            "ENHYDRIS_COMPRESS_AFTER (the policy still uses the setting)",
+        )
+        parser.add_argument(
+            "--decompress",
+            action="store_true",
+            help="Remove the policy, decompress all records and disable compression",
+        )
+        parser.add_argument(
+            "--report",
+            action="store_true",
+            help="Only show the size of each chunk before and after compression",
+        )
+
+    def handle(self, *args, **options):
+        version = continuous_aggregates.get_timescaledb_version()
+        if version is None or version < compression.MINIMUM_VERSION:
+            raise CommandError(
+                "Compression needs TimescaleDB "
+                + ".".join(str(x) for x in compression.MINIMUM_VERSION)
+                + " or later"
+            )
+        with connection.cursor() as cursor:
+            if options["report"]:
+                self._write_report(cursor)
+            elif options["decompress"]:
+                count = compression.disable(cursor)
+                self.stdout.write(f"Decompressed {count} chunks")
+            else:
+                self._compress(cursor, options["older_than"])
+
+    def _compress(self, cursor, older_than):
+        compress_after = settings.ENHYDRIS_COMPRESS_AFTER
+        if compress_after is None:
+            raise CommandError("ENHYDRIS_COMPRESS_AFTER is not set")
+        compression.enable(cursor, compress_after)
+        count = compression.compress_chunks(cursor, older_than or compress_after)
+        self.stdout.write(f"Compressed {count} chunks")
+
+    def _write_report(self, cursor):
+        total_before = total_after = 0
+        for name, start, end, is_compressed, before, after in compression.get_report(
+            cursor
+        ):
+            if is_compressed:
+                ratio = f"{before / after:.1f}x"
+                total_after += after
+            else:
+                ratio = "uncompressed"
+                total_after += before
+            total_before += before
+            self.stdout.write(
+                f"{name}\t{start:%Y-%m-%d}\t{end:%Y-%m-%d}\t{before}\t"
+                f"{after or ''}\t{ratio}"
+            )
+        if total_after:
+            self.stdout.write(
+                f"Total\t\t\t{total_before}\t{total_after}\t"
+                f"{total_before / total_after:.1f}x"
+            )
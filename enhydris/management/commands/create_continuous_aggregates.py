@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from enhydris import continuous_aggregates
+
+
+class Command(BaseCommand):
+    help = (
+        "Create TimescaleDB continuous aggregates (hourly, daily, monthly) of the "
+        "time series records, with refresh policies. To be used for aggregation, "
+        "they must also be listed in ENHYDRIS_CONTINUOUS_AGGREGATES."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "names",
+            nargs="*",
+            help="The continuous aggregates to create; by default, all of them",
+        )
+        parser.add_argument(
+            "--drop",
+            action="store_true",
+            help="Drop the continuous aggregates instead of creating them",
+        )
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            help="Materialize the continuous aggregates now rather than waiting "
+            "for their refresh policies",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            rollups = [
+                continuous_aggregates.get_rollup(name) for name in options["names"]
+            ] or continuous_aggregates.ROLLUPS
+        except ValueError as e:
+            raise CommandError(str(e))
+        version = continuous_aggregates.get_timescaledb_version()
+        with connection.cursor() as cursor:
+            for rollup in rollups:
+                if options["drop"]:
+                    rollup.drop(cursor)
+                    continue
+                if version is None or version < rollup.minimum_version:
+                    self.stderr.write(
+                        f"Skipping {rollup.name}: it needs TimescaleDB "
+                        + ".".join(str(x) for x in rollup.minimum_version)
+                        + " or later; aggregation will use the records instead"
+                    )
+                    continue
+                rollup.create(cursor)
+                if options["refresh"]:
+                    rollup.refresh(cursor)
+                self.stdout.write(f"Created {rollup.view_name}")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from enhydris.models import Timeseries
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalculate the summary of the records (start and end date, number of "
+        "records, last record) that is stored in each time series, and the pyramid "
+        "of their hourly, daily, monthly and yearly min, max, sum and count."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "timeseries_ids",
+            nargs="*",
+            type=int,
+            help="The ids of the time series to rebuild; by default, all of them",
+        )
+
+    def handle(self, *args, **options):
+        timeseries = Timeseries.objects.order_by("id")
+        if options["timeseries_ids"]:
+            timeseries = timeseries.filter(id__in=options["timeseries_ids"])
+        for t in timeseries:
+            t.rebuild_summary()
+            if options["verbosity"] >= 2:
+                self.stdout.write(f"{t.id}: {t.records_count} records")
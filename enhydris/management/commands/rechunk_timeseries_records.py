@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from enhydris import chunking, continuous_aggregates
+
+
+class Command(BaseCommand):
+    help = (
+        "Change the chunk layout of the time series records to that specified by "
+        "ENHYDRIS_CHUNK_TIME_INTERVAL and ENHYDRIS_CHUNK_SPACE_PARTITIONS, "
+        "reloading the records if it differs, and reorder the chunks so that the "
+        "records of each time series are contiguous on disk."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reorder-only",
+            action="store_true",
+            help="Only reorder the chunks, even if the layout differs",
+        )
+
+    def handle(self, *args, **options):
+        version = continuous_aggregates.get_timescaledb_version()
+        if version is None or version < chunking.MINIMUM_VERSION:
+            raise CommandError(
+                "Rechunking needs TimescaleDB "
+                + ".".join(str(x) for x in chunking.MINIMUM_VERSION)
+                + " or later"
+            )
+        time_interval = settings.ENHYDRIS_CHUNK_TIME_INTERVAL
+        partitions = settings.ENHYDRIS_CHUNK_SPACE_PARTITIONS
+        if partitions < 1:
+            raise CommandError("ENHYDRIS_CHUNK_SPACE_PARTITIONS must be at least 1")
+        with connection.cursor() as cursor:
+            if not options["reorder_only"] and not chunking.layout_matches(
+                cursor, time_interval, partitions
+            ):
+                self._rebuild(cursor, time_interval, partitions)
+            count = chunking.reorder(cursor)
+        self.stdout.write(f"Reordered {count} chunks")
+
+    def _rebuild(self, cursor, time_interval, partitions):
+        if chunking.compression_is_enabled(cursor):
+            raise CommandError(
+                "Compression is enabled; run compress_timeseries_records "
+                "--decompress first, and compress_timeseries_records afterwards"
+            )
+        with transaction.atomic():
+            chunking.rebuild(cursor, time_interval, partitions)
+        self.stdout.write(
+            f"Reloaded the records in chunks of {time_interval} "
+            f"with {partitions} space partition(s)"
+        )
+        for rollup in continuous_aggregates.ROLLUPS:
+            if rollup.exists(cursor):
+                rollup.refresh(cursor)
+                self.stdout.write(f"Refreshed {rollup.view_name}")
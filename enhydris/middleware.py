@@ -0,0 +1,114 @@
+"""Compression of responses according to the Accept-Encoding of the request.
+
+This replaces Django's GZipMiddleware. It also supports zstd (if the optional
+zstandard package is installed), which compresses time series data about as well
+as gzip with a fraction of the CPU time, and it uses the compression levels of the
+ENHYDRIS_RESPONSE_COMPRESSION setting. Streamed responses are compressed as they
+are streamed, a chunk at a time. Responses whose content is already compressed,
+such as zip files, are left alone.
+"""
+import re
+import zlib
+from importlib.util import find_spec
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+# Content types that are compressed already, so that compressing them again would
+# waste CPU time for practically nothing.
+COMPRESSED_CONTENT_TYPES = (
+    "application/zip",
+    "application/gzip",
+    "application/vnd.apache.parquet",
+    "image/png",
+    "image/jpeg",
+)
+
+ENCODINGS = ("gzip", "zstd")
+
+# Non-streaming responses shorter than this are not worth compressing
+MINIMUM_LENGTH = 200
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    def process_response(self, request, response):
+        if response.has_header("Content-Encoding") or not self._is_compressible(
+            response
+        ):
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = choose_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None:
+            return response
+        level = settings.ENHYDRIS_RESPONSE_COMPRESSION[encoding]
+        if response.streaming:
+            response.streaming_content = _compress_sequence(
+                response.streaming_content, encoding, level
+            )
+            del response["Content-Length"]
+        else:
+            content = _compress_sequence([response.content], encoding, level)
+            compressed_content = b"".join(content)
+            if len(compressed_content) >= len(response.content):
+                return response
+            response.content = compressed_content
+            response["Content-Length"] = str(len(response.content))
+
+        # The compressed representation is not byte-for-byte the same as the
+        # uncompressed one (see the same in Django's GZipMiddleware).
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = encoding
+        return response
+
+    def _is_compressible(self, response):
+        if not response.streaming and len(response.content) < MINIMUM_LENGTH:
+            return False
+        content_type = response.get("Content-Type", "").split(";")[0].strip()
+        return content_type not in COMPRESSED_CONTENT_TYPES
+
+
+def choose_encoding(accept_encoding):
+    """Return the encoding to use for a request's Accept-Encoding, or None.
+
+    The encoding is the first one in ENHYDRIS_RESPONSE_COMPRESSION that is
+    supported and available and that the client accepts (with a nonzero q). As in
+    RFC 7231, "*" accepts any encoding that is not listed explicitly.
+    """
+    qvalues = {}
+    for item in accept_encoding.split(","):
+        match = re.match(r"\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?", item)
+        if match is None:
+            continue
+        encoding, q = match.groups()
+        try:
+            qvalues[encoding.lower()] = 1.0 if q is None else float(q)
+        except ValueError:
+            continue
+    for encoding in settings.ENHYDRIS_RESPONSE_COMPRESSION:
+        if not qvalues.get(encoding, qvalues.get("*")) or encoding not in ENCODINGS:
+            continue
+        if encoding == "zstd" and find_spec("zstandard") is None:
+            continue
+        return encoding
+    return None
+
+
+def _compress_sequence(sequence, encoding, level):
+    """Compress an iterable of bytes, yielding compressed bytes as they are ready."""
+    if encoding == "zstd":
+        import zstandard
+
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    else:
+        # wbits=31 means a gzip header and trailer
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for item in sequence:
+        if isinstance(item, str):
+            item = item.encode()
+        data = compressor.compress(item)
+        if data:
+            yield data
+    yield compressor.flush()
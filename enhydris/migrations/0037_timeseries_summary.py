@@ -0,0 +1,61 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("enhydris", "0036_remove_timeseries_datafile_and_bounding_dates"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="timeseries",
+            name="start_date_utc",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="timeseries",
+            name="end_date_utc",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="timeseries",
+            name="records_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="timeseries",
+            name="last_record_value",
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="timeseries",
+            name="last_record_flags",
+            field=models.CharField(blank=True, editable=False, max_length=237),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE enhydris_timeseries t
+            SET
+                start_date_utc = s.start_date_utc,
+                end_date_utc = s.end_date_utc,
+                records_count = s.records_count
+            FROM (
+                SELECT
+                    timeseries_id,
+                    MIN("timestamp") AS start_date_utc,
+                    MAX("timestamp") AS end_date_utc,
+                    COUNT(*) AS records_count
+                FROM enhydris_timeseriesrecord
+                GROUP BY timeseries_id
+            ) s
+            WHERE t.id = s.timeseries_id;
+
+            UPDATE enhydris_timeseries t
+            SET last_record_value = r.value, last_record_flags = r.flags
+            FROM enhydris_timeseriesrecord r
+            WHERE r.timeseries_id = t.id AND r."timestamp" = t.end_date_utc;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
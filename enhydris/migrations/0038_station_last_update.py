@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("enhydris", "0037_timeseries_summary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="station",
+            name="last_update",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE enhydris_station s
+            SET last_update = t.last_update
+            FROM (
+                SELECT gentity_id, MAX(end_date_utc) AS last_update
+                FROM enhydris_timeseries
+                GROUP BY gentity_id
+            ) t
+            WHERE s.gpoint_ptr_id = t.gentity_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
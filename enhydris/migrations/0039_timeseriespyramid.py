@@ -0,0 +1,72 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("enhydris", "0038_station_last_update"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            CREATE TABLE enhydris_timeseriespyramid (
+                timeseries_id INTEGER NOT NULL
+                    REFERENCES enhydris_timeseries(id) ON DELETE CASCADE
+                    DEFERRABLE INITIALLY DEFERRED,
+                level CHAR(1) NOT NULL,
+                bucket TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                min DOUBLE PRECISION NOT NULL,
+                max DOUBLE PRECISION NOT NULL,
+                sum DOUBLE PRECISION NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (timeseries_id, level, bucket)
+            )
+            """,
+            reverse_sql="DROP TABLE enhydris_timeseriespyramid",
+        ),
+        migrations.RunSQL(
+            """
+            INSERT INTO enhydris_timeseriespyramid
+                (timeseries_id, level, bucket, min, max, sum, count)
+            SELECT
+                r.timeseries_id,
+                'H',
+                date_trunc(
+                    'hour',
+                    r."timestamp" AT TIME ZONE make_interval(mins => z.utc_offset)
+                ),
+                MIN(NULLIF(r.value, 'NaN')),
+                MAX(NULLIF(r.value, 'NaN')),
+                SUM(NULLIF(r.value, 'NaN')),
+                COUNT(NULLIF(r.value, 'NaN'))
+            FROM enhydris_timeseriesrecord r
+            JOIN enhydris_timeseries t ON t.id = r.timeseries_id
+            JOIN enhydris_timezone z ON z.id = t.time_zone_id
+            GROUP BY 1, 3
+            HAVING COUNT(NULLIF(r.value, 'NaN')) > 0;
+
+            INSERT INTO enhydris_timeseriespyramid
+                (timeseries_id, level, bucket, min, max, sum, count)
+            SELECT timeseries_id, 'D', date_trunc('day', bucket),
+                MIN(min), MAX(max), SUM(sum), SUM(count)
+            FROM enhydris_timeseriespyramid WHERE level = 'H'
+            GROUP BY 1, 3;
+
+            INSERT INTO enhydris_timeseriespyramid
+                (timeseries_id, level, bucket, min, max, sum, count)
+            SELECT timeseries_id, 'M', date_trunc('month', bucket),
+                MIN(min), MAX(max), SUM(sum), SUM(count)
+            FROM enhydris_timeseriespyramid WHERE level = 'D'
+            GROUP BY 1, 3;
+
+            INSERT INTO enhydris_timeseriespyramid
+                (timeseries_id, level, bucket, min, max, sum, count)
+            SELECT timeseries_id, 'Y', date_trunc('year', bucket),
+                MIN(min), MAX(max), SUM(sum), SUM(count)
+            FROM enhydris_timeseriespyramid WHERE level = 'M'
+            GROUP BY 1, 3;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("enhydris", "0039_timeseriespyramid"),
+    ]
+
+    # Both indexes duplicate the leading column of another index (the primary key
+    # and the ("timestamp", timeseries_id) index respectively), so they only slow
+    # down inserts. The second one was created by create_hypertable().
+    operations = [
+        migrations.RunSQL(
+            "DROP INDEX IF EXISTS enhydris_timeseriesrecord_timeseries_id_idx",
+            reverse_sql="CREATE INDEX enhydris_timeseriesrecord_timeseries_id_idx "
+            "ON enhydris_timeseriesrecord(timeseries_id)",
+        ),
+        migrations.RunSQL(
+            "DROP INDEX IF EXISTS enhydris_timeseriesrecord_timestamp_idx",
+            reverse_sql="CREATE INDEX enhydris_timeseriesrecord_timestamp_idx "
+            'ON enhydris_timeseriesrecord("timestamp" DESC)',
+        ),
+    ]
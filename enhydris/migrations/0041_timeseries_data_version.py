@@ -0,0 +1,24 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("enhydris", "0040_drop_redundant_record_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="timeseries",
+            name="data_version",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="timeseries",
+            name="data_last_modified",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False
+            ),
+        ),
+    ]
@@ -1,22 +1,36 @@
 from datetime import timedelta, timezone
+from io import BytesIO, StringIO
 from itertools import islice
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.gis.db import models
-from django.core.cache import cache
 from django.core.files.storage import FileSystemStorage
-from django.db import IntegrityError
-from django.db.models.signals import post_save
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Max
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.utils._os import abspathu
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
+import numpy as np
 import pandas as pd
 from htimeseries import HTimeseries
+from htimeseries.htimeseries import MetadataWriter
 from parler.managers import TranslatableManager
 from parler.models import TranslatableModel, TranslatedFields
 
+from enhydris import (
+    columnar,
+    compression,
+    continuous_aggregates,
+    downsampling,
+    pyramid,
+    stats,
+    timeseries_cache,
+)
+from enhydris.timeseries_cache import TimeseriesCache
+
 
 def check_time_step(time_step):
     if not time_step:
@@ -262,27 +276,35 @@ class Station(Gpoint):
     maintainers = models.ManyToManyField(
         User, blank=True, related_name="maintaining_stations"
     )
+    # The end date of the time series of the station that ends last; it is
+    # maintained whenever the records of its time series change.
+    last_update = models.DateTimeField(null=True, blank=True, editable=False)
 
     f_dependencies = ["Gpoint"]
 
+    def save(self, *args, **kwargs):
+        _exclude_fields_from_update(self, ("last_update",), args, kwargs)
+        super().save(*args, **kwargs)
+
     @property
-    def last_update(self):
-        timeseries = Timeseries.objects.filter(gentity_id=self.id)
-        result = None
-        for t in timeseries:
-            try:
-                latest_record = TimeseriesRecord.objects.filter(
-                    timeseries_id=t.id
-                ).latest()
-            except TimeseriesRecord.DoesNotExist:
-                continue
-            latest_timestamp = latest_record.timestamp.astimezone(
-                t.time_zone.as_tzinfo
-            ).replace(tzinfo=None)
-
-            if result is None or latest_timestamp > result:
-                result = latest_timestamp
-        return result
+    def last_update_naive(self):
+        """last_update in the time zone of the time series that ends last."""
+        if self.last_update is None:
+            return None
+        timeseries = (
+            Timeseries.objects.filter(gentity_id=self.id, end_date_utc=self.last_update)
+            .select_related("time_zone")
+            .first()
+        )
+        return timeseries.end_date_naive if timeseries else None
+
+
+def update_last_update_of_station(station_id):
+    """Set the last_update of the station from the end dates of its time series."""
+    last_update = Timeseries.objects.filter(gentity_id=station_id).aggregate(
+        Max("end_date_utc")
+    )["end_date_utc__max"]
+    Station.objects.filter(id=station_id).update(last_update=last_update)
 
 
 #
@@ -388,6 +410,32 @@ class Timeseries(models.Model):
         ),
     )
 
+    # Summary of the records, maintained whenever records are inserted or deleted,
+    # so that showing the dates and the last record of a time series doesn't need
+    # to query the records. It can be recalculated with rebuild_summary().
+    start_date_utc = models.DateTimeField(null=True, blank=True, editable=False)
+    end_date_utc = models.DateTimeField(null=True, blank=True, editable=False)
+    records_count = models.IntegerField(default=0, editable=False)
+    last_record_value = models.FloatField(null=True, blank=True, editable=False)
+    last_record_flags = models.CharField(max_length=237, blank=True, editable=False)
+
+    # Incremented whenever the records or the time series (or its station, variable,
+    # unit of measurement or time zone) change, so that clients that have the data
+    # can tell whether it has changed without getting it again (see the conditional
+    # requests of the web service API).
+    data_version = models.IntegerField(default=0, editable=False)
+    data_last_modified = models.DateTimeField(default=now, editable=False)
+
+    summary_fields = (
+        "start_date_utc",
+        "end_date_utc",
+        "records_count",
+        "last_record_value",
+        "last_record_flags",
+        "data_version",
+        "data_last_modified",
+    )
+
     class Meta:
         verbose_name = "Time Series"
         verbose_name_plural = "Time Series"
@@ -395,43 +443,71 @@ class Timeseries(models.Model):
 
     @property
     def start_date(self):
-        try:
-            return self.timeseriesrecord_set.earliest().timestamp.astimezone(
-                self.time_zone.as_tzinfo
-            )
-        except TimeseriesRecord.DoesNotExist:
+        if self.start_date_utc is None:
             return None
+        return self.start_date_utc.astimezone(self.time_zone.as_tzinfo)
 
     @property
     def end_date(self):
-        try:
-            return self.timeseriesrecord_set.latest().timestamp.astimezone(
-                self.time_zone.as_tzinfo
-            )
-        except TimeseriesRecord.DoesNotExist:
+        if self.end_date_utc is None:
             return None
+        return self.end_date_utc.astimezone(self.time_zone.as_tzinfo)
 
     @property
     def start_date_naive(self):
-        try:
-            return (
-                self.timeseriesrecord_set.earliest()
-                .timestamp.astimezone(self.time_zone.as_tzinfo)
-                .replace(tzinfo=None)
-            )
-        except TimeseriesRecord.DoesNotExist:
-            return None
+        return self._make_naive(self.start_date_utc)
 
     @property
     def end_date_naive(self):
-        try:
-            return (
-                self.timeseriesrecord_set.latest()
-                .timestamp.astimezone(self.time_zone.as_tzinfo)
-                .replace(tzinfo=None)
-            )
-        except TimeseriesRecord.DoesNotExist:
-            return None
+        return self._make_naive(self.end_date_utc)
+
+    def rebuild_summary(self):
+        """Recalculate the summary and pyramid of the records from the records."""
+        Timeseries.objects.filter(id=self.id).update(records_count=0)
+        self._update_summary(self.timeseriesrecord_set.count(), records_changed=True)
+        pyramid.update(self)
+
+    def _update_summary(self, records_count_change, records_changed=None):
+        """Update the summary of the records after records have been changed.
+
+        "records_count_change" is the number of records that have been inserted (or
+        deleted, if negative). The dates and the last record are read with two
+        lookups on the primary key. If "records_changed" is true (by default, if
+        records_count_change is nonzero), the data version is also incremented.
+        """
+        if records_changed is None:
+            records_changed = bool(records_count_change)
+        records = self.timeseriesrecord_set
+        first_record = records.order_by("timestamp").values_list("timestamp").first()
+        last_record = (
+            records.order_by("-timestamp")
+            .values_list("timestamp", "value", "flags")
+            .first()
+        )
+        self.start_date_utc = first_record[0] if first_record else None
+        (
+            self.end_date_utc,
+            self.last_record_value,
+            self.last_record_flags,
+        ) = last_record or (None, None, "")
+        data_version_fields = {}
+        if records_changed:
+            data_version_fields = {
+                "data_version": F("data_version") + 1,
+                "data_last_modified": now(),
+            }
+        Timeseries.objects.filter(id=self.id).update(
+            start_date_utc=self.start_date_utc,
+            end_date_utc=self.end_date_utc,
+            last_record_value=self.last_record_value,
+            last_record_flags=self.last_record_flags,
+            records_count=F("records_count") + records_count_change,
+            **data_version_fields,
+        )
+        self.refresh_from_db(
+            fields=["records_count", "data_version", "data_last_modified"]
+        )
+        update_last_update_of_station(self.gentity_id)
 
     def _set_extra_timeseries_properties(self, ahtimeseries):
         if self.gentity.geom:
@@ -457,41 +533,249 @@ class Timeseries(models.Model):
         ahtimeseries.location = location
         ahtimeseries.comment = "%s\n\n%s" % (self.gentity.name, self.remarks)
 
+    def _make_naive(self, date):
+        if date is None:
+            return None
+        return date.astimezone(self.time_zone.as_tzinfo).replace(tzinfo=None)
+
     def get_data(self, start_date=None, end_date=None):
-        data = cache.get_or_set(f"timeseries_data_{self.id}", self._get_all_data_as_pd)
-        if start_date:
-            start_date = start_date.astimezone(self.time_zone.as_tzinfo)
-            start_date = start_date.replace(tzinfo=None)
-        if end_date:
-            end_date = end_date.astimezone(self.time_zone.as_tzinfo)
-            end_date = end_date.replace(tzinfo=None)
-        data = data.loc[start_date:end_date]
+        start_date = self._make_naive(start_date)
+        end_date = self._make_naive(end_date)
+        data = TimeseriesCache(self).get(start_date, end_date)
         result = HTimeseries(data)
         self._set_extra_timeseries_properties(result)
         return result
 
-    def _get_all_data_as_pd(self):
-        tzinfo = self.time_zone.as_tzinfo
-        data = {"value": [], "flags": []}
-        index = []
-        for record in self.timeseriesrecord_set.all().order_by("timestamp"):
-            timestamp = record.timestamp.astimezone(tzinfo).replace(tzinfo=None)
-            index.append(timestamp)
-            data["value"].append(record.value)
-            data["flags"].append(record.flags)
-        result = pd.DataFrame(data=data, columns=["value", "flags"], index=index)
-        result.index.name = "date"
+    @classmethod
+    def get_many_data(cls, timeseries_list, start_date=None, end_date=None):
+        """Return the data of many time series, like get_data() for each one.
+
+        The data of all the time series is read from the cache at once (see
+        enhydris.timeseries_cache.get_many()). Returns a list of HTimeseries objects.
+        """
+        dates = [
+            (t._make_naive(start_date), t._make_naive(end_date))
+            for t in timeseries_list
+        ]
+        result = []
+        for t, data in zip(
+            timeseries_list, timeseries_cache.get_many(timeseries_list, dates)
+        ):
+            ahtimeseries = HTimeseries(data)
+            t._set_extra_timeseries_properties(ahtimeseries)
+            result.append(ahtimeseries)
+        return result
+
+    def get_chart_data(
+        self, start_date=None, end_date=None, npoints=200, method="minmax"
+    ):
+        """Return about npoints records between start_date and end_date for a chart.
+
+        The records are read from the cache, which only loads the years that overlap
+        the range, or, if there are too many of them, the buckets of a level of the
+        pyramid are read instead (see enhydris.pyramid). They are then reduced with
+        enhydris.downsampling.downsample(). The result is a pandas series with a naive
+        datetime index, in the time zone of the time series.
+        """
+        start_date = self._make_naive(start_date)
+        end_date = self._make_naive(end_date)
+        level = pyramid.choose_level(self, start_date, end_date, npoints)
+        if level is None:
+            data = TimeseriesCache(self).get(start_date, end_date)
+        else:
+            data = pyramid.get_chart_dataframe(
+                self, level, start_date, end_date, method
+            )
+        return downsampling.downsample(data, npoints, method)
+
+    def get_statistics(self, start_date=None, end_date=None, vector=False):
+        """Return statistics of the records between start_date and end_date.
+
+        See enhydris.stats.get_statistics(); the dates in the result are naive, in
+        the time zone of the time series.
+        """
+        start_date = self._make_naive(start_date)
+        end_date = self._make_naive(end_date)
+        data = TimeseriesCache(self).get(start_date, end_date)
+        return stats.get_statistics(data, vector)
+
+    def iter_data(
+        self, start_date=None, end_date=None, format=HTimeseries.TEXT, version=5
+    ):
+        """Return an iterator over the data in text (CSV) or file (HTS) format.
+
+        The result is the same as writing the result of get_data() to a file, but
+        the records are formatted by the database and read a chunk at a time, so
+        that memory usage does not depend on the number of records. Each item of the
+        iterator is a string with many lines. "format" can also be "parquet" or
+        "arrow" (see enhydris.columnar), in which case each item is bytes.
+        """
+        if format in columnar.FORMATS:
+            yield from self._iter_columnar_data(start_date, end_date, format)
+            return
+        if format == HTimeseries.FILE:
+            yield self._get_data_file_header(start_date, end_date, version)
+        yield from TimeseriesRecord.iter_csv(self, start_date, end_date)
+
+    def _iter_columnar_data(self, start_date, end_date, format):
+        ahtimeseries = HTimeseries()
+        self._set_extra_timeseries_properties(ahtimeseries)
+        yield from columnar.iter_file(
+            format,
+            [("value", "float"), ("flags", "str")],
+            TimeseriesRecord.iter_dataframes(
+                self, start_date, end_date, chunk_size=columnar.BATCH_SIZE
+            ),
+            columnar.get_metadata(ahtimeseries),
+        )
+
+    def _get_data_file_header(self, start_date, end_date, version):
+        ahtimeseries = HTimeseries()
+        self._set_extra_timeseries_properties(ahtimeseries)
+        count = self._count_records(start_date, end_date)
+        f = StringIO()
+        _MetadataWriterWithCount(f, ahtimeseries, version, count).write_meta()
+        f.write("\r\n")
+        return f.getvalue()
+
+    def _count_records(self, start_date, end_date):
+        return self._get_records(start_date, end_date).count()
+
+    def _get_records(self, start_date, end_date):
+        records = self.timeseriesrecord_set.all()
+        if start_date:
+            records = records.filter(timestamp__gte=start_date)
+        if end_date:
+            records = records.filter(timestamp__lte=end_date)
+        return records
+
+    def get_aggregated_data(self, time_step, functions, start_date=None, end_date=None):
+        """Return the data aggregated by the database.
+
+        "time_step" is like Timeseries.time_step (but it can't be empty, and months and
+        years can't have a number). "functions" is a list of aggregation functions
+        ("mean", "sum", "min", "max", "count"). The result is a dictionary with the
+        functions as keys and HTimeseries objects as values. Each timestamp is the
+        start of an interval, in the time zone of the time series; intervals without
+        records are omitted.
+        """
+        data = TimeseriesRecord.get_aggregated_dataframe(
+            self, time_step, functions, start_date, end_date
+        )
+        result = {}
+        for function in functions:
+            ahtimeseries = HTimeseries(
+                pd.DataFrame(
+                    {"value": data[function], "flags": ""},
+                    columns=["value", "flags"],
+                    index=data.index,
+                )
+            )
+            self._set_extra_timeseries_properties(ahtimeseries)
+            ahtimeseries.time_step = time_step
+            if function == "count":
+                ahtimeseries.precision = 0
+            result[function] = ahtimeseries
         return result
 
+    def _get_all_data_as_pd(self):
+        return self._get_data_as_pd_from_db()
+
+    def _get_data_as_pd_from_db(self, start_date=None, end_date=None):
+        return TimeseriesRecord.get_dataframe(self, start_date, end_date)
+
     def set_data(self, data):
         ahtimeseries = self._get_htimeseries_from_data(data)
-        self.timeseriesrecord_set.all().delete()
+        self._delete_records()
         return TimeseriesRecord.bulk_insert(self, ahtimeseries)
 
+    def _delete_records(self, start_date=None, end_date=None):
+        naive_start_date = self._make_naive(start_date)
+        naive_end_date = self._make_naive(end_date)
+        self._decompress_records(naive_start_date, naive_end_date)
+        deleted, _ = self._get_records(start_date, end_date).delete()
+        start_date, end_date = naive_start_date, naive_end_date
+        TimeseriesCache(self).invalidate_on_commit(start_date, end_date)
+        self._update_summary(-deleted)
+        if deleted:
+            pyramid.update(self, start_date, end_date)
+
+    def _decompress_records(self, start_date=None, end_date=None):
+        """Make the records between the (naive) dates deletable if compressed.
+
+        None means the start or end of the time series, so that only the chunks
+        that contain its records are decompressed.
+        """
+        if not self.records_count:
+            return
+        compression.decompress_for_write(
+            self, start_date or self.start_date_naive, end_date or self.end_date_naive
+        )
+
     def append_data(self, data):
         ahtimeseries = self._get_htimeseries_from_data(data)
-        self._check_new_data_is_newer(ahtimeseries)
-        return TimeseriesRecord.bulk_insert(self, ahtimeseries)
+        with transaction.atomic():
+            self._refresh_summary_for_update()
+            self._check_new_data_is_newer(ahtimeseries)
+            return TimeseriesRecord.bulk_insert(self, ahtimeseries)
+
+    def _refresh_summary_for_update(self):
+        """Lock the time series until the end of the transaction and reread its summary.
+
+        Another process may have added records since this object was loaded; the lock
+        makes any other writer that does the same wait until the transaction ends.
+        """
+        fields = [
+            "start_date_utc",
+            "end_date_utc",
+            "last_record_value",
+            "last_record_flags",
+            "records_count",
+        ]
+        timeseries = Timeseries.objects.select_for_update().filter(id=self.id)
+        for field, value in timeseries.values(*fields).get().items():
+            setattr(self, field, value)
+
+    def merge_data(self, data):
+        """Insert the records of data that are new and update those that differ.
+
+        Unlike append_data(), the records may overlap the existing ones or be earlier
+        than them. Returns a dictionary with the number of records that were
+        "inserted", "updated" and "unchanged".
+        """
+        ahtimeseries = self._get_htimeseries_from_data(data)
+        return TimeseriesRecord.merge(self, ahtimeseries)
+
+    def replace_range(self, start_date, end_date, data):
+        """Replace the records between start_date and end_date (inclusive) with data.
+
+        The dates are aware; None means no limit. The records of data must be within
+        the range; if data is empty, the records of the range are simply deleted.
+        The deletion and the insertion are done in a single transaction, and only
+        the cached data of the range is invalidated. Returns the number of records
+        inserted.
+        """
+        ahtimeseries = self._get_htimeseries_from_data(data)
+        naive_start_date = self._make_naive(start_date)
+        naive_end_date = self._make_naive(end_date)
+        self._check_data_is_within_range(ahtimeseries, naive_start_date, naive_end_date)
+        with transaction.atomic():
+            self._delete_records(start_date, end_date)
+            return TimeseriesRecord.bulk_insert(self, ahtimeseries)
+
+    def _check_data_is_within_range(self, ahtimeseries, start_date, end_date):
+        index = ahtimeseries.data.index
+        if not len(index):
+            return
+        if (start_date and index.min() < start_date) or (
+            end_date and index.max() > end_date
+        ):
+            raise ValueError(
+                (
+                    "Cannot replace range: the records to insert ({} to {}) are "
+                    "outside the range to replace ({} to {})."
+                ).format(index.min(), index.max(), start_date, end_date)
+            )
 
     def _check_new_data_is_newer(self, ahtimeseries):
         if not len(ahtimeseries.data):
@@ -513,10 +797,12 @@ class Timeseries(models.Model):
             return HTimeseries(data)
 
     def get_last_record_as_string(self):
-        try:
-            return str(self.timeseriesrecord_set.latest())
-        except TimeseriesRecord.DoesNotExist:
+        if self.end_date_utc is None:
             return ""
+        datestr = self.end_date.strftime("%Y-%m-%d %H:%M")
+        value = self.last_record_value
+        valuestr = "" if value is None else f"{value:.{self.precision}f}"
+        return f"{datestr},{valuestr},{self.last_record_flags}"
 
     @property
     def related_station(self):
@@ -530,8 +816,113 @@ class Timeseries(models.Model):
 
     def save(self, force_insert=False, force_update=False, *args, **kwargs):
         check_time_step(self.time_step)
+        _exclude_fields_from_update(self, self.summary_fields, args, kwargs)
+        adding = self._state.adding
+        time_zone_has_changed = self._time_zone_has_changed()
+        saved_gentity_id = self._get_saved_gentity_id()
         super(Timeseries, self).save(force_insert, force_update, *args, **kwargs)
-        cache.delete(f"timeseries_data_{self.id}")
+        if time_zone_has_changed:
+            # The buckets of the pyramid are in the time zone of the time series
+            pyramid.update(self)
+        if saved_gentity_id is not None and saved_gentity_id != self.gentity_id:
+            # The time series has moved to another station
+            update_last_update_of_station(saved_gentity_id)
+            update_last_update_of_station(self.gentity_id)
+        if not adding:
+            # The time zone, precision etc. affect the data as retrieved
+            Timeseries.objects.filter(id=self.id).update(
+                data_version=F("data_version") + 1, data_last_modified=now()
+            )
+            self.refresh_from_db(fields=["data_version", "data_last_modified"])
+
+    def _get_saved_gentity_id(self):
+        if self._state.adding:
+            return None
+        return (
+            Timeseries.objects.filter(id=self.id)
+            .values_list("gentity_id", flat=True)
+            .first()
+        )
+
+    def _time_zone_has_changed(self):
+        if self._state.adding or not self.records_count:
+            return False
+        return (
+            Timeseries.objects.filter(id=self.id)
+            .exclude(time_zone_id=self.time_zone_id)
+            .exists()
+        )
+
+
+def pre_delete_timeseries(sender, **kwargs):
+    # The records are deleted together with the time series
+    kwargs["instance"]._decompress_records()
+
+
+pre_delete.connect(pre_delete_timeseries, sender=Timeseries)
+
+
+def post_delete_timeseries(sender, **kwargs):
+    update_last_update_of_station(kwargs["instance"].gentity_id)
+
+
+post_delete.connect(post_delete_timeseries, sender=Timeseries)
+
+
+def post_save_timeseries_metadata(sender, **kwargs):
+    """Increment the data version of the time series that use the saved object.
+
+    The data of a time series in HTS includes properties of its station, variable,
+    unit of measurement and time zone, so changing them changes the data.
+    """
+    instance = kwargs["instance"]
+    if issubclass(sender, Gentity):
+        timeseries = Timeseries.objects.filter(gentity_id=instance.id)
+    elif sender is UnitOfMeasurement:
+        timeseries = Timeseries.objects.filter(unit_of_measurement_id=instance.id)
+    elif sender is TimeZone:
+        timeseries = Timeseries.objects.filter(time_zone_id=instance.id)
+    else:
+        # The description of the variable is in its translations
+        timeseries = Timeseries.objects.filter(variable_id=instance.master_id)
+    timeseries.update(data_version=F("data_version") + 1, data_last_modified=now())
+
+
+post_save.connect(post_save_timeseries_metadata, sender=Gentity)
+post_save.connect(post_save_timeseries_metadata, sender=Station)
+post_save.connect(post_save_timeseries_metadata, sender=UnitOfMeasurement)
+post_save.connect(post_save_timeseries_metadata, sender=TimeZone)
+post_save.connect(
+    post_save_timeseries_metadata, sender=Variable._parler_meta.root_model
+)
+
+
+def _exclude_fields_from_update(instance, fields, args, kwargs):
+    """Make instance.save() not write the specified fields if it's an update.
+
+    The fields are maintained by updates of the database that don't go through
+    save(), so they may have changed since the instance was loaded (e.g. by data
+    being appended in another request). "args" and "kwargs" are the additional
+    arguments of save(); "kwargs" is modified.
+    """
+    if instance._state.adding or args or "update_fields" in kwargs:
+        return
+    kwargs["update_fields"] = [
+        f.name
+        for f in instance._meta.concrete_fields
+        if not f.primary_key and f.name not in fields
+    ]
+
+
+class _MetadataWriterWithCount(MetadataWriter):
+    """A MetadataWriter that writes a count without needing the data."""
+
+    def __init__(self, f, htimeseries, version, count):
+        super().__init__(f, htimeseries, version)
+        self.count = count
+
+    def write_count(self):
+        self.f.write("Count={}\r\n".format(self.count))
 
 
 class TimeseriesRecord(models.Model):
@@ -553,6 +944,126 @@ class TimeseriesRecord(models.Model):
 
     @classmethod
     def bulk_insert(cls, timeseries, htimeseries):
+        if len(htimeseries.data):
+            index = htimeseries.data.index
+            compression.decompress_for_write(timeseries, index.min(), index.max())
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                count = cls._copy_insert(timeseries, htimeseries.data)
+            else:
+                count = cls._bulk_create(timeseries, htimeseries.data)
+            timeseries._update_summary(count)
+            if count:
+                index = htimeseries.data.index
+                start_date, end_date = index.min(), index.max()
+                pyramid.update(timeseries, start_date, end_date)
+                TimeseriesCache(timeseries).invalidate_on_commit(start_date, end_date)
+        return count
+
+    @classmethod
+    def merge(cls, timeseries, htimeseries):
+        """Insert or update the records of htimeseries (see Timeseries.merge_data()).
+
+        The records are copied to a temporary table, and from there they are merged
+        into the time series with a single "INSERT ... ON CONFLICT DO UPDATE", which
+        only updates the records whose value or flags differ.
+        """
+        data = htimeseries.data
+        result = {"inserted": 0, "updated": 0, "unchanged": 0}
+        if not len(data):
+            return result
+        compression.decompress_for_write(timeseries, data.index.min(), data.index.max())
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                """
+                CREATE TEMPORARY TABLE IF NOT EXISTS enhydris_timeseriesrecord_merge
+                    (LIKE enhydris_timeseriesrecord) ON COMMIT DROP;
+                TRUNCATE enhydris_timeseriesrecord_merge;
+                """
+            )
+            cls._copy_insert(timeseries, data, table="enhydris_timeseriesrecord_merge")
+            cursor.execute(
+                """
+                SELECT
+                    COUNT(*) FILTER (WHERE r.timeseries_id IS NULL),
+                    COUNT(*) FILTER (
+                        WHERE r.timeseries_id IS NOT NULL
+                        AND (r.value, r.flags) IS DISTINCT FROM (m.value, m.flags)
+                    )
+                FROM enhydris_timeseriesrecord_merge m
+                LEFT JOIN enhydris_timeseriesrecord r
+                    ON r.timeseries_id = m.timeseries_id
+                    AND r."timestamp" = m."timestamp"
+                """
+            )
+            result["inserted"], result["updated"] = cursor.fetchone()
+            cursor.execute(
+                """
+                INSERT INTO enhydris_timeseriesrecord
+                    (timeseries_id, "timestamp", value, flags)
+                SELECT timeseries_id, "timestamp", value, flags
+                FROM enhydris_timeseriesrecord_merge
+                ON CONFLICT (timeseries_id, "timestamp") DO UPDATE
+                    SET value = EXCLUDED.value, flags = EXCLUDED.flags
+                    WHERE (enhydris_timeseriesrecord.value,
+                           enhydris_timeseriesrecord.flags)
+                        IS DISTINCT FROM (EXCLUDED.value, EXCLUDED.flags)
+                """
+            )
+            result["unchanged"] = len(data) - result["inserted"] - result["updated"]
+            timeseries._update_summary(
+                result["inserted"], bool(result["inserted"] or result["updated"])
+            )
+            if result["inserted"] or result["updated"]:
+                start_date, end_date = data.index.min(), data.index.max()
+                pyramid.update(timeseries, start_date, end_date)
+                TimeseriesCache(timeseries).invalidate_on_commit(start_date, end_date)
+        return result
+
+    @classmethod
+    def _copy_insert(
+        cls, timeseries, data, batch_size=100000, table="enhydris_timeseriesrecord"
+    ):
+        """Insert the records with "COPY ... FROM STDIN".
+
+        The records are converted to CSV for a whole batch at once; the timestamps
+        are converted to UTC and formatted by numpy, and the values and flags are
+        formatted by pandas.
+        """
+        utc_offset = pd.Timedelta(minutes=timeseries.time_zone.utc_offset)
+        with connection.cursor() as cursor:
+            for start in range(0, len(data), batch_size):
+                end = start + batch_size
+                batch = data.iloc[start:end]
+                timestamps = np.datetime_as_string(
+                    (pd.DatetimeIndex(batch.index) - utc_offset).values,
+                    unit="s",
+                    timezone="UTC",
+                )
+                f = StringIO()
+                pd.DataFrame(
+                    {
+                        "timeseries_id": timeseries.id,
+                        "timestamp": timestamps,
+                        "value": batch["value"].values,
+                        "flags": batch["flags"].values,
+                    }
+                ).to_csv(f, header=False, index=False)
+                f.seek(0)
+                # Django's cursor wrapper doesn't translate the errors of
+                # copy_expert(), e.g. psycopg2.IntegrityError to IntegrityError.
+                with connection.wrap_database_errors:
+                    cursor.copy_expert(
+                        f"""
+                        COPY {table} (timeseries_id, "timestamp", value, flags)
+                        FROM STDIN WITH (FORMAT CSV, FORCE_NOT_NULL (flags))
+                        """,
+                        f,
+                    )
+        return len(data)
+
+    @classmethod
+    def _bulk_create(cls, timeseries, data):
         tzinfo = timeseries.time_zone.as_tzinfo
         record_generator = (
             TimeseriesRecord(
@@ -561,7 +1072,7 @@ class TimeseriesRecord(models.Model):
                 value=t.value,
                 flags=t.flags,
             )
-            for t in htimeseries.data.itertuples()
+            for t in data.itertuples()
         )
         batch_size = 1000
         count = 0
@@ -573,6 +1084,219 @@ class TimeseriesRecord(models.Model):
             count += len(batch)
         return count
 
+    @classmethod
+    def get_dataframe(cls, timeseries, start_date=None, end_date=None):
+        """Return the records of the time series as a pandas dataframe.
+
+        The records are transferred with "COPY ... TO STDOUT" and parsed by pandas in
+        bulk, so that no Python object is created per record. The timestamps are
+        transferred as seconds since the epoch and are converted to the time zone of
+        the time series for the whole array at once.
+
+        If start_date and/or end_date (aware datetimes) are specified, only the
+        records between them (inclusive) are read, with a range scan on the
+        (timeseries_id, timestamp) primary key.
+        """
+        date_range_sql, date_range_params = _get_date_range_sql(start_date, end_date)
+        with connection.cursor() as cursor, BytesIO() as f:
+            query = cursor.mogrify(
+                f"""
+                COPY (
+                    SELECT EXTRACT(EPOCH FROM "timestamp")::bigint, value, flags
+                    FROM enhydris_timeseriesrecord
+                    WHERE timeseries_id = %s {date_range_sql}
+                    ORDER BY "timestamp"
+                ) TO STDOUT WITH (FORMAT CSV)
+                """,
+                [timeseries.id, *date_range_params],
+            )
+            with connection.wrap_database_errors:
+                cursor.copy_expert(query.decode(), f)
+            f.seek(0)
+            return _read_records_csv(f, timeseries.time_zone.utc_offset)
+
+    @classmethod
+    def iter_csv(cls, timeseries, start_date=None, end_date=None, chunk_size=10000):
+        """Return an iterator over the records of the time series in CSV.
+
+        The records are formatted like HTimeseries.write() formats them, in the time
+        zone and with the precision of the time series, but this is done by the
+        database. They are read with a server-side cursor, chunk_size records at a
+        time; each item of the iterator is a string with the lines of a chunk.
+        """
+        csv_line_sql, csv_line_params = _get_csv_line_sql(timeseries)
+        date_range_sql, date_range_params = _get_date_range_sql(start_date, end_date)
+        with transaction.atomic(), connection.chunked_cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT {csv_line_sql}
+                FROM enhydris_timeseriesrecord
+                WHERE timeseries_id = %s {date_range_sql}
+                ORDER BY "timestamp"
+                """,
+                [*csv_line_params, timeseries.id, *date_range_params],
+            )
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield "".join(row[0] for row in rows)
+
+    @classmethod
+    def iter_dataframes(
+        cls, timeseries, start_date=None, end_date=None, chunk_size=10000
+    ):
+        """Return an iterator over the records of the time series as dataframes.
+
+        The dataframes are like the result of get_dataframe() (except that the flags
+        are not categorical), with up to chunk_size records each. The records are
+        read with a server-side cursor, so that memory usage does not depend on the
+        number of records. If there are no records, there is a single empty
+        dataframe.
+        """
+        date_range_sql, date_range_params = _get_date_range_sql(start_date, end_date)
+        utc_offset = pd.Timedelta(minutes=timeseries.time_zone.utc_offset)
+        with transaction.atomic(), connection.chunked_cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT EXTRACT(EPOCH FROM "timestamp")::bigint, value, flags
+                FROM enhydris_timeseriesrecord
+                WHERE timeseries_id = %s {date_range_sql}
+                ORDER BY "timestamp"
+                """,
+                [timeseries.id, *date_range_params],
+            )
+            rows = cursor.fetchmany(chunk_size)
+            while True:
+                timestamps, values, flags = zip(*rows) if rows else ((), (), ())
+                index = pd.to_datetime(np.array(timestamps, dtype=np.int64), unit="s")
+                yield pd.DataFrame(
+                    {
+                        "value": np.array(values, dtype=np.float64),
+                        "flags": np.array(flags, dtype=object),
+                    },
+                    columns=["value", "flags"],
+                    index=pd.Index(index + utc_offset, name="date"),
+                )
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+
+    @classmethod
+    def get_head_or_tail_csv(cls, timeseries, n, tail):
+        """Return the first (or, if tail is true, the last) n records in CSV.
+
+        The records are formatted by the database like iter_csv() formats them, and
+        they are read with a scan of the primary key in the appropriate direction,
+        so this takes the same time however long the time series is.
+        """
+        direction = "DESC" if tail else "ASC"
+        csv_line_sql, csv_line_params = _get_csv_line_sql(timeseries)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT line FROM (
+                    SELECT "timestamp", {csv_line_sql} AS line
+                    FROM enhydris_timeseriesrecord
+                    WHERE timeseries_id = %s
+                    ORDER BY "timestamp" {direction}
+                    LIMIT %s
+                ) records
+                ORDER BY "timestamp"
+                """,
+                [*csv_line_params, timeseries.id, n],
+            )
+            return "".join(row[0] for row in cursor.fetchall())
+
+    @classmethod
+    def get_aggregated_dataframe(
+        cls, timeseries, time_step, functions, start_date=None, end_date=None
+    ):
+        """Return the records aggregated with time_bucket() as a pandas dataframe.
+
+        See Timeseries.get_aggregated_data() for the parameters. The result has a
+        naive datetime index and a float column for each function.
+
+        If a continuous aggregate that can serve the aggregation is enabled (see
+        enhydris.continuous_aggregates), it is aggregated further instead of the
+        records; if it turns out to be unavailable, the records are aggregated.
+        """
+        bucket_sql, bucket_params = _get_bucket_sql(time_step)
+        utc_offset = timeseries.time_zone.utc_offset
+        params = [*bucket_params, utc_offset, timeseries.id]
+
+        def aggregate_records(cursor):
+            aggregates_sql = ", ".join(_get_aggregate_sql(f) for f in functions)
+            date_range_sql, date_range_params = _get_date_range_sql(
+                start_date, end_date
+            )
+            cursor.execute(
+                f"""
+                SELECT {bucket_sql} AS bucket, {aggregates_sql}
+                FROM (
+                    SELECT
+                        "timestamp" AT TIME ZONE make_interval(mins => %s)
+                            AS local_timestamp,
+                        NULLIF(value, 'NaN') AS value
+                    FROM enhydris_timeseriesrecord
+                    WHERE timeseries_id = %s {date_range_sql}
+                ) records
+                GROUP BY bucket
+                ORDER BY bucket
+                """,
+                [*params, *date_range_params],
+            )
+            return cursor.fetchall()
+
+        def aggregate_rollup(cursor):
+            aggregates_sql = ", ".join(_get_rollup_aggregate_sql(f) for f in functions)
+            date_range_sql, date_range_params = _get_date_range_sql(
+                start_date, end_date, column="bucket"
+            )
+            cursor.execute(
+                f"""
+                SELECT {bucket_sql} AS bucket, {aggregates_sql}
+                FROM (
+                    SELECT
+                        bucket AT TIME ZONE make_interval(mins => %s)
+                            AS local_timestamp,
+                        sum,
+                        min,
+                        max,
+                        count
+                    FROM {rollup.view_name}
+                    WHERE timeseries_id = %s {date_range_sql}
+                ) rollup_rows
+                GROUP BY bucket
+                ORDER BY bucket
+                """,
+                [*params, *date_range_params],
+            )
+            return cursor.fetchall()
+
+        for function in functions:
+            _get_aggregate_sql(function)  # Raises ValueError if invalid
+        rollup = continuous_aggregates.choose_rollup(
+            _get_bucket_minutes(time_step), utc_offset, start_date, end_date
+        )
+        if rollup is None:
+            with connection.cursor() as cursor:
+                rows = aggregate_records(cursor)
+        else:
+            rows = continuous_aggregates.execute_with_fallback(
+                aggregate_rollup, aggregate_records
+            )
+        columns = list(zip(*rows)) or [[]] * (len(functions) + 1)
+        result = pd.DataFrame(
+            {
+                function: np.array(column, dtype=np.float64)
+                for function, column in zip(functions, columns[1:])
+            },
+            columns=functions,
+            index=pd.DatetimeIndex(columns[0], name="date"),
+        )
+        return result
+
     def __str__(self):
         tzinfo = self.timeseries.time_zone.as_tzinfo
         precision = self.timeseries.precision
@@ -580,6 +1304,152 @@ class TimeseriesRecord(models.Model):
         return f"{datestr},{self.value:.{precision}f},{self.flags}"
 
 
+def _get_csv_line_sql(timeseries):
+    """Return SQL that formats a TimeseriesRecord row as a line of CSV, and its params.
+
+    The result is a tuple (sql, params). The line is like those of HTimeseries.write():
+    the date is in the time zone of the time series, missing values are empty,
+    infinite ones are "inf" and "-inf", and the others are rounded to the precision
+    of the time series, with ties rounded to even. The rounding is done on the value
+    multiplied by a power of ten, so for a value that is not a tie but is within
+    about 1e-16 (relatively) of one, the last digit may differ from that of
+    HTimeseries.write(), which rounds the exact binary value.
+    """
+    precision = int(timeseries.precision)
+    if precision >= 0:
+        multiplier = 10 ** precision
+        rounded_value_sql = f"round(value * {multiplier}::float8) / {multiplier}"
+    else:
+        multiplier = 10 ** -precision
+        rounded_value_sql = f"round(value / {multiplier}::float8) * {multiplier}"
+    sql = f"""
+        to_char(
+            "timestamp" AT TIME ZONE make_interval(mins => %s), 'YYYY-MM-DD HH24:MI'
+        )
+        || ','
+        || CASE
+            WHEN value IS NULL OR value = 'NaN' THEN ''
+            WHEN value = 'Infinity' THEN 'inf'
+            WHEN value = '-Infinity' THEN '-inf'
+            -- round(float8) rounds ties to even; round(numeric) only sets the scale
+            ELSE round(({rounded_value_sql})::numeric, {precision})::text
+        END
+        || ','
+        || flags
+        || E'\\r\\n'
+    """
+    return sql, [timeseries.time_zone.utc_offset]
+
+
+def _get_date_range_sql(start_date, end_date, column='"timestamp"'):
+    """Return SQL that restricts TimeseriesRecord rows to a date range, and its params.
+
+    The result is a tuple (sql, params). The SQL is either empty or starts with "AND",
+    so that it can be appended to a WHERE clause. Unspecified dates are not limits.
+    """
+    sql = ""
+    params = []
+    if start_date:
+        sql += f" AND {column} >= %s"
+        params.append(start_date)
+    if end_date:
+        sql += f" AND {column} <= %s"
+        params.append(end_date)
+    return sql, params
+
+
+_BUCKET_INTERVALS = {"min": "minutes", "H": "hours", "D": "days"}
+_BUCKET_TRUNCATIONS = {"M": "month", "Y": "year"}
+
+
+def _get_bucket_sql(time_step):
+    """Return SQL that calculates the interval of local_timestamp, and its params."""
+    number, unit = _parse_time_step(time_step)
+    if unit in _BUCKET_INTERVALS and number != "0":
+        interval = "{} {}".format(number or 1, _BUCKET_INTERVALS[unit])
+        return "time_bucket(%s::interval, local_timestamp)", [interval]
+    elif unit in _BUCKET_TRUNCATIONS and number in ("", "1"):
+        return "date_trunc(%s, local_timestamp)", [_BUCKET_TRUNCATIONS[unit]]
+    raise ValueError('"{}" is not a valid aggregation time step'.format(time_step))
+
+
+def _get_bucket_minutes(time_step):
+    """Return the length of the intervals of _get_bucket_sql() in minutes.
+
+    Returns None for months and years.
+    """
+    number, unit = _parse_time_step(time_step)
+    multipliers = {"min": 1, "H": 60, "D": 1440}
+    if unit not in multipliers:
+        return None
+    return int(number or 1) * multipliers[unit]
+
+
+_AGGREGATE_FUNCTIONS = {
+    "mean": "AVG",
+    "sum": "SUM",
+    "min": "MIN",
+    "max": "MAX",
+    "count": "COUNT",
+}
+
+
+def _get_aggregate_sql(function):
+    try:
+        return "{}(value)".format(_AGGREGATE_FUNCTIONS[function])
+    except KeyError:
+        raise ValueError('"{}" is not a valid aggregation function'.format(function))
+
+
+_ROLLUP_AGGREGATES = {
+    "mean": "SUM(sum) / NULLIF(SUM(count), 0)",
+    "sum": "SUM(sum)",
+    "min": "MIN(min)",
+    "max": "MAX(max)",
+    "count": "SUM(count)",
+}
+
+
+def _get_rollup_aggregate_sql(function):
+    """Like _get_aggregate_sql(), but for aggregating a continuous aggregate."""
+    return _ROLLUP_AGGREGATES[function]
+
+
+def _read_records_csv(f, utc_offset):
+    """Read the CSV output of TimeseriesRecord.get_dataframe() into a dataframe.
+
+    "utc_offset" is in minutes; the resulting index is naive, in that offset. The
+    flags are categorical, since most records have one of a few distinct flags.
+    """
+    if f.read(1):
+        f.seek(0)
+        data = pd.read_csv(
+            f,
+            header=None,
+            names=("timestamp", "value", "flags"),
+            dtype={"timestamp": np.int64, "value": np.float64, "flags": "category"},
+            keep_default_na=False,
+            na_values={"value": ["", "NaN"]},
+        )
+    else:
+        data = pd.DataFrame(
+            {
+                "timestamp": np.array([], dtype=np.int64),
+                "value": np.array([], dtype=np.float64),
+                "flags": pd.Categorical([]),
+            }
+        )
+    index = pd.to_datetime(data["timestamp"].values, unit="s")
+    index += pd.Timedelta(minutes=utc_offset)
+    result = pd.DataFrame(
+        {"value": data["value"].values, "flags": data["flags"].values},
+        columns=["value", "flags"],
+        index=index,
+    )
+    result.index.name = "date"
+    return result
+
+
 class UserProfile(models.Model):
     """Unused model for backwards compatibility.
 
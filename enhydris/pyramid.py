@@ -0,0 +1,220 @@
+"""Precalculated min, max, sum and count of time series records.
+
+For each time series, the table enhydris_timeseriespyramid contains the min, max, sum
+and count of the values (NaNs excluded) of each hour, day, month and year that has
+values. The intervals ("buckets") are in the time zone of the time series, and each
+level is calculated from the one below it (the hourly from the records, the daily
+from the hourly, and so on), so that updating it after a few records have been
+inserted or deleted only reads a few rows per level.
+
+The pyramid is updated whenever Enhydris inserts or deletes records (see update()),
+and it is used for charts of periods that have too many records (see choose_level()
+and get_chart_dataframe()), so that a chart of any period, however long, reads at
+most a few thousand rows.
+"""
+import datetime as dt
+
+from django.db import connection
+
+import numpy as np
+import pandas as pd
+
+# A chart of npoints is made from the records if there are at most
+# npoints * MAX_ROWS_PER_POINT of them in the period, otherwise from the finest level
+# that has at most that many buckets in the period.
+MAX_ROWS_PER_POINT = 10
+
+
+class Level:
+    def __init__(self, name, truncation, duration):
+        self.name = name
+        self.truncation = truncation  # The date_trunc() field
+        self.duration = duration  # Approximate, for months and years
+
+    def floor(self, date):
+        """Return the start of the bucket that contains the (naive) date."""
+        date = date.replace(minute=0, second=0, microsecond=0)
+        if self.truncation == "hour":
+            return date
+        date = date.replace(hour=0)
+        if self.truncation == "day":
+            return date
+        date = date.replace(day=1)
+        if self.truncation == "month":
+            return date
+        return date.replace(month=1)
+
+    def next(self, bucket):
+        """Return the start of the bucket after the one that starts at "bucket"."""
+        if self.truncation == "month":
+            if bucket.month == 12:
+                return bucket.replace(year=bucket.year + 1, month=1)
+            return bucket.replace(month=bucket.month + 1)
+        elif self.truncation == "year":
+            return bucket.replace(year=bucket.year + 1)
+        return bucket + self.duration
+
+
+LEVELS = [
+    Level("H", "hour", dt.timedelta(hours=1)),
+    Level("D", "day", dt.timedelta(days=1)),
+    Level("M", "month", dt.timedelta(days=30.44)),
+    Level("Y", "year", dt.timedelta(days=365.25)),
+]
+
+
+def update(timeseries, start_date=None, end_date=None):
+    """Recalculate the pyramid of the time series after its records have changed.
+
+    start_date and end_date are the dates of the first and last record that have
+    been inserted or deleted; they are naive, in the time zone of the time series.
+    If they are not specified, the entire pyramid of the time series is
+    recalculated.
+    """
+    if start_date is not None and end_date is not None:
+        start_date = _as_datetime(start_date)
+        end_date = _as_datetime(end_date)
+    with connection.cursor() as cursor:
+        source = None
+        for level in LEVELS:
+            _update_level(cursor, timeseries, level, source, start_date, end_date)
+            source = level
+
+
+def _update_level(cursor, timeseries, level, source, start_date, end_date):
+    buckets_sql, buckets_params = "", []
+    records_sql, records_params = "", []
+    if start_date is not None and end_date is not None:
+        first_bucket = level.floor(start_date)
+        end_of_last_bucket = level.next(level.floor(end_date))
+        buckets_sql = "AND bucket >= %s AND bucket < %s"
+        buckets_params = [first_bucket, end_of_last_bucket]
+        tzinfo = timeseries.time_zone.as_tzinfo
+        records_sql = 'AND "timestamp" >= %s AND "timestamp" < %s'
+        records_params = [
+            first_bucket.replace(tzinfo=tzinfo),
+            end_of_last_bucket.replace(tzinfo=tzinfo),
+        ]
+    cursor.execute(
+        f"""
+        DELETE FROM enhydris_timeseriespyramid
+        WHERE timeseries_id = %s AND level = %s {buckets_sql}
+        """,
+        [timeseries.id, level.name, *buckets_params],
+    )
+    if source is None:
+        cursor.execute(
+            f"""
+            INSERT INTO enhydris_timeseriespyramid
+                (timeseries_id, level, bucket, min, max, sum, count)
+            SELECT
+                %s,
+                %s,
+                date_trunc(
+                    '{level.truncation}',
+                    "timestamp" AT TIME ZONE make_interval(mins => %s)
+                ),
+                MIN(NULLIF(value, 'NaN')),
+                MAX(NULLIF(value, 'NaN')),
+                SUM(NULLIF(value, 'NaN')),
+                COUNT(NULLIF(value, 'NaN'))
+            FROM enhydris_timeseriesrecord
+            WHERE timeseries_id = %s {records_sql}
+            GROUP BY 3
+            HAVING COUNT(NULLIF(value, 'NaN')) > 0
+            """,
+            [
+                timeseries.id,
+                level.name,
+                timeseries.time_zone.utc_offset,
+                timeseries.id,
+                *records_params,
+            ],
+        )
+    else:
+        cursor.execute(
+            f"""
+            INSERT INTO enhydris_timeseriespyramid
+                (timeseries_id, level, bucket, min, max, sum, count)
+            SELECT
+                %s,
+                %s,
+                date_trunc('{level.truncation}', bucket),
+                MIN(min),
+                MAX(max),
+                SUM(sum),
+                SUM(count)
+            FROM enhydris_timeseriespyramid
+            WHERE timeseries_id = %s AND level = %s {buckets_sql}
+            GROUP BY 3
+            """,
+            [timeseries.id, level.name, timeseries.id, source.name, *buckets_params,],
+        )
+
+
+def choose_level(timeseries, start_date, end_date, npoints):
+    """Return the level to use for a chart of npoints, or None to use the records.
+
+    start_date and end_date are naive, in the time zone of the time series, or None
+    for no limit. The number of records in the period is estimated from the number
+    of records of the time series, assuming they are evenly distributed.
+    """
+    first_date = timeseries.start_date_naive
+    last_date = timeseries.end_date_naive
+    if first_date is None:
+        return None
+    start_date = max(start_date, first_date) if start_date else first_date
+    end_date = min(end_date, last_date) if end_date else last_date
+    if end_date <= start_date:
+        return None
+    max_rows = npoints * MAX_ROWS_PER_POINT
+    fraction = (end_date - start_date) / (last_date - first_date)
+    nrecords = timeseries.records_count * fraction
+    if nrecords <= max_rows:
+        return None
+    for level in LEVELS:
+        if (end_date - start_date) / level.duration <= max_rows:
+            return level
+    return LEVELS[-1]
+
+
+def get_chart_dataframe(timeseries, level, start_date, end_date, method):
+    """Return the buckets of a level as a dataframe to be given to downsample().
+
+    start_date and end_date are as for choose_level(); the buckets that contain them
+    are included whole. If "method" is "minmax", the result has two rows for each
+    bucket, with its min and max; otherwise it has one row with the mean. The index
+    is the start of the bucket.
+    """
+    params = [timeseries.id, level.name]
+    date_range_sql = ""
+    if start_date is not None:
+        date_range_sql += " AND bucket >= %s"
+        params.append(level.floor(_as_datetime(start_date)))
+    if end_date is not None:
+        date_range_sql += " AND bucket <= %s"
+        params.append(_as_datetime(end_date))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT bucket, min, max, sum / count
+            FROM enhydris_timeseriespyramid
+            WHERE timeseries_id = %s AND level = %s {date_range_sql}
+            ORDER BY bucket
+            """,
+            params,
+        )
+        rows = cursor.fetchall()
+    buckets = pd.DatetimeIndex([row[0] for row in rows], name="date")
+    values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(-1, 3)
+    if method == "minmax":
+        buckets = buckets.repeat(2)
+        values = values[:, :2].ravel()
+    else:
+        values = values[:, 2]
+    return pd.DataFrame({"value": values}, index=buckets)
+
+
+def _as_datetime(date):
+    """Convert a pandas Timestamp (or datetime) to datetime, for the database."""
+    return pd.Timestamp(date).to_pydatetime()
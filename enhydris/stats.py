@@ -0,0 +1,69 @@
+"""Summary statistics of time series data.
+
+The statistics are calculated with numpy over the arrays returned by
+TimeseriesCache.get(), so they are cheap enough to recalculate whenever a chart is
+zoomed.
+
+For vector variables, such as wind direction, the values are angles in degrees
+(clockwise from north); in that case the statistics also include the mean direction
+(the direction of the sum of the unit vectors) and the number of values in each of
+eight sectors of 45 degrees, the first of which is centered on north.
+"""
+import numpy as np
+
+
+def get_statistics(data, vector=False):
+    """Return a dictionary with statistics of data.
+
+    "data" is a dataframe like those returned by TimeseriesCache.get(). Records
+    without a value or with an infinite value are ignored. The dates in the result
+    are the same type as the index of "data"; the items that can't be calculated
+    because there are no values are None.
+    """
+    values = data["value"].values
+    has_value = np.isfinite(values)
+    values = values[has_value]
+    dates = data.index[has_value]
+    result = {
+        "count": len(values),
+        "min": None,
+        "min_date": None,
+        "max": None,
+        "max_date": None,
+        "sum": None,
+        "mean": None,
+        "last": None,
+        "last_date": None,
+    }
+    if vector:
+        result["vector_mean"] = None
+        result["sectors"] = [0] * 8
+    if not len(values):
+        return result
+    imin = np.argmin(values)
+    imax = np.argmax(values)
+    result.update(
+        {
+            "min": float(values[imin]),
+            "min_date": dates[imin],
+            "max": float(values[imax]),
+            "max_date": dates[imax],
+            "sum": float(values.sum()),
+            "mean": float(values.mean()),
+            "last": float(values[-1]),
+            "last_date": dates[-1],
+        }
+    )
+    if vector:
+        result.update(_get_vector_statistics(values))
+    return result
+
+
+def _get_vector_statistics(values):
+    directions = np.mod(values, 360)
+    radians = np.deg2rad(directions)
+    mean = np.rad2deg(np.arctan2(np.sin(radians).sum(), np.cos(radians).sum()))
+    sectors = np.bincount(
+        (np.mod(directions + 22.5, 360) // 45).astype(np.int64), minlength=8
+    )
+    return {"vector_mean": float(np.mod(mean, 360)), "sectors": sectors.tolist()}
@@ -380,6 +380,112 @@ class TimeseriesInlineAdminFormAcceptsReplacingTestCase(TestCase):
         )
 
 
+class TimeseriesInlineAdminFormAcceptsMergingTestCase(TestCase):
+    def setUp(self):
+        station = mommy.make(models.Station)
+        self.timeseries = mommy.make(
+            models.Timeseries,
+            gentity=station,
+            time_zone__utc_offset=0,
+            variable__descr="irrelevant",
+            precision=2,
+        )
+        self.timeseries.set_data(
+            StringIO("2005-11-01 18:00,3,\n2019-01-01 00:30,25,\n")
+        )
+        self.data = {
+            "replace_or_append": "MERGE",
+            "gentity": station.id,
+            "unit_of_measurement": self.timeseries.unit_of_measurement.id,
+            "variable": self.timeseries.variable.id,
+            "time_zone": self.timeseries.time_zone.id,
+            "precision": 2,
+        }
+        self.files = {
+            "data": SimpleUploadedFile(
+                "mytimeseries.csv", b"2005-12-01 18:35,7,\n2019-01-01 00:30,26,\n"
+            )
+        }
+        self.form = TimeseriesInlineAdminForm(
+            data=self.data, files=self.files, instance=self.timeseries
+        )
+        self.form.save()
+
+    def test_form_is_valid(self):
+        self.assertTrue(self.form.is_valid())
+
+    def test_data(self):
+        data = self.timeseries.get_data().data
+        self.assertEqual(
+            list(data.index),
+            [
+                dt.datetime(2005, 11, 1, 18, 0),
+                dt.datetime(2005, 12, 1, 18, 35),
+                dt.datetime(2019, 1, 1, 0, 30),
+            ],
+        )
+        self.assertEqual(list(data["value"]), [3, 7, 26])
+
+    def test_merge_result(self):
+        self.assertEqual(
+            self.form.merge_result, {"inserted": 1, "updated": 1, "unchanged": 0}
+        )
+
+
+class TimeseriesInlineAdminFormAcceptsReplacingPeriodTestCase(TestCase):
+    def setUp(self):
+        station = mommy.make(models.Station)
+        self.timeseries = mommy.make(
+            models.Timeseries,
+            gentity=station,
+            time_zone__utc_offset=0,
+            variable__descr="irrelevant",
+            precision=2,
+        )
+        self.timeseries.set_data(
+            StringIO(
+                "2005-11-01 18:00,3,\n"
+                "2005-12-01 18:00,4,\n"
+                "2005-12-01 18:10,5,\n"
+                "2019-01-01 00:30,25,\n"
+            )
+        )
+        self.data = {
+            "replace_or_append": "REPLACE_PERIOD",
+            "gentity": station.id,
+            "unit_of_measurement": self.timeseries.unit_of_measurement.id,
+            "variable": self.timeseries.variable.id,
+            "time_zone": self.timeseries.time_zone.id,
+            "precision": 2,
+        }
+        self.files = {
+            "data": SimpleUploadedFile(
+                "mytimeseries.csv", b"2005-11-15 00:00,7,\n2005-12-01 18:05,8,\n"
+            )
+        }
+        self.form = TimeseriesInlineAdminForm(
+            data=self.data, files=self.files, instance=self.timeseries
+        )
+        self.form.save()
+
+    def test_form_is_valid(self):
+        self.assertTrue(self.form.is_valid())
+
+    def test_data(self):
+        data = self.timeseries.get_data().data
+        self.assertEqual(
+            list(data.index),
+            [
+                dt.datetime(2005, 11, 1, 18, 0),
+                dt.datetime(2005, 11, 15, 0, 0),
+                dt.datetime(2005, 12, 1, 18, 5),
+                dt.datetime(2005, 12, 1, 18, 10),
+                dt.datetime(2019, 1, 1, 0, 30),
+            ],
+        )
+        self.assertEqual(list(data["value"]), [3, 7, 8, 5, 25])
+
+
 class TimeseriesUploadFileMixin:
     def _get_basic_form_contents(self):
         return {
@@ -443,6 +549,22 @@ class TimeseriesUploadFileTestCase(TestCase, TimeseriesUploadFileMixin):
             3.14159065358979,
         )
 
+    def test_merge_reports_counts(self):
+        station = models.Station.objects.first()
+        timeseries = models.Timeseries.objects.first()
+        self.data["timeseries-0-id"] = timeseries.id
+        self.data["timeseries-0-gentity"] = station.id
+        self.data["timeseries-INITIAL_FORMS"] = "1"
+        self.data["timeseries-0-replace_or_append"] = "MERGE"
+        with StringIO("2019-08-18 12:39,1,\n2019-08-19 12:39,2,\n") as f:
+            self.data["timeseries-0-data"] = f
+            response = self.client.post(
+                "/admin/enhydris/station/{}/change/".format(station.id),
+                self.data,
+                follow=True,
+            )
+        self.assertContains(response, "1 records inserted, 1 updated, 0 unchanged")
+
 
 class TimeseriesUploadFileWithUnicodeHeadersTestCase(TestCase):
     def setUp(self):
@@ -0,0 +1,55 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+
+from model_mommy import mommy
+
+from enhydris import chunking, continuous_aggregates, models
+
+
+# reorder_chunk() can't run in a transaction block, hence TransactionTestCase
+@override_settings(
+    ENHYDRIS_CHUNK_TIME_INTERVAL="30 days", ENHYDRIS_CHUNK_SPACE_PARTITIONS=2
+)
+class RechunkTestCase(TransactionTestCase):
+    def setUp(self):
+        version = continuous_aggregates.get_timescaledb_version()
+        if version is None or version < chunking.MINIMUM_VERSION:
+            self.skipTest("Rechunking needs TimescaleDB 2.0 or later")
+        self.timeseries = mommy.make(
+            models.Timeseries, time_zone__utc_offset=0, precision=2
+        )
+        self.timeseries.set_data(
+            StringIO("2019-01-15 00:00,1,\n2019-02-15 00:00,2,\n2019-03-15 00:00,3,\n")
+        )
+        call_command("rechunk_timeseries_records", stdout=StringIO())
+
+    def tearDown(self):
+        with override_settings(
+            ENHYDRIS_CHUNK_TIME_INTERVAL="1 year", ENHYDRIS_CHUNK_SPACE_PARTITIONS=1
+        ):
+            call_command("rechunk_timeseries_records", stdout=StringIO())
+
+    def _get_chunks_count(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT COUNT(*) FROM timescaledb_information.chunks
+                WHERE hypertable_name = 'enhydris_timeseriesrecord'
+                """
+            )
+            return cursor.fetchone()[0]
+
+    def test_layout(self):
+        with connection.cursor() as cursor:
+            self.assertTrue(chunking.layout_matches(cursor, "30 days", 2))
+
+    def test_records_are_in_new_chunks(self):
+        self.assertGreaterEqual(self._get_chunks_count(), 3)
+
+    def test_records_are_kept(self):
+        cache.clear()
+        self.assertEqual(list(self.timeseries.get_data().data["value"]), [1, 2, 3])
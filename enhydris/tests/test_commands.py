@@ -0,0 +1,36 @@
+import datetime as dt
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from model_mommy import mommy
+
+from enhydris import models
+
+
+class RebuildTimeseriesSummariesTestCase(TestCase):
+    def setUp(self):
+        self.timeseries = mommy.make(
+            models.Timeseries, time_zone__utc_offset=0, precision=2
+        )
+        self.timeseries.timeseriesrecord_set.create(
+            timestamp=dt.datetime(2019, 7, 24, 11, 26, tzinfo=dt.timezone.utc),
+            value=42,
+            flags="",
+        )
+
+    def test_rebuilds_summary(self):
+        call_command("rebuild_timeseries_summaries", stdout=StringIO())
+        self.timeseries.refresh_from_db()
+        self.assertEqual(self.timeseries.records_count, 1)
+        self.assertEqual(
+            self.timeseries.get_last_record_as_string(), "2019-07-24 11:26,42.00,"
+        )
+
+    def test_rebuilds_only_specified_time_series(self):
+        call_command(
+            "rebuild_timeseries_summaries", self.timeseries.id + 1, stdout=StringIO()
+        )
+        self.timeseries.refresh_from_db()
+        self.assertEqual(self.timeseries.records_count, 0)
@@ -0,0 +1,86 @@
+import datetime as dt
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from model_mommy import mommy
+
+from enhydris import compression, continuous_aggregates, models
+
+
+@override_settings(ENHYDRIS_COMPRESS_AFTER="1 year")
+class CompressionTestCase(TestCase):
+    def setUp(self):
+        version = continuous_aggregates.get_timescaledb_version()
+        if version is None or version < compression.MINIMUM_VERSION:
+            self.skipTest("Compression needs TimescaleDB 2.0 or later")
+        cache.clear()
+        self.timeseries = mommy.make(
+            models.Timeseries, time_zone__utc_offset=0, precision=2
+        )
+        self.timeseries.set_data(
+            StringIO("2018-06-01 00:00,1,\n2018-06-01 00:10,2,\n2019-06-01 00:00,3,\n")
+        )
+        call_command("compress_timeseries_records", stdout=StringIO())
+        self.tzinfo = self.timeseries.time_zone.as_tzinfo
+
+    def _get_compressed_chunks_count(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT COUNT(*) FROM timescaledb_information.chunks
+                WHERE hypertable_name = 'enhydris_timeseriesrecord' AND is_compressed
+                """
+            )
+            return cursor.fetchone()[0]
+
+    def _get_values(self):
+        cache.clear()
+        return list(self.timeseries.get_data().data["value"])
+
+    def test_compresses_old_chunks(self):
+        self.assertEqual(self._get_compressed_chunks_count(), 2)
+
+    def test_read(self):
+        self.assertEqual(self._get_values(), [1, 2, 3])
+
+    def test_set_data(self):
+        self.timeseries.set_data(StringIO("2018-06-01 00:00,4,\n"))
+        self.assertEqual(self._get_values(), [4])
+
+    def test_replace_range(self):
+        self.timeseries.replace_range(
+            dt.datetime(2018, 6, 1, 0, 10, tzinfo=self.tzinfo),
+            dt.datetime(2018, 12, 31, 23, 59, tzinfo=self.tzinfo),
+            StringIO("2018-07-01 00:00,5,\n"),
+        )
+        self.assertEqual(self._get_values(), [1, 5, 3])
+
+    def test_merge_data(self):
+        result = self.timeseries.merge_data(
+            StringIO("2018-06-01 00:10,6,\n2018-06-01 00:20,7,\n")
+        )
+        self.assertEqual(result, {"inserted": 1, "updated": 1, "unchanged": 0})
+        self.assertEqual(self._get_values(), [1, 6, 7, 3])
+
+    def test_delete_timeseries(self):
+        self.timeseries.delete()
+        self.assertFalse(models.TimeseriesRecord.objects.exists())
+
+    def test_report(self):
+        out = StringIO()
+        call_command("compress_timeseries_records", "--report", stdout=out)
+        self.assertIn("Total", out.getvalue())
+
+    def test_decompress(self):
+        call_command("compress_timeseries_records", "--decompress", stdout=StringIO())
+        self.assertEqual(self._get_compressed_chunks_count(), 0)
+        self.assertEqual(self._get_values(), [1, 2, 3])
+
+    @override_settings(ENHYDRIS_COMPRESS_AFTER=None)
+    def test_requires_setting(self):
+        with self.assertRaises(CommandError):
+            call_command("compress_timeseries_records", stdout=StringIO())
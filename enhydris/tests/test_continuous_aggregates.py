@@ -0,0 +1,125 @@
+import datetime as dt
+from io import StringIO
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from model_mommy import mommy
+
+from enhydris import continuous_aggregates, models
+
+UTC = dt.timezone.utc
+
+
+class RollupCanServeTestCase(SimpleTestCase):
+    def setUp(self):
+        self.hourly = continuous_aggregates.get_rollup("hourly")
+        self.daily = continuous_aggregates.get_rollup("daily")
+        self.monthly = continuous_aggregates.get_rollup("monthly")
+
+    def test_hourly_serves_multiples_of_an_hour(self):
+        self.assertTrue(self.hourly.can_serve(180, 120, None, None))
+        self.assertFalse(self.hourly.can_serve(30, 120, None, None))
+
+    def test_hourly_needs_whole_hour_offset(self):
+        self.assertFalse(self.hourly.can_serve(1440, 330, None, None))
+
+    def test_hourly_serves_months(self):
+        self.assertTrue(self.hourly.can_serve(None, 120, None, None))
+
+    def test_daily_needs_utc(self):
+        self.assertTrue(self.daily.can_serve(1440, 0, None, None))
+        self.assertFalse(self.daily.can_serve(1440, 120, None, None))
+
+    def test_monthly_serves_only_months_and_years(self):
+        self.assertTrue(self.monthly.can_serve(None, 0, None, None))
+        self.assertFalse(self.monthly.can_serve(1440, 0, None, None))
+
+    def test_dates_at_boundaries(self):
+        self.assertTrue(
+            self.daily.can_serve(
+                1440,
+                0,
+                dt.datetime(2019, 1, 1, tzinfo=UTC),
+                dt.datetime(2019, 1, 31, 23, 59, tzinfo=UTC),
+            )
+        )
+
+    def test_start_date_not_at_boundary(self):
+        self.assertFalse(
+            self.daily.can_serve(1440, 0, dt.datetime(2019, 1, 1, 1, tzinfo=UTC), None)
+        )
+
+    def test_end_date_not_at_boundary(self):
+        self.assertFalse(
+            self.daily.can_serve(1440, 0, None, dt.datetime(2019, 1, 31, tzinfo=UTC))
+        )
+
+
+class ChooseRollupTestCase(SimpleTestCase):
+    @override_settings(ENHYDRIS_CONTINUOUS_AGGREGATES=["hourly", "daily"])
+    def test_chooses_coarsest(self):
+        rollup = continuous_aggregates.choose_rollup(None, 0, None, None)
+        self.assertEqual(rollup.name, "daily")
+
+    @override_settings(ENHYDRIS_CONTINUOUS_AGGREGATES=["hourly", "daily"])
+    def test_chooses_finer_when_coarsest_does_not_fit(self):
+        rollup = continuous_aggregates.choose_rollup(None, 120, None, None)
+        self.assertEqual(rollup.name, "hourly")
+
+    @override_settings(ENHYDRIS_CONTINUOUS_AGGREGATES=[])
+    def test_none_enabled(self):
+        self.assertIsNone(continuous_aggregates.choose_rollup(1440, 0, None, None))
+
+
+class AggregationTestCaseBase(TestCase):
+    def setUp(self):
+        self.timeseries = mommy.make(
+            models.Timeseries, time_zone__utc_offset=0, precision=2
+        )
+        self.timeseries.set_data(
+            StringIO(
+                "2019-01-01 00:00,1,\n"
+                "2019-01-01 12:00,2,\n"
+                "2019-01-02 00:10,,MISS\n"
+                "2019-01-02 00:20,4,\n"
+            )
+        )
+
+    def _check_daily_aggregation(self):
+        result = self.timeseries.get_aggregated_data(
+            "D", ["mean", "sum", "min", "max", "count"]
+        )
+        self.assertEqual(list(result["mean"].data["value"]), [1.5, 4])
+        self.assertEqual(list(result["sum"].data["value"]), [3, 4])
+        self.assertEqual(list(result["min"].data["value"]), [1, 4])
+        self.assertEqual(list(result["max"].data["value"]), [2, 4])
+        self.assertEqual(list(result["count"].data["value"]), [2, 1])
+
+
+@override_settings(ENHYDRIS_CONTINUOUS_AGGREGATES=["daily"])
+class FallbackWhenContinuousAggregateDoesNotExistTestCase(AggregationTestCaseBase):
+    def test_aggregation(self):
+        self._check_daily_aggregation()
+
+
+@override_settings(ENHYDRIS_CONTINUOUS_AGGREGATES=["hourly", "daily"])
+class ContinuousAggregatesTestCase(AggregationTestCaseBase):
+    def setUp(self):
+        version = continuous_aggregates.get_timescaledb_version()
+        if version is None or version < (2, 0):
+            self.skipTest("Continuous aggregates need TimescaleDB 2.0 or later")
+        super().setUp()
+        with connection.cursor() as cursor:
+            for name in ("hourly", "daily"):
+                continuous_aggregates.get_rollup(name).create(cursor)
+
+    def test_aggregation(self):
+        self._check_daily_aggregation()
+
+    def test_uses_continuous_aggregate(self):
+        with CaptureQueriesContext(connection) as context:
+            self.timeseries.get_aggregated_data("D", ["mean"])
+        queries = [q["sql"] for q in context.captured_queries]
+        self.assertTrue(any("enhydris_timeseriesrecord_daily" in q for q in queries))
@@ -0,0 +1,91 @@
+from django.test import SimpleTestCase
+
+import numpy as np
+import pandas as pd
+
+from enhydris.downsampling import downsample, lttb, min_max
+
+
+class MinMaxTestCase(SimpleTestCase):
+    def test_keeps_min_and_max_of_each_interval(self):
+        timestamps = np.array([0, 1, 2, 3, 4, 5])
+        values = np.array([1.0, 5, 2, 0, 3, 3])
+        self.assertEqual(list(min_max(timestamps, values, 4)), [0, 1, 3, 4])
+
+    def test_intervals_are_of_equal_duration(self):
+        timestamps = np.array([0, 1, 2, 3, 100])
+        values = np.array([1.0, 5, 2, 0, 3])
+        self.assertEqual(list(min_max(timestamps, values, 4)), [1, 3, 4])
+
+    def test_few_records(self):
+        timestamps = np.array([0, 1, 2])
+        values = np.array([1.0, 5, 2])
+        self.assertEqual(list(min_max(timestamps, values, 4)), [0, 1, 2])
+
+    def test_number_of_points(self):
+        timestamps = pd.date_range(
+            "2000-01-01", "2019-12-31", freq="10min"
+        ).values.view(np.int64)
+        values = np.random.RandomState(42).random_sample(len(timestamps))
+        for npoints in (199, 200, 201, 997):
+            self.assertLessEqual(len(min_max(timestamps, values, npoints)), npoints)
+
+
+class LttbTestCase(SimpleTestCase):
+    def test_keeps_first_and_last(self):
+        timestamps = np.arange(1000)
+        values = np.sin(timestamps / 50)
+        result = lttb(timestamps, values, 20)
+        self.assertEqual(len(result), 20)
+        self.assertEqual(result[0], 0)
+        self.assertEqual(result[-1], 999)
+
+    def test_keeps_peak(self):
+        timestamps = np.arange(1000)
+        values = np.zeros(1000)
+        values[437] = 10
+        self.assertIn(437, lttb(timestamps, values, 20))
+
+    def test_few_records(self):
+        timestamps = np.array([0, 1, 2])
+        values = np.array([1.0, 5, 2])
+        self.assertEqual(list(lttb(timestamps, values, 4)), [0, 1, 2])
+
+    def test_two_points(self):
+        timestamps = np.arange(10)
+        values = np.arange(10.0)
+        self.assertEqual(list(lttb(timestamps, values, 2)), [0, 9])
+
+    def test_one_point(self):
+        timestamps = np.arange(10)
+        values = np.arange(10.0)
+        self.assertEqual(list(lttb(timestamps, values, 1)), [9])
+
+
+class DownsampleTestCase(SimpleTestCase):
+    def setUp(self):
+        self.data = pd.DataFrame(
+            {"value": [1.0, np.nan, 5, 2, 0, 3], "flags": ""},
+            columns=["value", "flags"],
+            index=pd.date_range("2019-01-01", periods=6, freq="10min", name="date"),
+        )
+
+    def test_ignores_records_without_value(self):
+        result = downsample(self.data, 10)
+        self.assertEqual(list(result), [1, 5, 2, 0, 3])
+        self.assertEqual(result.index[1], pd.Timestamp("2019-01-01 00:20"))
+
+    def test_minmax(self):
+        result = downsample(self.data, 2)
+        self.assertEqual(list(result), [5, 0])
+
+    def test_lttb(self):
+        result = downsample(self.data, 3, "lttb")
+        self.assertEqual(list(result), [1, 5, 3])
+
+    def test_empty(self):
+        self.assertEqual(len(downsample(self.data.iloc[:0], 10)), 0)
+
+    def test_invalid_method(self):
+        with self.assertRaisesRegex(ValueError, "not a valid downsampling method"):
+            downsample(self.data, 10, "average")
@@ -0,0 +1,117 @@
+import gzip
+from importlib.util import find_spec
+from unittest import skipUnless
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from enhydris.middleware import CompressionMiddleware, choose_encoding
+
+CONTENT = b"2018-06-01 00:00,1.5,\r\n" * 1000
+
+
+@override_settings(ENHYDRIS_RESPONSE_COMPRESSION={"zstd": 3, "gzip": 6})
+class CompressionMiddlewareTestCase(SimpleTestCase):
+    def _get_response(self, response, accept_encoding="gzip"):
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda r: response)(request)
+
+    def test_compresses_response(self):
+        response = self._get_response(HttpResponse(CONTENT))
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), CONTENT)
+
+    def test_sets_content_length(self):
+        response = self._get_response(HttpResponse(CONTENT))
+        self.assertEqual(response["Content-Length"], str(len(response.content)))
+
+    def test_compresses_streaming_response(self):
+        response = self._get_response(
+            StreamingHttpResponse(CONTENT.splitlines(keepends=True))
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        content = b"".join(response.streaming_content)
+        self.assertEqual(gzip.decompress(content), CONTENT)
+
+    def test_sets_vary(self):
+        response = self._get_response(HttpResponse(CONTENT))
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+
+    def test_weakens_etag(self):
+        original_response = HttpResponse(CONTENT)
+        original_response["ETag"] = '"42-1"'
+        response = self._get_response(original_response)
+        self.assertEqual(response["ETag"], 'W/"42-1"')
+
+    def test_does_not_compress_without_accept_encoding(self):
+        response = self._get_response(HttpResponse(CONTENT), accept_encoding="")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content, CONTENT)
+
+    def test_does_not_compress_zip(self):
+        response = self._get_response(
+            HttpResponse(CONTENT, content_type="application/zip")
+        )
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_does_not_compress_short_response(self):
+        response = self._get_response(HttpResponse(b"hello"))
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    @override_settings(ENHYDRIS_RESPONSE_COMPRESSION={"gzip": 1})
+    def test_level(self):
+        level1_length = len(self._get_response(HttpResponse(CONTENT)).content)
+        with override_settings(ENHYDRIS_RESPONSE_COMPRESSION={"gzip": 9}):
+            level9_length = len(self._get_response(HttpResponse(CONTENT)).content)
+        self.assertLess(level9_length, level1_length)
+
+    @skipUnless(find_spec("zstandard"), "zstandard is not installed")
+    def test_zstd(self):
+        import zstandard
+
+        response = self._get_response(
+            StreamingHttpResponse([CONTENT]), accept_encoding="gzip, zstd"
+        )
+        self.assertEqual(response["Content-Encoding"], "zstd")
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        content = decompressor.decompress(b"".join(response.streaming_content))
+        self.assertEqual(content, CONTENT)
+
+
+class ChooseEncodingTestCase(SimpleTestCase):
+    @override_settings(ENHYDRIS_RESPONSE_COMPRESSION={"gzip": 6, "zstd": 3})
+    def test_preference(self):
+        self.assertEqual(choose_encoding("zstd, gzip"), "gzip")
+
+    @override_settings(ENHYDRIS_RESPONSE_COMPRESSION={"gzip": 6})
+    def test_q(self):
+        self.assertEqual(choose_encoding("deflate, gzip;q=0.5"), "gzip")
+
+    @override_settings(ENHYDRIS_RESPONSE_COMPRESSION={"gzip": 6})
+    def test_q_zero(self):
+        self.assertIsNone(choose_encoding("deflate, gzip;q=0"))
+
+    @override_settings(ENHYDRIS_RESPONSE_COMPRESSION={"gzip": 6})
+    def test_not_accepted(self):
+        self.assertIsNone(choose_encoding("deflate, br"))
+
+    @override_settings(ENHYDRIS_RESPONSE_COMPRESSION={"gzip": 6})
+    def test_wildcard(self):
+        self.assertEqual(choose_encoding("*"), "gzip")
+
+    @override_settings(ENHYDRIS_RESPONSE_COMPRESSION={"gzip": 6})
+    def test_wildcard_with_q(self):
+        self.assertEqual(choose_encoding("br, *;q=0.1"), "gzip")
+
+    @override_settings(ENHYDRIS_RESPONSE_COMPRESSION={"gzip": 6})
+    def test_wildcard_q_zero(self):
+        self.assertIsNone(choose_encoding("br, *;q=0"))
+
+    @override_settings(ENHYDRIS_RESPONSE_COMPRESSION={"zstd": 3, "gzip": 6})
+    def test_wildcard_does_not_override_q_zero(self):
+        self.assertEqual(choose_encoding("zstd;q=0, *"), "gzip")
+
+    @override_settings(ENHYDRIS_RESPONSE_COMPRESSION={"zstd": 3, "gzip": 6})
+    @skipUnless(find_spec("zstandard") is None, "zstandard is installed")
+    def test_zstd_unavailable(self):
+        self.assertEqual(choose_encoding("zstd, gzip"), "gzip")
@@ -1,7 +1,9 @@
 import datetime as dt
 from io import StringIO
+from unittest.mock import patch
 
 from django.contrib.gis.geos import MultiPolygon, Point, Polygon
+from django.core.cache import cache
 from django.db import IntegrityError
 from django.test import TestCase, override_settings
 from django.utils import translation
@@ -298,30 +300,32 @@ class StationLastUpdateTestCase(TestCase):
         self.time_zone = mommy.make(models.TimeZone, code="EET", utc_offset=120)
 
     def _create_timeseries(self, ye=None, mo=None, da=None, ho=None, mi=None):
-        if ye:
-            end_date_utc = dt.datetime(ye, mo, da, ho, mi, tzinfo=dt.timezone.utc)
-        else:
-            end_date_utc = None
         timeseries = mommy.make(
             models.Timeseries,
             gentity=self.station,
             time_zone=self.time_zone,
             precision=2,
         )
-        if end_date_utc:
-            timeseries.timeseriesrecord_set.create(
-                timestamp=end_date_utc, value=0, flags=""
-            )
+        if ye:
+            timeseries.set_data(StringIO(f"{ye}-{mo:02}-{da:02} {ho:02}:{mi:02},0,\n"))
+        self.station.refresh_from_db()
+        return timeseries
 
     def test_last_update_when_all_timeseries_have_end_date(self):
-        self._create_timeseries(2019, 7, 24, 11, 26)
-        self._create_timeseries(2019, 7, 23, 5, 10)
-        self.assertEqual(self.station.last_update, dt.datetime(2019, 7, 24, 13, 26))
+        self._create_timeseries(2019, 7, 24, 13, 26)
+        self._create_timeseries(2019, 7, 23, 7, 10)
+        self.assertEqual(
+            self.station.last_update,
+            dt.datetime(2019, 7, 24, 11, 26, tzinfo=dt.timezone.utc),
+        )
 
     def test_last_update_when_one_timeseries_has_no_data(self):
-        self._create_timeseries(2019, 7, 24, 11, 26)
+        self._create_timeseries(2019, 7, 24, 13, 26)
         self._create_timeseries()
-        self.assertEqual(self.station.last_update, dt.datetime(2019, 7, 24, 13, 26))
+        self.assertEqual(
+            self.station.last_update,
+            dt.datetime(2019, 7, 24, 11, 26, tzinfo=dt.timezone.utc),
+        )
 
     def test_last_update_when_all_timeseries_has_no_data(self):
         self._create_timeseries()
@@ -331,6 +335,64 @@ class StationLastUpdateTestCase(TestCase):
     def test_last_update_when_no_timeseries(self):
         self.assertIsNone(self.station.last_update)
 
+    def test_last_update_after_appending_data(self):
+        timeseries = self._create_timeseries(2019, 7, 24, 13, 26)
+        timeseries.append_data(StringIO("2019-07-25 13:26,0,\n"))
+        self.station.refresh_from_db()
+        self.assertEqual(
+            self.station.last_update,
+            dt.datetime(2019, 7, 25, 11, 26, tzinfo=dt.timezone.utc),
+        )
+
+    def test_last_update_after_deleting_timeseries(self):
+        self._create_timeseries(2019, 7, 24, 13, 26)
+        timeseries = self._create_timeseries(2019, 7, 25, 13, 26)
+        timeseries.delete()
+        self.station.refresh_from_db()
+        self.assertEqual(
+            self.station.last_update,
+            dt.datetime(2019, 7, 24, 11, 26, tzinfo=dt.timezone.utc),
+        )
+
+    def test_last_update_after_moving_timeseries(self):
+        self._create_timeseries(2019, 7, 24, 13, 26)
+        timeseries = self._create_timeseries(2019, 7, 25, 13, 26)
+        other_station = mommy.make(models.Station)
+        timeseries.gentity = other_station
+        timeseries.save()
+        self.station.refresh_from_db()
+        other_station.refresh_from_db()
+        self.assertEqual(
+            self.station.last_update,
+            dt.datetime(2019, 7, 24, 11, 26, tzinfo=dt.timezone.utc),
+        )
+        self.assertEqual(
+            other_station.last_update,
+            dt.datetime(2019, 7, 25, 11, 26, tzinfo=dt.timezone.utc),
+        )
+
+    def test_last_update_naive(self):
+        self._create_timeseries(2019, 7, 24, 13, 26)
+        self.assertEqual(
+            self.station.last_update_naive, dt.datetime(2019, 7, 24, 13, 26)
+        )
+
+    def test_last_update_naive_when_no_data(self):
+        self._create_timeseries()
+        self.assertIsNone(self.station.last_update_naive)
+
+    def test_save_does_not_overwrite_last_update(self):
+        station = models.Station.objects.get(id=self.station.id)
+        self._create_timeseries(2019, 7, 24, 13, 26)
+        station.name = "Renamed"
+        station.save()
+        self.station.refresh_from_db()
+        self.assertEqual(self.station.name, "Renamed")
+        self.assertEqual(
+            self.station.last_update,
+            dt.datetime(2019, 7, 24, 11, 26, tzinfo=dt.timezone.utc),
+        )
+
 
 class UnitOfMeasurementTestCase(TestCase):
     def test_str(self):
@@ -418,6 +480,7 @@ def make_timeseries(*, start_date, end_date, **kwargs):
     result = mommy.make(models.Timeseries, **kwargs)
     result.timeseriesrecord_set.create(timestamp=start_date, value=0, flags="")
     result.timeseriesrecord_set.create(timestamp=end_date, value=0, flags="")
+    result.rebuild_summary()
     return result
 
 
@@ -465,6 +528,125 @@ class TimeseriesDatesTestCase(TestCase):
         )
 
 
+class TimeseriesSummaryTestCase(TestCase):
+    def setUp(self):
+        self.timeseries = mommy.make(
+            models.Timeseries, time_zone__utc_offset=120, precision=2
+        )
+        self.timeseries.set_data(
+            StringIO("2018-01-01 00:00,1,\n2018-01-01 00:10,2,\n2018-01-01 00:20,3,A\n")
+        )
+
+    def _check_summary(self, start_date, end_date, count, value, flags):
+        for timeseries in (
+            self.timeseries,
+            models.Timeseries.objects.get(id=self.timeseries.id),
+        ):
+            self.assertEqual(timeseries.start_date_naive, start_date)
+            self.assertEqual(timeseries.end_date_naive, end_date)
+            self.assertEqual(timeseries.records_count, count)
+            self.assertEqual(timeseries.last_record_value, value)
+            self.assertEqual(timeseries.last_record_flags, flags)
+
+    def test_set_data(self):
+        self._check_summary(
+            dt.datetime(2018, 1, 1, 0, 0), dt.datetime(2018, 1, 1, 0, 20), 3, 3, "A"
+        )
+
+    def test_append_data(self):
+        self.timeseries.append_data(StringIO("2018-01-01 00:30,,MISS\n"))
+        self._check_summary(
+            dt.datetime(2018, 1, 1, 0, 0),
+            dt.datetime(2018, 1, 1, 0, 30),
+            4,
+            None,
+            "MISS",
+        )
+
+    def test_merge_data(self):
+        self.timeseries.merge_data(
+            StringIO("2017-12-31 23:50,0,\n2018-01-01 00:20,4,\n")
+        )
+        self._check_summary(
+            dt.datetime(2017, 12, 31, 23, 50), dt.datetime(2018, 1, 1, 0, 20), 4, 4, ""
+        )
+
+    def test_replace_range(self):
+        tzinfo = self.timeseries.time_zone.as_tzinfo
+        self.timeseries.replace_range(
+            dt.datetime(2018, 1, 1, 0, 10, tzinfo=tzinfo), None, HTimeseries()
+        )
+        self._check_summary(
+            dt.datetime(2018, 1, 1, 0, 0), dt.datetime(2018, 1, 1, 0, 0), 1, 1, ""
+        )
+
+    def test_set_empty_data(self):
+        self.timeseries.set_data(HTimeseries())
+        self._check_summary(None, None, 0, None, "")
+
+    def test_rebuild_summary(self):
+        models.Timeseries.objects.filter(id=self.timeseries.id).update(
+            start_date_utc=None, end_date_utc=None, records_count=0
+        )
+        timeseries = models.Timeseries.objects.get(id=self.timeseries.id)
+        timeseries.rebuild_summary()
+        self.timeseries.refresh_from_db()
+        self._check_summary(
+            dt.datetime(2018, 1, 1, 0, 0), dt.datetime(2018, 1, 1, 0, 20), 3, 3, "A"
+        )
+
+    def test_save_does_not_overwrite_summary(self):
+        timeseries = models.Timeseries.objects.get(id=self.timeseries.id)
+        self.timeseries.append_data(StringIO("2018-01-01 00:30,4,\n"))
+        timeseries.name = "Renamed"
+        timeseries.save()
+        self.timeseries.refresh_from_db()
+        self.assertEqual(self.timeseries.name, "Renamed")
+        self._check_summary(
+            dt.datetime(2018, 1, 1, 0, 0), dt.datetime(2018, 1, 1, 0, 30), 4, 4, ""
+        )
+
+    def test_dates_do_not_query_records(self):
+        timeseries = models.Timeseries.objects.select_related("time_zone").get(
+            id=self.timeseries.id
+        )
+        with self.assertNumQueries(0):
+            timeseries.start_date
+            timeseries.end_date
+            timeseries.get_last_record_as_string()
+
+
+class TimeseriesDataVersionTestCase(TestCase):
+    def setUp(self):
+        self.timeseries = mommy.make(
+            models.Timeseries, time_zone__utc_offset=120, precision=2
+        )
+        self.timeseries.set_data(StringIO("2018-01-01 00:00,1,\n"))
+        self.version = self.timeseries.data_version
+
+    def _get_stored_version(self):
+        return models.Timeseries.objects.get(id=self.timeseries.id).data_version
+
+    def test_append_data(self):
+        self.timeseries.append_data(StringIO("2018-01-01 00:10,2,\n"))
+        self.assertGreater(self.timeseries.data_version, self.version)
+        self.assertEqual(self._get_stored_version(), self.timeseries.data_version)
+
+    def test_merge_data_that_updates(self):
+        self.timeseries.merge_data(StringIO("2018-01-01 00:00,2,\n"))
+        self.assertGreater(self._get_stored_version(), self.version)
+
+    def test_merge_unchanged_data(self):
+        self.timeseries.merge_data(StringIO("2018-01-01 00:00,1,\n"))
+        self.assertEqual(self._get_stored_version(), self.version)
+
+    def test_save_of_stale_instance(self):
+        timeseries = models.Timeseries.objects.get(id=self.timeseries.id)
+        self.timeseries.append_data(StringIO("2018-01-01 00:10,2,\n"))
+        timeseries.save()
+        self.assertGreater(self._get_stored_version(), self.timeseries.data_version)
+
+
 class DataTestCase(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -496,6 +678,7 @@ class DataTestCase(TestCase):
             index=[dt.datetime(2017, 11, 23, 17, 23), dt.datetime(2018, 11, 25, 1, 0)],
         )
         cls.expected_result.index.name = "date"
+        cls.expected_result["flags"] = cls.expected_result["flags"].astype("category")
 
 
 class TimeseriesGetDataTestCase(DataTestCase):
@@ -563,6 +746,7 @@ class TimeseriesGetDataWithStartAndEndDateTestCase(DataTestCase):
             index=[dt.datetime(2017, 11, 23, 17, 23), dt.datetime(2018, 11, 25, 1, 0)],
         )
         full_result.index.name = "date"
+        full_result["flags"] = full_result["flags"].astype("category")
         expected_result = full_result.iloc[start_index:end_index]
         pd.testing.assert_frame_equal(self.ahtimeseries.data, expected_result)
 
@@ -608,23 +792,277 @@ class TimeseriesGetDataWithStartAndEndDateTestCase(DataTestCase):
 )
 class TimeseriesGetDataCacheTestCase(DataTestCase):
     def test_cache(self):
-        # Make sure we've accessed gpoint already, otherwise it screws up the number of
-        # queries later
-        self.timeseries.gentity.gpoint.altitude
+        self._get_data_and_check_num_database_reads(1)
+        self._get_data_and_check_num_database_reads(0)
 
-        self._get_data_and_check_num_queries(1)
-        self._get_data_and_check_num_queries(0)
+        # Saving the time series does not invalidate the cache...
+        self.timeseries.save()
+        self._get_data_and_check_num_database_reads(0)
 
-        # Check cache invalidation
+        # ...unless its time zone changes (from UTC+0530 to UTC+0200, which moves the
+        # records 3.5 hours earlier)
+        self.timeseries.time_zone = mommy.make(models.TimeZone, utc_offset=120)
         self.timeseries.save()
-        self._get_data_and_check_num_queries(1)
+        expected_result = self.expected_result.copy()
+        expected_result.index = pd.DatetimeIndex(
+            [dt.datetime(2017, 11, 23, 13, 53), dt.datetime(2018, 11, 24, 21, 30)],
+            name="date",
+        )
+        self._get_data_and_check_num_database_reads(1, expected_result)
+
+    def _get_data_and_check_num_database_reads(self, num_reads, expected_result=None):
+        # We don't use assertNumQueries(), because it does not count COPY
+        if expected_result is None:
+            expected_result = self.expected_result
+        get_dataframe = models.TimeseriesRecord.get_dataframe
+        with patch.object(
+            models.TimeseriesRecord, "get_dataframe", wraps=get_dataframe
+        ) as m:
+            data = self.timeseries.get_data()
+        self.assertEqual(m.call_count, num_reads)
+        pd.testing.assert_frame_equal(data.data, expected_result)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class TimeseriesGetDataRangeWhenNotCachedTestCase(DataTestCase):
+    def setUp(self):
+        cache.clear()
+        tzinfo = self.timeseries.time_zone.as_tzinfo
+        self.start_date = dt.datetime(2018, 1, 1, 0, 0, tzinfo=tzinfo)
+        get_dataframe = models.TimeseriesRecord.get_dataframe
+        with patch.object(
+            models.TimeseriesRecord, "get_dataframe", wraps=get_dataframe
+        ) as m:
+            self.data = self.timeseries.get_data(start_date=self.start_date)
+        self.mock_get_dataframe = m
+
+    def test_reads_only_the_year_of_the_range_from_the_database(self):
+        tzinfo = self.timeseries.time_zone.as_tzinfo
+        self.mock_get_dataframe.assert_called_once_with(
+            self.timeseries,
+            dt.datetime(2018, 1, 1, 0, 0, tzinfo=tzinfo),
+            dt.datetime(2018, 12, 31, 23, 59, 59, 999999, tzinfo=tzinfo),
+        )
+
+    def test_data(self):
+        pd.testing.assert_frame_equal(self.data.data, self.expected_result.iloc[1:])
 
-    def _get_data_and_check_num_queries(self, num_queries):
-        with self.assertNumQueries(num_queries):
+    def test_caches_the_year_of_the_range(self):
+        tzinfo = self.timeseries.time_zone.as_tzinfo
+        get_dataframe = models.TimeseriesRecord.get_dataframe
+        with patch.object(
+            models.TimeseriesRecord, "get_dataframe", wraps=get_dataframe
+        ) as m:
             data = self.timeseries.get_data()
+        m.assert_called_once_with(
+            self.timeseries,
+            dt.datetime(2017, 1, 1, 0, 0, tzinfo=tzinfo),
+            dt.datetime(2017, 12, 31, 23, 59, 59, 999999, tzinfo=tzinfo),
+        )
         pd.testing.assert_frame_equal(data.data, self.expected_result)
 
 
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class TimeseriesGetDataRangeWhenCachedTestCase(DataTestCase):
+    def setUp(self):
+        cache.clear()
+        self.timeseries.get_data()
+        tzinfo = self.timeseries.time_zone.as_tzinfo
+        start_date = dt.datetime(2018, 1, 1, 0, 0, tzinfo=tzinfo)
+        get_dataframe = models.TimeseriesRecord.get_dataframe
+        with patch.object(
+            models.TimeseriesRecord, "get_dataframe", wraps=get_dataframe
+        ) as m:
+            self.data = self.timeseries.get_data(start_date=start_date)
+        self.mock_get_dataframe = m
+
+    def test_does_not_read_from_the_database(self):
+        self.mock_get_dataframe.assert_not_called()
+
+    def test_data(self):
+        pd.testing.assert_frame_equal(self.data.data, self.expected_result.iloc[1:])
+
+
+class TimeseriesIterDataTestCase(DataTestCase):
+    def _check(self, start_date=None, end_date=None, **kwargs):
+        """Check that iter_data() gives the same result as writing get_data()."""
+        f = StringIO()
+        self.timeseries.get_data(start_date=start_date, end_date=end_date).write(
+            f, **kwargs
+        )
+        result = "".join(
+            self.timeseries.iter_data(
+                start_date=start_date, end_date=end_date, **kwargs
+            )
+        )
+        self.assertEqual(result, f.getvalue())
+
+    def test_csv(self):
+        self._check()
+
+    def test_hts(self):
+        self._check(format=HTimeseries.FILE, version=5)
+
+    def test_hts2(self):
+        self._check(format=HTimeseries.FILE, version=2)
+
+    def test_hts_with_start_date(self):
+        tzinfo = self.timeseries.time_zone.as_tzinfo
+        self._check(
+            start_date=dt.datetime(2017, 11, 23, 17, 24, tzinfo=tzinfo),
+            format=HTimeseries.FILE,
+        )
+
+    def test_csv_with_end_date(self):
+        tzinfo = self.timeseries.time_zone.as_tzinfo
+        self._check(end_date=dt.datetime(2017, 11, 23, 17, 23, tzinfo=tzinfo))
+
+
+class TimeseriesGetAggregatedDataTestCase(TestCase):
+    def setUp(self):
+        self.timeseries = mommy.make(
+            models.Timeseries, time_zone__utc_offset=120, precision=1
+        )
+        self.timeseries.set_data(
+            StringIO(
+                "2019-01-01 00:00,1,\n"
+                "2019-01-01 12:00,2,\n"
+                "2019-01-01 23:50,,MISS\n"
+                "2019-01-03 00:10,4,\n"
+                "2019-02-01 00:00,5,\n"
+            )
+        )
+
+    def test_daily(self):
+        result = self.timeseries.get_aggregated_data("D", ["mean", "count"])
+        mean = result["mean"].data
+        self.assertEqual(
+            list(mean.index),
+            [
+                dt.datetime(2019, 1, 1),
+                dt.datetime(2019, 1, 3),
+                dt.datetime(2019, 2, 1),
+            ],
+        )
+        self.assertEqual(list(mean["value"]), [1.5, 4, 5])
+        self.assertEqual(list(result["count"].data["value"]), [2, 1, 1])
+
+    def test_properties(self):
+        result = self.timeseries.get_aggregated_data("D", ["mean", "count"])
+        self.assertEqual(result["mean"].time_step, "D")
+        self.assertEqual(result["mean"].precision, 1)
+        self.assertEqual(result["count"].precision, 0)
+
+    def test_minutes(self):
+        result = self.timeseries.get_aggregated_data("720min", ["max"])
+        self.assertEqual(
+            list(result["max"].data.index),
+            [
+                dt.datetime(2019, 1, 1, 0, 0),
+                dt.datetime(2019, 1, 1, 12, 0),
+                dt.datetime(2019, 1, 3, 0, 0),
+                dt.datetime(2019, 2, 1, 0, 0),
+            ],
+        )
+
+    def test_monthly(self):
+        result = self.timeseries.get_aggregated_data("M", ["sum"])
+        data = result["sum"].data
+        self.assertEqual(
+            list(data.index), [dt.datetime(2019, 1, 1), dt.datetime(2019, 2, 1)]
+        )
+        self.assertEqual(list(data["value"]), [7, 5])
+
+    def test_date_range(self):
+        tzinfo = self.timeseries.time_zone.as_tzinfo
+        result = self.timeseries.get_aggregated_data(
+            "Y",
+            ["min"],
+            start_date=dt.datetime(2019, 1, 1, 12, 0, tzinfo=tzinfo),
+            end_date=dt.datetime(2019, 1, 31, 0, 0, tzinfo=tzinfo),
+        )
+        self.assertEqual(list(result["min"].data["value"]), [2])
+
+    def test_empty(self):
+        result = self.timeseries.get_aggregated_data(
+            "D", ["mean"], start_date=dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc)
+        )
+        self.assertEqual(len(result["mean"].data), 0)
+
+    def test_invalid_time_step(self):
+        with self.assertRaises(ValueError):
+            self.timeseries.get_aggregated_data("2M", ["mean"])
+
+    def test_invalid_function(self):
+        with self.assertRaises(ValueError):
+            self.timeseries.get_aggregated_data("D", ["median"])
+
+
+class TimeseriesRecordIterCsvTestCase(TestCase):
+    def setUp(self):
+        self.timeseries = mommy.make(
+            models.Timeseries, time_zone__utc_offset=-150, precision=2
+        )
+        self.timeseries.set_data(
+            StringIO(
+                "2019-07-24 11:20,,MISS\n"
+                "2019-07-24 11:30,3.14159,\n"
+                "2019-07-24 11:40,1234.5,A B\n"
+            )
+        )
+
+    def test_records(self):
+        result = "".join(models.TimeseriesRecord.iter_csv(self.timeseries))
+        self.assertEqual(
+            result,
+            "2019-07-24 11:20,,MISS\r\n"
+            "2019-07-24 11:30,3.14,\r\n"
+            "2019-07-24 11:40,1234.50,A B\r\n",
+        )
+
+    def test_negative_precision(self):
+        self.timeseries.precision = -1
+        result = "".join(models.TimeseriesRecord.iter_csv(self.timeseries))
+        self.assertEqual(
+            result,
+            "2019-07-24 11:20,,MISS\r\n"
+            "2019-07-24 11:30,0,\r\n"
+            "2019-07-24 11:40,1230,A B\r\n",
+        )
+
+    def test_chunks(self):
+        result = list(models.TimeseriesRecord.iter_csv(self.timeseries, chunk_size=2))
+        self.assertEqual(len(result), 2)
+
+    def test_ties_and_infinities(self):
+        self.timeseries.set_data(
+            StringIO(
+                "2019-07-24 11:20,0.125,\n"
+                "2019-07-24 11:30,0.375,\n"
+                "2019-07-24 11:40,inf,\n"
+                "2019-07-24 11:50,-inf,\n"
+            )
+        )
+        result = "".join(models.TimeseriesRecord.iter_csv(self.timeseries))
+        self.assertEqual(
+            result,
+            "2019-07-24 11:20,0.12,\r\n"
+            "2019-07-24 11:30,0.38,\r\n"
+            "2019-07-24 11:40,inf,\r\n"
+            "2019-07-24 11:50,-inf,\r\n",
+        )
+
+    def test_same_as_htimeseries_write(self):
+        f = StringIO()
+        self.timeseries.get_data().write(f)
+        result = "".join(models.TimeseriesRecord.iter_csv(self.timeseries))
+        self.assertEqual(result, f.getvalue())
+
+
 class TimeseriesSetDataTestCase(TestCase):
     def setUp(self):
         self.timeseries = mommy.make(
@@ -733,6 +1171,7 @@ class TimeseriesAppendDataTestCase(TestCase):
             ],
         )
         expected_result.index.name = "date"
+        expected_result["flags"] = expected_result["flags"].astype("category")
         pd.testing.assert_frame_equal(self.timeseries.get_data().data, expected_result)
 
 
@@ -763,9 +1202,9 @@ class TimeseriesAppendDataToEmptyTimeseriesTestCase(TestCase):
         return result
 
     def _assert_wrote_data(self):
-        pd.testing.assert_frame_equal(
-            self.timeseries.get_data().data, self._get_dataframe()
-        )
+        expected_result = self._get_dataframe()
+        expected_result["flags"] = expected_result["flags"].astype("category")
+        pd.testing.assert_frame_equal(self.timeseries.get_data().data, expected_result)
 
 
 class TimeseriesAppendErrorTestCase(TestCase):
@@ -779,6 +1218,135 @@ class TimeseriesAppendErrorTestCase(TestCase):
                 StringIO("2017-11-23 17:23,1,\n2018-11-25 01:00,2,\n")
             )
 
+    def test_checks_the_dates_in_the_database(self):
+        timeseries = mommy.make(
+            models.Timeseries, id=42, time_zone__utc_offset=0, precision=2
+        )
+        stale_timeseries = models.Timeseries.objects.get(id=42)
+        timeseries.append_data(StringIO("2018-01-01 00:00,42,\n"))
+        with self.assertRaises(IntegrityError):
+            stale_timeseries.append_data(StringIO("2017-11-23 17:23,1,\n"))
+
+
+class TimeseriesMergeDataTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.timeseries = mommy.make(
+            models.Timeseries, time_zone__utc_offset=120, precision=2
+        )
+        self.timeseries.set_data(
+            StringIO(
+                "2017-11-23 17:23,1,\n"
+                "2018-01-01 00:00,2,\n"
+                "2018-11-25 01:00,,MISS\n"
+                "2019-01-01 00:00,4,\n"
+            )
+        )
+        self.timeseries.get_data()  # Populate the cache
+        self.result = self.timeseries.merge_data(
+            StringIO(
+                "2016-01-01 00:00,0,\n"
+                "2018-01-01 00:00,2,\n"
+                "2018-06-01 00:00,2.5,\n"
+                "2018-11-25 01:00,3,\n"
+                "2019-01-01 00:00,4,DOUBTFUL\n"
+            )
+        )
+
+    def test_result(self):
+        self.assertEqual(self.result, {"inserted": 2, "updated": 2, "unchanged": 1})
+
+    def test_data(self):
+        expected_result = pd.DataFrame(
+            data={
+                "value": [0.0, 1.0, 2.0, 2.5, 3.0, 4.0],
+                "flags": ["", "", "", "", "", "DOUBTFUL"],
+            },
+            columns=["value", "flags"],
+            index=[
+                dt.datetime(2016, 1, 1, 0, 0),
+                dt.datetime(2017, 11, 23, 17, 23),
+                dt.datetime(2018, 1, 1, 0, 0),
+                dt.datetime(2018, 6, 1, 0, 0),
+                dt.datetime(2018, 11, 25, 1, 0),
+                dt.datetime(2019, 1, 1, 0, 0),
+            ],
+        )
+        expected_result.index.name = "date"
+        expected_result["flags"] = expected_result["flags"].astype("category")
+        pd.testing.assert_frame_equal(self.timeseries.get_data().data, expected_result)
+
+    def test_merge_unchanged_data(self):
+        result = self.timeseries.merge_data(StringIO("2018-01-01 00:00,2,\n"))
+        self.assertEqual(result, {"inserted": 0, "updated": 0, "unchanged": 1})
+
+    def test_merge_empty_data(self):
+        result = self.timeseries.merge_data(HTimeseries())
+        self.assertEqual(result, {"inserted": 0, "updated": 0, "unchanged": 0})
+
+
+class TimeseriesReplaceRangeTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.timeseries = mommy.make(
+            models.Timeseries, time_zone__utc_offset=120, precision=2
+        )
+        self.timeseries.set_data(
+            StringIO(
+                "2017-11-23 17:23,1,\n"
+                "2018-01-01 00:00,2,\n"
+                "2018-01-01 00:10,3,\n"
+                "2018-01-01 00:20,4,\n"
+                "2019-01-01 00:00,5,\n"
+            )
+        )
+        self.timeseries.get_data()  # Populate the cache
+        self.tzinfo = self.timeseries.time_zone.as_tzinfo
+
+    def _get_index_and_values(self):
+        data = self.timeseries.get_data().data
+        return list(zip(data.index, data["value"]))
+
+    def test_replace(self):
+        count = self.timeseries.replace_range(
+            dt.datetime(2018, 1, 1, 0, 0, tzinfo=self.tzinfo),
+            dt.datetime(2018, 1, 1, 0, 10, tzinfo=self.tzinfo),
+            StringIO("2018-01-01 00:05,2.5,\n"),
+        )
+        self.assertEqual(count, 1)
+        self.assertEqual(
+            self._get_index_and_values(),
+            [
+                (dt.datetime(2017, 11, 23, 17, 23), 1.0),
+                (dt.datetime(2018, 1, 1, 0, 5), 2.5),
+                (dt.datetime(2018, 1, 1, 0, 20), 4.0),
+                (dt.datetime(2019, 1, 1, 0, 0), 5.0),
+            ],
+        )
+
+    def test_delete(self):
+        self.timeseries.replace_range(
+            dt.datetime(2018, 1, 1, 0, 0, tzinfo=self.tzinfo),
+            dt.datetime(2018, 12, 31, 23, 59, tzinfo=self.tzinfo),
+            HTimeseries(),
+        )
+        self.assertEqual(
+            self._get_index_and_values(),
+            [
+                (dt.datetime(2017, 11, 23, 17, 23), 1.0),
+                (dt.datetime(2019, 1, 1, 0, 0), 5.0),
+            ],
+        )
+
+    def test_data_outside_range(self):
+        with self.assertRaisesRegex(ValueError, "outside the range to replace"):
+            self.timeseries.replace_range(
+                dt.datetime(2018, 1, 1, 0, 0, tzinfo=self.tzinfo),
+                dt.datetime(2018, 1, 1, 0, 10, tzinfo=self.tzinfo),
+                StringIO("2018-01-01 00:05,2.5,\n2018-01-01 00:15,3.5,\n"),
+            )
+        self.assertEqual(len(self._get_index_and_values()), 5)
+
 
 class TimeseriesGetLastRecordAsStringTestCase(TestCase):
     def test_when_record_exists(self):
@@ -857,3 +1425,106 @@ class TimeseriesRecordTestCase(TestCase):
         record = models.TimeseriesRecord.objects.first()
         self.assertAlmostEqual(record.value, 3.14159)
         self.assertEqual(str(record), "2017-11-23 17:23,3.14,")
+
+
+class TimeseriesRecordBulkInsertTestCase(TestCase):
+    def setUp(self):
+        self.timeseries = mommy.make(
+            models.Timeseries, time_zone__utc_offset=-150, precision=2
+        )
+        self.htimeseries = HTimeseries(
+            StringIO(
+                "2019-07-24 11:20,,MISS\n"
+                "2019-07-24 11:30,3.14159,\n"
+                '2019-07-24 11:40,1234.5,"A,B"\n'
+            )
+        )
+
+    def _check_records(self):
+        self.assertEqual(
+            list(
+                self.timeseries.timeseriesrecord_set.order_by("timestamp").values_list(
+                    "timestamp", "value", "flags"
+                )
+            ),
+            [
+                (
+                    dt.datetime(2019, 7, 24, 13, 50, tzinfo=dt.timezone.utc),
+                    None,
+                    "MISS",
+                ),
+                (dt.datetime(2019, 7, 24, 14, 0, tzinfo=dt.timezone.utc), 3.14159, ""),
+                (
+                    dt.datetime(2019, 7, 24, 14, 10, tzinfo=dt.timezone.utc),
+                    1234.5,
+                    "A,B",
+                ),
+            ],
+        )
+
+    def test_copy(self):
+        count = models.TimeseriesRecord.bulk_insert(self.timeseries, self.htimeseries)
+        self.assertEqual(count, 3)
+        self._check_records()
+
+    def test_copy_in_batches(self):
+        models.TimeseriesRecord._copy_insert(
+            self.timeseries, self.htimeseries.data, batch_size=2
+        )
+        self._check_records()
+
+    def test_bulk_create(self):
+        with patch.object(models.connection, "vendor", "sqlite"):
+            count = models.TimeseriesRecord.bulk_insert(
+                self.timeseries, self.htimeseries
+            )
+        self.assertEqual(count, 3)
+        self.assertEqual(self.timeseries.timeseriesrecord_set.count(), 3)
+
+    def test_duplicate_timestamp(self):
+        models.TimeseriesRecord.bulk_insert(self.timeseries, self.htimeseries)
+        with self.assertRaises(IntegrityError):
+            models.TimeseriesRecord.bulk_insert(self.timeseries, self.htimeseries)
+
+    @patch("enhydris.models.pyramid.update", side_effect=RuntimeError)
+    def test_rolls_back_records_if_summary_update_fails(self, m):
+        with self.assertRaises(RuntimeError):
+            models.TimeseriesRecord.bulk_insert(self.timeseries, self.htimeseries)
+        self.assertEqual(self.timeseries.timeseriesrecord_set.count(), 0)
+        self.timeseries.refresh_from_db()
+        self.assertEqual(self.timeseries.records_count, 0)
+
+
+class TimeseriesRecordGetDataframeTestCase(TestCase):
+    def setUp(self):
+        self.timeseries = mommy.make(
+            models.Timeseries, time_zone__utc_offset=120, precision=2
+        )
+
+    def test_records(self):
+        self.timeseries.timeseriesrecord_set.create(
+            timestamp=dt.datetime(2019, 7, 24, 11, 20, tzinfo=dt.timezone.utc),
+            value=None,
+            flags="MISS",
+        )
+        self.timeseries.timeseriesrecord_set.create(
+            timestamp=dt.datetime(2019, 7, 24, 11, 30, tzinfo=dt.timezone.utc),
+            value=3.14159,
+            flags="",
+        )
+        expected_result = pd.DataFrame(
+            data={"value": [float("NaN"), 3.14159], "flags": ["MISS", ""]},
+            columns=["value", "flags"],
+            index=[dt.datetime(2019, 7, 24, 13, 20), dt.datetime(2019, 7, 24, 13, 30)],
+        )
+        expected_result.index.name = "date"
+        expected_result["flags"] = expected_result["flags"].astype("category")
+        pd.testing.assert_frame_equal(
+            models.TimeseriesRecord.get_dataframe(self.timeseries), expected_result
+        )
+
+    def test_empty(self):
+        result = models.TimeseriesRecord.get_dataframe(self.timeseries)
+        self.assertEqual(len(result), 0)
+        self.assertEqual(list(result.columns), ["value", "flags"])
+        self.assertIsInstance(result.index, pd.DatetimeIndex)
@@ -0,0 +1,229 @@
+import datetime as dt
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+
+from model_mommy import mommy
+
+from enhydris import models, pyramid
+
+
+class PyramidTestCaseBase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.timeseries = mommy.make(
+            models.Timeseries, time_zone__utc_offset=120, precision=2
+        )
+        self.timeseries.set_data(
+            StringIO(
+                "2018-12-31 23:10,1,\n"
+                "2018-12-31 23:20,3,\n"
+                "2019-01-01 00:00,,MISS\n"
+                "2019-01-01 00:10,5,\n"
+                "2019-01-02 12:00,7,\n"
+            )
+        )
+        self.tzinfo = self.timeseries.time_zone.as_tzinfo
+
+    def _get_level(self, level):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT bucket, min, max, sum, count
+                FROM enhydris_timeseriespyramid
+                WHERE timeseries_id = %s AND level = %s
+                ORDER BY bucket
+                """,
+                [self.timeseries.id, level],
+            )
+            return cursor.fetchall()
+
+
+class PyramidSetDataTestCase(PyramidTestCaseBase):
+    def test_hourly(self):
+        self.assertEqual(
+            self._get_level("H"),
+            [
+                (dt.datetime(2018, 12, 31, 23, 0), 1, 3, 4, 2),
+                (dt.datetime(2019, 1, 1, 0, 0), 5, 5, 5, 1),
+                (dt.datetime(2019, 1, 2, 12, 0), 7, 7, 7, 1),
+            ],
+        )
+
+    def test_daily(self):
+        self.assertEqual(
+            self._get_level("D"),
+            [
+                (dt.datetime(2018, 12, 31), 1, 3, 4, 2),
+                (dt.datetime(2019, 1, 1), 5, 5, 5, 1),
+                (dt.datetime(2019, 1, 2), 7, 7, 7, 1),
+            ],
+        )
+
+    def test_monthly(self):
+        self.assertEqual(
+            self._get_level("M"),
+            [
+                (dt.datetime(2018, 12, 1), 1, 3, 4, 2),
+                (dt.datetime(2019, 1, 1), 5, 7, 12, 2),
+            ],
+        )
+
+    def test_yearly(self):
+        self.assertEqual(
+            self._get_level("Y"),
+            [
+                (dt.datetime(2018, 1, 1), 1, 3, 4, 2),
+                (dt.datetime(2019, 1, 1), 5, 7, 12, 2),
+            ],
+        )
+
+    def test_set_data_replaces_pyramid(self):
+        self.timeseries.set_data(StringIO("2020-03-01 00:00,9,\n"))
+        self.assertEqual(self._get_level("Y"), [(dt.datetime(2020, 1, 1), 9, 9, 9, 1)])
+
+
+class PyramidUpdateTestCase(PyramidTestCaseBase):
+    def test_append(self):
+        self.timeseries.append_data(StringIO("2019-01-02 12:10,-1,\n"))
+        self.assertEqual(
+            self._get_level("M")[-1], (dt.datetime(2019, 1, 1), -1, 7, 11, 3)
+        )
+
+    def test_append_only_recalculates_affected_buckets(self):
+        with connection.cursor() as cursor:
+            # Tamper with a bucket that the append does not touch
+            cursor.execute(
+                """
+                UPDATE enhydris_timeseriespyramid SET max = 100
+                WHERE timeseries_id = %s AND level = 'D' AND bucket = '2019-01-01'
+                """,
+                [self.timeseries.id],
+            )
+        self.timeseries.append_data(StringIO("2019-01-02 12:10,-1,\n"))
+        self.assertEqual(
+            self._get_level("D")[1], (dt.datetime(2019, 1, 1), 5, 100, 5, 1)
+        )
+        self.assertEqual(
+            self._get_level("D")[2], (dt.datetime(2019, 1, 2), -1, 7, 6, 2)
+        )
+
+    def test_merge(self):
+        self.timeseries.merge_data(StringIO("2018-12-31 23:20,8,\n"))
+        self.assertEqual(self._get_level("Y")[0], (dt.datetime(2018, 1, 1), 1, 8, 9, 2))
+
+    def test_replace_range(self):
+        self.timeseries.replace_range(
+            dt.datetime(2019, 1, 1, 0, 0, tzinfo=self.tzinfo),
+            dt.datetime(2019, 1, 1, 23, 59, tzinfo=self.tzinfo),
+            StringIO(""),
+        )
+        self.assertEqual(
+            self._get_level("D"),
+            [
+                (dt.datetime(2018, 12, 31), 1, 3, 4, 2),
+                (dt.datetime(2019, 1, 2), 7, 7, 7, 1),
+            ],
+        )
+        self.assertEqual(self._get_level("Y")[1], (dt.datetime(2019, 1, 1), 7, 7, 7, 1))
+
+    def test_change_time_zone(self):
+        self.timeseries.time_zone = mommy.make(models.TimeZone, utc_offset=0)
+        self.timeseries.save()
+        self.assertEqual(self._get_level("Y")[0], (dt.datetime(2018, 1, 1), 1, 5, 9, 3))
+
+    def test_delete_timeseries(self):
+        self.timeseries.delete()
+        self.assertEqual(self._get_level("H"), [])
+
+
+class ChooseLevelTestCase(TestCase):
+    def setUp(self):
+        self.timeseries = mommy.make(
+            models.Timeseries,
+            time_zone__utc_offset=0,
+            start_date_utc=dt.datetime(1990, 1, 1, tzinfo=dt.timezone.utc),
+            end_date_utc=dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc),
+            records_count=30 * 52560,  # 30 years of ten-minute records
+        )
+
+    def _choose_level(self, start_date, end_date, npoints=200):
+        level = pyramid.choose_level(self.timeseries, start_date, end_date, npoints)
+        return level and level.name
+
+    def test_all(self):
+        self.assertEqual(self._choose_level(None, None), "M")
+
+    def test_five_years(self):
+        self.assertEqual(
+            self._choose_level(dt.datetime(2010, 1, 1), dt.datetime(2015, 1, 1)), "D"
+        )
+
+    def test_one_month(self):
+        self.assertEqual(
+            self._choose_level(dt.datetime(2010, 1, 1), dt.datetime(2010, 2, 1)), "H"
+        )
+
+    def test_one_week(self):
+        self.assertIsNone(
+            self._choose_level(dt.datetime(2010, 1, 1), dt.datetime(2010, 1, 8))
+        )
+
+    def test_outside_the_time_series(self):
+        self.assertIsNone(self._choose_level(dt.datetime(2021, 1, 1), None))
+
+    def test_empty_time_series(self):
+        self.timeseries.start_date_utc = self.timeseries.end_date_utc = None
+        self.timeseries.records_count = 0
+        self.assertIsNone(self._choose_level(None, None))
+
+
+class GetChartDataframeTestCase(PyramidTestCaseBase):
+    def test_minmax(self):
+        result = pyramid.get_chart_dataframe(
+            self.timeseries, pyramid.LEVELS[1], None, None, "minmax"
+        )
+        self.assertEqual(list(result["value"]), [1, 3, 5, 5, 7, 7])
+        self.assertEqual(
+            list(result.index),
+            [
+                dt.datetime(2018, 12, 31),
+                dt.datetime(2018, 12, 31),
+                dt.datetime(2019, 1, 1),
+                dt.datetime(2019, 1, 1),
+                dt.datetime(2019, 1, 2),
+                dt.datetime(2019, 1, 2),
+            ],
+        )
+
+    def test_mean(self):
+        result = pyramid.get_chart_dataframe(
+            self.timeseries, pyramid.LEVELS[1], None, None, "lttb"
+        )
+        self.assertEqual(list(result["value"]), [2, 5, 7])
+
+    def test_range_includes_whole_buckets(self):
+        result = pyramid.get_chart_dataframe(
+            self.timeseries,
+            pyramid.LEVELS[1],
+            dt.datetime(2019, 1, 1, 12, 0),
+            dt.datetime(2019, 1, 1, 23, 0),
+            "lttb",
+        )
+        self.assertEqual(list(result["value"]), [5])
+
+
+class GetChartDataTestCase(PyramidTestCaseBase):
+    def test_from_records(self):
+        result = self.timeseries.get_chart_data(npoints=10)
+        self.assertEqual(list(result), [1, 3, 5, 7])
+        self.assertEqual(result.index[-1], dt.datetime(2019, 1, 2, 12, 0))
+
+    def test_from_pyramid(self):
+        with patch("enhydris.pyramid.choose_level", return_value=pyramid.LEVELS[1]):
+            result = self.timeseries.get_chart_data(npoints=10, method="lttb")
+        self.assertEqual(list(result), [2, 5, 7])
+        self.assertEqual(result.index[-1], dt.datetime(2019, 1, 2))
@@ -0,0 +1,79 @@
+import datetime as dt
+
+from django.test import SimpleTestCase
+
+import numpy as np
+import pandas as pd
+
+from enhydris.stats import get_statistics
+
+
+def _make_data(values):
+    return pd.DataFrame(
+        {"value": np.array(values, dtype=np.float64), "flags": ""},
+        columns=["value", "flags"],
+        index=pd.date_range(
+            "2019-01-01", periods=len(values), freq="10min", name="date"
+        ),
+    )
+
+
+class GetStatisticsTestCase(SimpleTestCase):
+    def setUp(self):
+        self.result = get_statistics(_make_data([3, 1, np.nan, 7, 5, np.nan]))
+
+    def test_count(self):
+        self.assertEqual(self.result["count"], 4)
+
+    def test_min(self):
+        self.assertEqual(self.result["min"], 1)
+        self.assertEqual(self.result["min_date"], dt.datetime(2019, 1, 1, 0, 10))
+
+    def test_max(self):
+        self.assertEqual(self.result["max"], 7)
+        self.assertEqual(self.result["max_date"], dt.datetime(2019, 1, 1, 0, 30))
+
+    def test_sum_and_mean(self):
+        self.assertEqual(self.result["sum"], 16)
+        self.assertEqual(self.result["mean"], 4)
+
+    def test_last(self):
+        self.assertEqual(self.result["last"], 5)
+        self.assertEqual(self.result["last_date"], dt.datetime(2019, 1, 1, 0, 40))
+
+    def test_no_vector_statistics(self):
+        self.assertNotIn("vector_mean", self.result)
+
+
+class GetStatisticsEmptyTestCase(SimpleTestCase):
+    def test_empty(self):
+        result = get_statistics(_make_data([np.nan]), vector=True)
+        self.assertEqual(result["count"], 0)
+        self.assertIsNone(result["mean"])
+        self.assertIsNone(result["last_date"])
+        self.assertIsNone(result["vector_mean"])
+        self.assertEqual(result["sectors"], [0] * 8)
+
+
+class GetStatisticsInfiniteTestCase(SimpleTestCase):
+    def test_infinite_values_are_ignored(self):
+        result = get_statistics(_make_data([3, np.inf, 1, -np.inf]))
+        self.assertEqual(result["count"], 2)
+        self.assertEqual(result["max"], 3)
+        self.assertEqual(result["min"], 1)
+        self.assertEqual(result["sum"], 4)
+        self.assertEqual(result["last"], 1)
+
+
+class GetVectorStatisticsTestCase(SimpleTestCase):
+    def test_mean_across_north(self):
+        result = get_statistics(_make_data([350, 10, 370]), vector=True)
+        self.assertAlmostEqual(result["vector_mean"], 3.364, places=3)
+
+    def test_mean_is_positive(self):
+        result = get_statistics(_make_data([260, 280]), vector=True)
+        self.assertAlmostEqual(result["vector_mean"], 270)
+
+    def test_sectors(self):
+        result = get_statistics(_make_data([350, 22, 23, 90, 180, 337.5, -90]), True)
+        self.assertEqual(result["sectors"], [3, 1, 1, 0, 1, 0, 1, 0])
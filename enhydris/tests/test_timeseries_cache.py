@@ -0,0 +1,323 @@
+import datetime as dt
+from importlib.util import find_spec
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+import numpy as np
+import pandas as pd
+from htimeseries import HTimeseries
+from model_mommy import mommy
+
+from enhydris import models
+from enhydris.timeseries_cache import (
+    TimeseriesCache,
+    _get_year_tokens,
+    deserialize,
+    get_many,
+    serialize,
+)
+
+
+class TimeseriesCacheTestMixin:
+    def setUp(self):
+        cache.clear()
+        self.timeseries = mommy.make(
+            models.Timeseries, time_zone__utc_offset=120, precision=2
+        )
+        self.timeseries.set_data(
+            StringIO(
+                "2016-06-01 00:00,1,\n"
+                "2017-01-01 00:00,2,\n"
+                "2017-12-31 23:50,3,\n"
+                "2019-03-01 00:00,4,\n"
+            )
+        )
+        self.timeseries_cache = TimeseriesCache(self.timeseries)
+
+    def _get_and_check_years_read(self, expected_years, start_date=None, end_date=None):
+        get_dataframe = models.TimeseriesRecord.get_dataframe
+        with patch.object(
+            models.TimeseriesRecord, "get_dataframe", wraps=get_dataframe
+        ) as m:
+            result = self.timeseries_cache.get(start_date, end_date)
+        years_read = []
+        for call in m.call_args_list:
+            timeseries, start_date, end_date = call[0]
+            years_read.extend(range(start_date.year, end_date.year + 1))
+        self.assertEqual(years_read, expected_years)
+        return result
+
+
+class TimeseriesCacheTestCase(TimeseriesCacheTestMixin, TestCase):
+    def test_first_read_reads_all_years(self):
+        self._get_and_check_years_read([2016, 2017, 2018, 2019])
+
+    def test_second_read_reads_nothing(self):
+        self.timeseries_cache.get()
+        self._get_and_check_years_read([])
+
+    def test_data(self):
+        data = self._get_and_check_years_read([2016, 2017, 2018, 2019])
+        self.assertEqual(list(data["value"]), [1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(
+            list(data.index),
+            [
+                dt.datetime(2016, 6, 1, 0, 0),
+                dt.datetime(2017, 1, 1, 0, 0),
+                dt.datetime(2017, 12, 31, 23, 50),
+                dt.datetime(2019, 3, 1, 0, 0),
+            ],
+        )
+
+    def test_range_reads_only_overlapping_years(self):
+        data = self._get_and_check_years_read(
+            [2017], dt.datetime(2017, 1, 1, 0, 0), dt.datetime(2017, 6, 1, 0, 0)
+        )
+        self.assertEqual(list(data["value"]), [2.0])
+
+    def test_range_uses_cached_years(self):
+        self.timeseries_cache.get(dt.datetime(2017, 1, 1, 0, 0))
+        self._get_and_check_years_read([2016])
+
+    def test_range_outside_time_series(self):
+        data = self._get_and_check_years_read([], dt.datetime(2020, 1, 1, 0, 0))
+        self.assertEqual(len(data), 0)
+        self.assertEqual(list(data.columns), ["value", "flags"])
+
+    def test_invalidate_range(self):
+        self.timeseries_cache.get()
+        self.timeseries_cache.invalidate(
+            dt.datetime(2017, 12, 31, 0, 0), dt.datetime(2018, 1, 5, 0, 0)
+        )
+        self._get_and_check_years_read([2017, 2018])
+
+    def test_invalidate_all(self):
+        self.timeseries_cache.get()
+        self.timeseries_cache.invalidate()
+        self._get_and_check_years_read([2016, 2017, 2018, 2019])
+
+    def test_time_zone_change_invalidates_all(self):
+        self.timeseries_cache.get()
+        self.timeseries.time_zone = mommy.make(models.TimeZone, utc_offset=60)
+        self._get_and_check_years_read([2016, 2017, 2018, 2019])
+
+    def test_set_data_invalidates_all(self):
+        self.timeseries_cache.get()
+        self.timeseries.set_data(StringIO("2018-01-01 00:00,5,\n"))
+        data = self._get_and_check_years_read([2018])
+        self.assertEqual(list(data["value"]), [5.0])
+
+
+class TimeseriesCacheWriteTestCase(TimeseriesCacheTestMixin, TransactionTestCase):
+    """The cache is invalidated again on commit, hence no TestCase."""
+
+    def _get_cached_chunks(self):
+        directory = self.timeseries_cache._get_directory()
+        year_token_keys = self.timeseries_cache._get_year_token_keys(
+            directory, None, None
+        )
+        year_tokens = _get_year_tokens(year_token_keys, cache.get_many(year_token_keys))
+        keys = self.timeseries_cache._get_chunk_keys(directory, year_tokens)
+        return cache.get_many(keys)
+
+    def test_append_invalidates_the_year(self):
+        self.timeseries_cache.get()
+        self.timeseries.append_data(StringIO("2019-12-31 00:00,5,\n"))
+        data = self._get_and_check_years_read([2019])
+        self.assertEqual(list(data["value"]), [1.0, 2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(data.index[-1], dt.datetime(2019, 12, 31, 0, 0))
+
+    def test_append_to_new_year(self):
+        self.timeseries_cache.get()
+        self.timeseries.append_data(StringIO("2020-01-01 00:00,5,\n"))
+        data = self._get_and_check_years_read([2020])
+        self.assertEqual(list(data["value"]), [1.0, 2.0, 3.0, 4.0, 5.0])
+
+    def test_insert_in_the_middle(self):
+        self.timeseries_cache.get()
+        models.TimeseriesRecord.bulk_insert(
+            self.timeseries, HTimeseries(StringIO("2017-06-01 00:00,5,\n"))
+        )
+        data = self._get_and_check_years_read([2017])
+        self.assertEqual(list(data["value"]), [1.0, 2.0, 5.0, 3.0, 4.0])
+
+    def test_insert_in_transaction(self):
+        self.timeseries_cache.get()
+        with transaction.atomic():
+            self.timeseries.append_data(StringIO("2019-12-31 00:00,5,\n"))
+            data = self.timeseries_cache.get()
+            self.assertEqual(list(data["value"]), [1.0, 2.0, 3.0, 4.0, 5.0])
+        data = self._get_and_check_years_read([2019])
+        self.assertEqual(list(data["value"]), [1.0, 2.0, 3.0, 4.0, 5.0])
+
+    def test_rollback(self):
+        self.timeseries_cache.get()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            models.TimeseriesRecord.bulk_insert(
+                self.timeseries, HTimeseries(StringIO("2017-06-01 00:00,5,\n"))
+            )
+            raise RuntimeError()
+        timeseries = models.Timeseries.objects.get(id=self.timeseries.id)
+        data = TimeseriesCache(timeseries).get()
+        self.assertEqual(list(data["value"]), [1.0, 2.0, 3.0, 4.0])
+
+    def test_chunk_read_before_append_and_cached_after_it(self):
+        self.timeseries_cache.get()
+        stale_chunks = self._get_cached_chunks()
+        self.timeseries.append_data(StringIO("2019-12-31 00:00,5,\n"))
+        # Another process, which read the data before the append, caches it now
+        cache.set_many(stale_chunks)
+        data = self.timeseries_cache.get()
+        self.assertEqual(list(data["value"]), [1.0, 2.0, 3.0, 4.0, 5.0])
+
+    def test_replace_range_invalidates_on_commit(self):
+        self.timeseries_cache.get()
+        stale_chunks = self._get_cached_chunks()
+        tzinfo = self.timeseries.time_zone.as_tzinfo
+        with transaction.atomic():
+            self.timeseries.replace_range(
+                dt.datetime(2017, 1, 1, 0, 0, tzinfo=tzinfo),
+                dt.datetime(2017, 12, 31, 23, 59, tzinfo=tzinfo),
+                StringIO("2017-06-01 00:00,5,\n"),
+            )
+            # Another process caches the data as it was before the transaction
+            self.timeseries_cache.get()
+            cache.set_many(stale_chunks)
+        data = self.timeseries_cache.get()
+        self.assertEqual(list(data["value"]), [1.0, 5.0, 4.0])
+
+
+class GetManyTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.timeseries1 = mommy.make(
+            models.Timeseries, time_zone__utc_offset=120, precision=2
+        )
+        self.timeseries1.set_data(
+            StringIO("2016-06-01 00:00,1,\n2017-01-01 00:00,2,\n")
+        )
+        self.timeseries2 = mommy.make(
+            models.Timeseries, time_zone__utc_offset=60, precision=2
+        )
+        self.timeseries2.set_data(StringIO("2017-03-01 00:00,3,\n"))
+        TimeseriesCache(self.timeseries1).get()
+
+    def _get_many(self, dates):
+        return get_many([self.timeseries1, self.timeseries2], dates)
+
+    def test_data(self):
+        data1, data2 = self._get_many([(None, None), (None, None)])
+        self.assertEqual(list(data1["value"]), [1.0, 2.0])
+        self.assertEqual(list(data2["value"]), [3.0])
+
+    def test_ranges(self):
+        data1, data2 = self._get_many(
+            [(dt.datetime(2017, 1, 1, 0, 0), None), (None, dt.datetime(2017, 1, 1))]
+        )
+        self.assertEqual(list(data1["value"]), [2.0])
+        self.assertEqual(len(data2), 0)
+
+    def test_reads_only_missing_chunks_from_database(self):
+        get_dataframe = models.TimeseriesRecord.get_dataframe
+        with patch.object(
+            models.TimeseriesRecord, "get_dataframe", wraps=get_dataframe
+        ) as m:
+            self._get_many([(None, None), (None, None)])
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(m.call_args[0][0], self.timeseries2)
+
+    def test_reads_cache_at_once(self):
+        self._get_many([(None, None), (None, None)])
+        with patch("enhydris.timeseries_cache.cache") as m:
+            m.get_many.side_effect = cache.get_many
+            self._get_many([(None, None), (None, None)])
+        self.assertEqual(m.get_many.call_count, 3)
+        m.get.assert_not_called()
+
+
+class TimeseriesCacheEmptyTimeseriesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.timeseries = mommy.make(models.Timeseries)
+
+    def test_get(self):
+        data = TimeseriesCache(self.timeseries).get()
+        expected_result = pd.DataFrame(
+            data={"value": np.array([], dtype=np.float64), "flags": pd.Categorical([])},
+            columns=["value", "flags"],
+            index=pd.DatetimeIndex([], name="date"),
+        )
+        pd.testing.assert_frame_equal(data, expected_result)
+
+
+class SerializationTestCase(SimpleTestCase):
+    def setUp(self):
+        self.data = pd.DataFrame(
+            data={
+                "value": [1.5, float("nan"), 3.25],
+                "flags": pd.Categorical(["", "MISS", "A B"]),
+            },
+            columns=["value", "flags"],
+            index=pd.DatetimeIndex(
+                [
+                    dt.datetime(2017, 11, 23, 17, 23),
+                    dt.datetime(2018, 11, 25, 1, 0),
+                    dt.datetime(2018, 11, 25, 1, 10),
+                ],
+                name="date",
+            ),
+        )
+
+    def _check_round_trip(self, data):
+        pd.testing.assert_frame_equal(deserialize(serialize(data)), data)
+
+    @override_settings(ENHYDRIS_CACHE_COMPRESSION=None)
+    def test_uncompressed(self):
+        self._check_round_trip(self.data)
+
+    @override_settings(ENHYDRIS_CACHE_COMPRESSION="zlib")
+    def test_zlib(self):
+        self._check_round_trip(self.data)
+
+    @skipUnless(find_spec("lz4"), "lz4 is not installed")
+    @override_settings(ENHYDRIS_CACHE_COMPRESSION="lz4")
+    def test_lz4(self):
+        self._check_round_trip(self.data)
+
+    def test_empty(self):
+        self._check_round_trip(self.data.iloc[:0])
+
+    def test_many_distinct_flags(self):
+        data = pd.DataFrame(
+            data={
+                "value": [1.0] * 300,
+                "flags": pd.Categorical([f"F{i}" for i in range(300)]),
+            },
+            columns=["value", "flags"],
+            index=pd.DatetimeIndex(
+                [dt.datetime(2018, 1, 1) + dt.timedelta(hours=i) for i in range(300)],
+                name="date",
+            ),
+        )
+        self._check_round_trip(data)
+
+    def test_missing_flags(self):
+        data = self.data.copy()
+        data["flags"] = pd.Categorical([float("nan"), "MISS", None])
+        expected = self.data.copy()
+        expected["flags"] = pd.Categorical(["", "MISS", ""])
+        pd.testing.assert_frame_equal(deserialize(serialize(data)), expected)
+
+    @override_settings(ENHYDRIS_CACHE_COMPRESSION="rot13")
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            serialize(self.data)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            deserialize(b"garbage")
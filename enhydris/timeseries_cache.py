@@ -0,0 +1,386 @@
+"""Caching of time series data.
+
+The data of a time series is cached in chunks of one year (in the time zone of the time
+series), like the one-year chunks of the hypertable. This way a chunk fits in cache
+backends that have an item size limit (such as memcached), a request for a date range
+only fetches the chunks it overlaps, and a write only invalidates the chunks it touches.
+
+Besides the chunks, each time series has a directory entry, which contains the UTC
+offset the chunks are in and a random token that is part of the keys of the chunks.
+Deleting the directory entry invalidates all the chunks of the time series at once
+(they can no longer be reached and they eventually expire); the same happens if the
+UTC offset of the time series changes.
+
+Likewise, each year has a random token, which is also part of the key of its chunk,
+and a write invalidates a year by deleting its token. A process that reads a year
+from the database gets the token first, so if a write is committed meanwhile, the
+chunk it caches can't be reached, rather than staying in the cache with the data as
+it was before the write. For the same reason, writes invalidate the cache again once
+they are committed (see invalidate_on_commit()).
+
+The chunks are not stored as pickled dataframes, but in a compact binary format (see
+serialize()), optionally compressed according to ENHYDRIS_CACHE_COMPRESSION.
+"""
+import datetime as dt
+import random
+import struct
+import uuid
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+class TimeseriesCache:
+    def __init__(self, timeseries):
+        self.timeseries = timeseries
+        self.directory_key = f"timeseries_data_{timeseries.id}"
+
+    def get(self, start_date=None, end_date=None):
+        """Return the data between start_date and end_date (inclusive).
+
+        The dates are naive, in the time zone of the time series; None means no limit.
+        Chunks that are not in the cache are read from the database and cached.
+        """
+        directory = self._get_directory()
+        year_token_keys = self._get_year_token_keys(directory, start_date, end_date)
+        year_tokens = _get_year_tokens(year_token_keys, cache.get_many(year_token_keys))
+        keys = self._get_chunk_keys(directory, year_tokens)
+        return self._assemble(keys, cache.get_many(keys), start_date, end_date)
+
+    def _get_year_token_keys(self, directory, start_date, end_date):
+        """Return the cache keys of the tokens of the years between the dates.
+
+        The result is a dictionary that has the keys as keys and the years as values.
+        """
+        years = self._get_years(start_date, end_date)
+        return {self._get_year_token_key(directory, year): year for year in years}
+
+    def _get_chunk_keys(self, directory, year_tokens):
+        """Return the cache keys of the chunks of the years.
+
+        "year_tokens" is a dictionary with the years as keys and their tokens as
+        values. The result is a dictionary that has the keys as keys and the years as
+        values.
+        """
+        return {
+            f"{self.directory_key}_{directory['token']}_{year}_{year_token}": year
+            for year, year_token in year_tokens.items()
+        }
+
+    def _assemble(self, keys, cached_chunks, start_date, end_date):
+        """Return the data from the cached chunks, reading the missing ones.
+
+        "keys" is the result of _get_chunk_keys(), and "cached_chunks" is a
+        dictionary with the chunks (or some of them) found in the cache.
+        """
+        if not keys:
+            return self._get_empty_dataframe()
+        years = list(keys.values())
+        chunks = {
+            year: deserialize(cached_chunks[key])
+            for key, year in keys.items()
+            if key in cached_chunks
+        }
+        missing_years = [year for year in years if year not in chunks]
+        for first_year, last_year in _get_runs(missing_years):
+            loaded_chunks = self._load_chunks(first_year, last_year)
+            cache.set_many(
+                {
+                    key: serialize(loaded_chunks[year])
+                    for key, year in keys.items()
+                    if year in loaded_chunks
+                }
+            )
+            chunks.update(loaded_chunks)
+        data = _concat([chunks[year] for year in years])
+        return data.loc[start_date:end_date]
+
+    def invalidate(self, start_date=None, end_date=None):
+        """Invalidate the chunks between start_date and end_date.
+
+        The dates are naive, in the time zone of the time series. If they are not
+        specified, the entire time series is invalidated.
+        """
+        if start_date is None or end_date is None:
+            cache.delete(self.directory_key)
+            return
+        directory = self._check_directory(cache.get(self.directory_key))
+        if directory is None:
+            return
+        years = range(start_date.year, end_date.year + 1)
+        cache.delete_many([self._get_year_token_key(directory, y) for y in years])
+
+    def invalidate_on_commit(self, start_date=None, end_date=None):
+        """Like invalidate(), but also when the current transaction is committed.
+
+        Until the commit, another process could cache the chunks as they were
+        before the transaction.
+        """
+        self.invalidate(start_date, end_date)
+        if connection.in_atomic_block:
+            transaction.on_commit(lambda: self.invalidate(start_date, end_date))
+
+    def _check_directory(self, directory):
+        if directory is None:
+            return None
+        if directory["utc_offset"] != self.timeseries.time_zone.utc_offset:
+            return None
+        return directory
+
+    def _get_directory(self, cached_directory=None):
+        """Return the directory, creating it if needed.
+
+        If "cached_directory" is specified, it is what was found in the cache for
+        this time series (see get_many()); otherwise the cache is read.
+        """
+        if cached_directory is None:
+            cached_directory = cache.get(self.directory_key)
+        directory = self._check_directory(cached_directory)
+        if directory is None:
+            directory = {
+                "token": uuid.uuid4().hex,
+                "utc_offset": self.timeseries.time_zone.utc_offset,
+            }
+            cache.set(self.directory_key, directory)
+        return directory
+
+    def _get_years(self, start_date, end_date):
+        start = self.timeseries.start_date_naive
+        end = self.timeseries.end_date_naive
+        if start is None:
+            return []
+        first_year = start.year
+        last_year = end.year
+        if start_date:
+            first_year = max(first_year, start_date.year)
+        if end_date:
+            last_year = min(last_year, end_date.year)
+        return list(range(first_year, last_year + 1))
+
+    def _get_year_token_key(self, directory, year):
+        return f"{self.directory_key}_{directory['token']}_{year}"
+
+    def _load_chunks(self, first_year, last_year):
+        """Read the years from first_year to last_year from the database.
+
+        Returns a dictionary that has the year as key and a dataframe as value.
+        """
+        tzinfo = self.timeseries.time_zone.as_tzinfo
+        start_date = dt.datetime(first_year, 1, 1, tzinfo=tzinfo)
+        end_date = dt.datetime(last_year + 1, 1, 1, tzinfo=tzinfo)
+        data = self.timeseries._get_data_as_pd_from_db(
+            start_date, end_date - dt.timedelta(microseconds=1)
+        )
+        years = range(first_year, last_year + 1)
+        starts = data.index.searchsorted([pd.Timestamp(y, 1, 1) for y in years])
+        ends = list(starts[1:]) + [len(data)]
+        return {
+            year: data.iloc[start:end] for year, start, end in zip(years, starts, ends)
+        }
+
+    def _get_empty_dataframe(self):
+        result = pd.DataFrame(
+            {"value": np.array([], dtype=np.float64), "flags": pd.Categorical([])},
+            columns=["value", "flags"],
+            index=pd.DatetimeIndex([], name="date"),
+        )
+        return result
+
+
+def get_many(timeseries_list, dates):
+    """Return the data of many time series, like TimeseriesCache.get().
+
+    "dates" is a list with a (start_date, end_date) tuple for each time series (naive,
+    in the time zone of the time series, or None for no limit). The directories, the
+    year tokens and the chunks of all the time series are read from the cache with a
+    single cache.get_many() each; chunks that are not in the cache are read from the
+    database and cached. Returns a list of dataframes.
+    """
+    caches = [TimeseriesCache(timeseries) for timeseries in timeseries_list]
+    cached_directories = cache.get_many([c.directory_key for c in caches])
+    directories = [
+        c._get_directory(cached_directories.get(c.directory_key)) for c in caches
+    ]
+    all_year_token_keys = [
+        c._get_year_token_keys(directory, start_date, end_date)
+        for c, directory, (start_date, end_date) in zip(caches, directories, dates)
+    ]
+    cached_year_tokens = cache.get_many(
+        [key for keys in all_year_token_keys for key in keys]
+    )
+    all_keys = [
+        c._get_chunk_keys(directory, _get_year_tokens(keys, cached_year_tokens))
+        for c, directory, keys in zip(caches, directories, all_year_token_keys)
+    ]
+    cached_chunks = cache.get_many([key for keys in all_keys for key in keys])
+    return [
+        c._assemble(keys, cached_chunks, start_date, end_date)
+        for c, keys, (start_date, end_date) in zip(caches, all_keys, dates)
+    ]
+
+
+def _get_year_tokens(year_token_keys, cached_year_tokens):
+    """Return the tokens of the years, creating those that are not in the cache.
+
+    "year_token_keys" is a dictionary with cache keys as keys and years as values
+    (see TimeseriesCache._get_year_token_keys()), and "cached_year_tokens" the
+    tokens (or some of them) found in the cache. Returns a dictionary with the years
+    as keys and the tokens as values.
+    """
+    new_year_tokens = {
+        key: random.getrandbits(48)
+        for key in year_token_keys
+        if key not in cached_year_tokens
+    }
+    cache.set_many(new_year_tokens)
+    return {
+        year: cached_year_tokens.get(key, new_year_tokens.get(key))
+        for key, year in year_token_keys.items()
+    }
+
+
+def _concat(chunks):
+    """Concatenate dataframes, keeping the flags categorical.
+
+    pd.concat() would convert the flags to object if the categories of the chunks
+    differ.
+    """
+    result = pd.DataFrame(
+        {
+            "value": np.concatenate([chunk["value"].values for chunk in chunks]),
+            "flags": union_categoricals(
+                [chunk["flags"].values for chunk in chunks], sort_categories=True
+            ),
+        },
+        columns=["value", "flags"],
+        index=pd.DatetimeIndex(
+            np.concatenate([chunk.index.values for chunk in chunks]), name="date"
+        ),
+    )
+    return result
+
+
+def _get_flags_categorical(flags):
+    """Return the flags as a categorical, with missing flags (NaN or None) as ""."""
+    result = pd.Categorical(flags)
+    if (result.codes == -1).any():
+        result = pd.Categorical(pd.Series(flags, dtype=object).fillna(""))
+    return result
+
+
+def _get_runs(years):
+    """Group a sorted list of years into runs of consecutive years.
+
+    Returns a list of (first_year, last_year) tuples.
+    """
+    result = []
+    for year in years:
+        if result and result[-1][1] == year - 1:
+            result[-1] = (result[-1][0], year)
+        else:
+            result.append((year, year))
+    return result
+
+
+# Serialized chunk: magic, format version, compression ("n" for none, "z" for zlib,
+# "l" for lz4), followed by the (possibly compressed) body.
+_PREFIX = struct.Struct("<4sBc")
+_MAGIC = b"EHTS"
+_VERSION = 1
+
+# Body: number of records, number of distinct flags, length of the encoded flags, size
+# in bytes of each flags code; then the distinct flags (UTF-8, separated by NUL), the
+# timestamps, the values and the flags codes.
+_BODY_HEADER = struct.Struct("<QIIB")
+
+
+def serialize(data):
+    """Return a dataframe like those returned by TimeseriesCache.get() as bytes.
+
+    The timestamps are stored as int64 nanoseconds since the epoch (the first one as
+    is and the rest as differences from the previous one, which compresses very well
+    for time series with a time step), the values as float64, and the flags as the
+    codes and categories of a categorical.
+    """
+    timestamps = data.index.values.view(np.int64)
+    if len(timestamps):
+        timestamps = np.concatenate((timestamps[:1], np.diff(timestamps)))
+    categorical_flags = _get_flags_categorical(data["flags"].values)
+    flags = categorical_flags.categories
+    codes = categorical_flags.codes.astype(_get_codes_dtype(len(flags)))
+    encoded_flags = "\0".join(flags).encode()
+    body = b"".join(
+        [
+            _BODY_HEADER.pack(
+                len(data), len(flags), len(encoded_flags), codes.dtype.itemsize
+            ),
+            encoded_flags,
+            timestamps.astype("<i8").tobytes(),
+            data["value"].values.astype("<f8").tobytes(),
+            codes.tobytes(),
+        ]
+    )
+    compression = settings.ENHYDRIS_CACHE_COMPRESSION
+    if compression is None:
+        return _PREFIX.pack(_MAGIC, _VERSION, b"n") + body
+    elif compression == "zlib":
+        return _PREFIX.pack(_MAGIC, _VERSION, b"z") + zlib.compress(body, 1)
+    elif compression == "lz4":
+        import lz4.frame
+
+        return _PREFIX.pack(_MAGIC, _VERSION, b"l") + lz4.frame.compress(body)
+    raise ValueError(f'Unknown ENHYDRIS_CACHE_COMPRESSION "{compression}"')
+
+
+def deserialize(serialized):
+    """Return a dataframe from the result of serialize()."""
+    magic, version, compression = _PREFIX.unpack_from(serialized)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError("Unknown serialization format of cached time series data")
+    prefix_size = _PREFIX.size
+    body = memoryview(serialized)[prefix_size:]
+    if compression == b"z":
+        body = zlib.decompress(body)
+    elif compression == b"l":
+        import lz4.frame
+
+        body = lz4.frame.decompress(body)
+    nrecords, nflags, encoded_flags_length, codes_itemsize = _BODY_HEADER.unpack_from(
+        body
+    )
+    offset = _BODY_HEADER.size
+    flags_end = offset + encoded_flags_length
+    encoded_flags = bytes(body[offset:flags_end])
+    flags = encoded_flags.decode().split("\0") if nflags else []
+    offset = flags_end
+    timestamps = np.frombuffer(body, dtype="<i8", count=nrecords, offset=offset)
+    offset += timestamps.nbytes
+    values = np.frombuffer(body, dtype="<f8", count=nrecords, offset=offset)
+    offset += values.nbytes
+    codes = np.frombuffer(
+        body, dtype=f"<u{codes_itemsize}", count=nrecords, offset=offset
+    )
+    result = pd.DataFrame(
+        {
+            "value": values.astype(np.float64),
+            "flags": pd.Categorical.from_codes(codes, categories=flags),
+        },
+        columns=["value", "flags"],
+        index=pd.DatetimeIndex(
+            np.cumsum(timestamps).view("datetime64[ns]"), name="date"
+        ),
+    )
+    return result
+
+
+def _get_codes_dtype(nflags):
+    for dtype in (np.uint8, np.uint16):
+        if nflags <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint32
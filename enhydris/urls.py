@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.urls import include, path
 from django.views.generic import RedirectView, View
 
-from enhydris import views, views_old
+from enhydris import views
 from enhydris.api import urls as enhydris_api_urls
 
 admin.autodiscover()
@@ -29,8 +29,6 @@ urlpatterns = [
         RedirectView.as_view(pattern_name="station_detail", permanent=True),
     ),
     path("timeseries/d/<int:pk>/", views.OldTimeseriesDetailRedirectView.as_view()),
-    # For the following, see ticket #181
-    path("timeseries/data/", views_old.timeseries_data, name="timeseries_data"),
     path("_nested_admin/", include("nested_admin.urls")),
 ]
 
@@ -53,7 +53,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
-    "django.middleware.gzip.GZipMiddleware",
+    "enhydris.middleware.CompressionMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.contrib.flatpages.middleware.FlatpageFallbackMiddleware",
 ]
@@ -143,11 +143,15 @@ ENHYDRIS_MAP_MARKERS = {"0": "images/drop_marker.png"}
 ENHYDRIS_MAP_MIN_VIEWPORT_SIZE = 0.04
 ENHYDRIS_MAP_DEFAULT_VIEWPORT = (19.3, 34.75, 29.65, 41.8)
 ENHYDRIS_TIMESERIES_DATA_DIR = "timeseries_data"
-ENHYDRIS_TS_GRAPH_BIG_STEP_DENOMINATOR = 200
-ENHYDRIS_TS_GRAPH_FINE_STEP_DENOMINATOR = 50
 ENHYDRIS_SITE_STATION_FILTER = {}
 ENHYDRIS_DISPLAY_COPYRIGHT_INFO = False
 ENHYDRIS_CELERY_SEND_TASK_ERROR_EMAILS = True
+ENHYDRIS_CACHE_COMPRESSION = "zlib"
+ENHYDRIS_CONTINUOUS_AGGREGATES = []
+ENHYDRIS_COMPRESS_AFTER = None
+ENHYDRIS_CHUNK_TIME_INTERVAL = "1 year"
+ENHYDRIS_CHUNK_SPACE_PARTITIONS = 1
+ENHYDRIS_RESPONSE_COMPRESSION = {"zstd": 3, "gzip": 6}
 
 if os.environ.get("SELENIUM_BROWSER", False):
     from selenium import webdriver